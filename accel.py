@@ -0,0 +1,97 @@
+import os
+import numpy as np
+
+# Optional Numba backend for the hot per-cell / per-row loops:
+#   - percentage ranks per cell (qdm_engine.pct_rank)
+#   - Schaake reorder per time step (schaake_shuffle.schaake_reorder)
+# Both are independent across cells / rows, so the kernels run them in parallel with
+# prange on all cores and without the full-size sort/index temporaries of the NumPy path.
+#
+# Select per run with --backend (numpy | numba | auto) or MQDM_BACKEND. 'auto' uses Numba
+# if it is installed. The NumPy implementations stay the reference and the fallback.
+# Both kernels give results identical to the NumPy path, including ties: the reorder
+# uses a stable sort of the template in both backends.
+
+BACKENDS = ('numpy', 'numba', 'auto')
+BACKEND = os.environ.get('MQDM_BACKEND', 'numpy')
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+
+def configure(backend=None, threads=None):
+    global BACKEND
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == 'numba' and not NUMBA_AVAILABLE:
+            raise ValueError("The numba backend was requested but numba is not installed")
+        BACKEND = backend
+        # Inherited by worker processes (mqdm_daily_shift --workers)
+        os.environ['MQDM_BACKEND'] = backend
+    if threads is not None and NUMBA_AVAILABLE:
+        numba.set_num_threads(threads)
+
+
+def use_numba():
+    return NUMBA_AVAILABLE and BACKEND in ('numba', 'auto')
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(parallel=True, cache=True)
+    def _pct_rank_columns(data):
+        # pct ranks of every column of a (n, m) array, average ranks for ties, NaN ignored
+        n, m = data.shape
+        out = np.full((n, m), np.nan)
+        for j in numba.prange(m):
+            col = data[:, j]
+            valid = np.flatnonzero(~np.isnan(col))
+            n_valid = valid.size
+            if n_valid == 0:
+                continue
+            vals = col[valid]
+            order = np.argsort(vals, kind='mergesort')
+            start = 0
+            while start < n_valid:
+                stop = start + 1
+                while stop < n_valid and vals[order[stop]] == vals[order[start]]:
+                    stop += 1
+                pct = ((start + stop - 1) / 2.0 + 1.0) / n_valid
+                for k in range(start, stop):
+                    out[valid[order[k]], j] = pct
+                start = stop
+        return out
+
+    @numba.njit(parallel=True, cache=True)
+    def _schaake_rows(template, values):
+        # Row t of the output: sorted values of row t placed in the rank order of template[t]
+        n_rows, n_cols = values.shape
+        out = np.empty_like(values)
+        for t in numba.prange(n_rows):
+            sorted_values = np.sort(values[t])
+            order = np.argsort(template[t], kind='mergesort')   # stable, like kind='stable' in NumPy
+            for k in range(n_cols):
+                out[t, order[k]] = sorted_values[k]
+        return out
+
+
+def pct_rank(data, axis=0):
+    # Numba pct ranks along `axis` (see qdm_engine.pct_rank)
+    data = np.moveaxis(np.asarray(data, dtype='float64'), axis, 0)
+    flat = np.ascontiguousarray(data.reshape(data.shape[0], -1))
+    ranks = _pct_rank_columns(flat).reshape(data.shape)
+    return np.moveaxis(ranks, 0, axis)
+
+
+def schaake_reorder(template, values, axis=-1):
+    # Numba Schaake reorder along `axis` (see schaake_shuffle.schaake_reorder)
+    values = np.moveaxis(np.asarray(values), axis, -1)
+    template = np.moveaxis(np.asarray(template), axis, -1)
+    shape = values.shape
+    out = _schaake_rows(np.ascontiguousarray(template.reshape(-1, shape[-1])),
+                        np.ascontiguousarray(values.reshape(-1, shape[-1])))
+    return np.moveaxis(out.reshape(shape), -1, axis)
@@ -0,0 +1,110 @@
+import os
+import json
+import numpy as np
+
+import storage
+
+# Precomputed diurnal shape factor alpha = (T - Tmin) / (Tmax - Tmin) of era5_clean.
+# Alpha only depends on the ERA5 history, so it is computed once and reused by every
+# reconstruction (scenarios, ensemble members) until era5_clean changes.
+#
+# Stored next to era5_clean as a memory-mappable .npy of uint16 (time, lat, lon):
+#   0 .. ALPHA_SCALE    alpha quantized on [0, 1] (error <= 0.5 / ALPHA_SCALE, i.e.
+#                       < 0.001 C for a 100 C diurnal range)
+#   ZERO_DTR            flag: zero diurnal range (or missing data); alpha is taken as 0,
+#                       like diurnal_alpha's fillna(0)
+# plus a small .json with the source fingerprint, dims and shape. A quarter of the
+# float64 size; readers map only the hours they touch.
+
+ALPHA_SCALE = 65534
+ZERO_DTR = 65535
+
+
+def store_paths(obs_path):
+    base = os.path.splitext(obs_path.rstrip('/'))[0]
+    return base + '_alpha.npy', base + '_alpha.json'
+
+
+def quantize(alpha, out=None):
+    # float alpha (NaN = undefined) -> uint16 codes
+    alpha = np.asarray(alpha)
+    undefined = ~np.isfinite(alpha)
+    codes = np.rint(np.clip(np.nan_to_num(alpha), 0, 1) * ALPHA_SCALE).astype('uint16')
+    codes[undefined] = ZERO_DTR
+    if out is not None:
+        out[...] = codes
+        return out
+    return codes
+
+
+def dequantize(codes, dtype='float32'):
+    # uint16 codes -> alpha (0 where flagged)
+    alpha = np.multiply(codes, 1.0 / ALPHA_SCALE, dtype=dtype)
+    alpha[codes == ZERO_DTR] = 0
+    return alpha
+
+
+def _alpha_block(temp, time_name):
+    # Unquantized alpha of a block of whole days, NaN where the diurnal range is zero
+    from daily_extremes import daily_extremes
+    daily = daily_extremes(temp, time_name)
+    hours = temp[time_name]
+    tmax = daily['tmax'].reindex({time_name: hours}, method='ffill').values
+    tmin = daily['tmin'].reindex({time_name: hours}, method='ffill').values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dtr = tmax - tmin
+        dtr[dtr == 0] = np.nan
+        return (temp.values - tmin) / dtr
+
+
+def build_alpha_store(obs_path=None):
+    obs_path = obs_path or storage.artifact_path('era5_clean')
+    npy_path, meta_path = store_paths(obs_path)
+    ds_obs = storage.open_dataset(obs_path)
+    time_name = 'valid_time' if 'valid_time' in ds_obs.dims else 'time'
+    temp = ds_obs['temp_hourly'].transpose(time_name, ...)
+
+    print(f"Building alpha store {npy_path}...")
+    tmp_path = npy_path + '.part.npy'
+    codes = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='uint16', shape=temp.shape)
+    # One year at a time (whole days) keeps the float working set small
+    years = temp[time_name].values.astype('datetime64[Y]')
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    stops = np.r_[starts[1:], years.size]
+    for start, stop in zip(starts, stops):
+        quantize(_alpha_block(temp.isel({time_name: slice(start, stop)}), time_name), out=codes[start:stop])
+    codes.flush()
+    del codes
+    os.replace(tmp_path, npy_path)
+
+    meta = {
+        'source': os.path.abspath(obs_path),
+        'fingerprint': list(storage.file_fingerprint(obs_path)),
+        'dims': list(temp.dims),
+        'shape': list(temp.shape),
+        'scale': ALPHA_SCALE,
+        'zero_dtr': ZERO_DTR,
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return npy_path
+
+
+def is_current(obs_path):
+    npy_path, meta_path = store_paths(obs_path)
+    if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return (meta.get('fingerprint') == list(storage.file_fingerprint(obs_path))
+            and meta.get('scale') == ALPHA_SCALE)
+
+
+def load_alpha(obs_path=None):
+    # Memory-mapped uint16 alpha codes (time, lat, lon) of obs_path; (re)built if
+    # missing or older than obs_path.
+    obs_path = obs_path or storage.artifact_path('era5_clean')
+    if not is_current(obs_path):
+        build_alpha_store(obs_path)
+    npy_path, _ = store_paths(obs_path)
+    return np.load(npy_path, mmap_mode='r')
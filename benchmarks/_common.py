@@ -0,0 +1,24 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# Shared setup of the benchmark scripts. Importing this module puts the repository
+# root on sys.path, so the pipeline modules import when a script is run as
+# python benchmarks/<script>.py.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+
+def timed(fn, *args, repeat=3):
+    # Best wall time over `repeat` calls, and the result of the last call
+    best = np.inf
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
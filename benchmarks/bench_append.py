@@ -0,0 +1,86 @@
+import xarray as xr
+import numpy as np
+import glob
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+from _common import BASE_DIR
+
+# Check + benchmark: pipeline --append vs a full recompute.
+# Builds two scratch working directories linked to the real inputs:
+#   full:   all ERA5 months, full pipeline run
+#   append: all but the last month, full run, then the last month added and --append run
+# The outputs must be identical (NaN where NaN), and the time of the --append run is
+# compared with the full run.
+# Run from anywhere: python benchmarks/bench_append.py
+
+OUTPUTS = {
+    'era5_clean': 'temp_hourly',
+    'era5_future_daily': 'tmax_shifted',
+    'era5_future_hourly': 'temp_future',
+    'era5_spatially_coherent': 'temp_coherent',
+}
+STAGES = ['merge', 'mqdm', 'reconstruct', 'schaake']
+
+
+def link_inputs(workdir, era5_files):
+    os.makedirs(os.path.join(workdir, 'data/raw'))
+    for name in ['cmip6_hist_clean.nc', 'cmip6_clean.nc']:
+        os.symlink(os.path.join(BASE_DIR, name), os.path.join(workdir, name))
+    for f in era5_files:
+        os.symlink(f, os.path.join(workdir, 'data/raw', os.path.basename(f)))
+
+
+def run_pipeline(workdir, *args):
+    env = dict(os.environ, PYTHONPATH=BASE_DIR)
+    cmd = [sys.executable, os.path.join(BASE_DIR, 'pipeline.py'), '--only'] + STAGES + list(args)
+    t0 = time.perf_counter()
+    subprocess.run(cmd, cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+
+def main():
+    era5_files = sorted(glob.glob(os.path.join(BASE_DIR, 'data/raw/era5_2m_temperature_*.nc')))
+    if len(era5_files) < 2:
+        print("Need at least two monthly ERA5 files in data/raw/.")
+        return
+
+    scratch = tempfile.mkdtemp(prefix='bench_append_')
+    try:
+        full_dir = os.path.join(scratch, 'full')
+        append_dir = os.path.join(scratch, 'append')
+        link_inputs(full_dir, era5_files)
+        link_inputs(append_dir, era5_files[:-1])
+
+        print(f"Full run over {len(era5_files)} months...")
+        t_full = run_pipeline(full_dir, '--force')
+
+        print(f"Initial run over {len(era5_files) - 1} months...")
+        run_pipeline(append_dir, '--force')
+        os.symlink(era5_files[-1], os.path.join(append_dir, 'data/raw', os.path.basename(era5_files[-1])))
+        print(f"Appending {os.path.basename(era5_files[-1])}...")
+        t_append = run_pipeline(append_dir, '--force', '--append')
+
+        print(f"\n{'output':<26} {'steps':>8} {'max abs diff':>14}")
+        for name, var in OUTPUTS.items():
+            path = name + '.nc'
+            with xr.open_dataset(os.path.join(full_dir, path)) as ds_full, \
+                 xr.open_dataset(os.path.join(append_dir, path)) as ds_app:
+                a = ds_full[var].values
+                b = ds_app[var].values
+                assert a.shape == b.shape, f"{name}: shape {b.shape} != {a.shape}"
+                np.testing.assert_array_equal(b, a, err_msg=name)
+                print(f"{name:<26} {a.shape[0]:>8} {np.nanmax(np.abs(a - b)):>14.2e}")
+
+        print(f"\nFull recompute: {t_full:8.2f} s")
+        print(f"--append:       {t_append:8.2f} s  ({t_full / t_append:.1f}x)")
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+import sys
+
+from _common import timed
+
+import accel
+from qdm_engine import pct_rank
+from schaake_shuffle import schaake_reorder
+
+# Check + benchmark: NumPy vs Numba backends (accel.py) for the per-cell ranking and
+# the per-time-step Schaake reorder. Outputs must be identical, also for tied values.
+# Run: python benchmarks/bench_backends.py   (requires numba for the second column)
+
+RANK_SHAPE = (31 * 30, 64, 64)      # one calendar month over 30 years, 64x64 cells
+REORDER_SHAPE = (8760, 1024)        # one year of hours, 32x32 cells
+
+
+def run(backend, fn, *args):
+    accel.configure(backend)
+    fn(*args)  # warm-up (Numba compiles on first call)
+    return timed(fn, *args)
+
+
+if __name__ == '__main__':
+    if not accel.NUMBA_AVAILABLE:
+        print("numba is not installed; only the NumPy backend is available.")
+        sys.exit(0)
+
+    rng = np.random.default_rng(0)
+    daily = np.round(rng.normal(30, 4, RANK_SHAPE), 1)   # rounded: many ties
+    daily[::97, 3, 5] = np.nan
+    # Packed int16-like template: many tied cells in every row
+    template = np.round(rng.normal(size=REORDER_SHAPE), 1)
+    values = rng.normal(size=REORDER_SHAPE)
+
+    print(f"{'kernel':<16} {'numpy':>9} {'numba':>9} {'speedup':>8}")
+    for name, fn, args in [('pct_rank', pct_rank, (daily, 0)),
+                           ('schaake_reorder', schaake_reorder, (template, values, 1))]:
+        t_np, out_np = run('numpy', fn, *args)
+        t_nb, out_nb = run('numba', fn, *args)
+        assert np.array_equal(out_np, out_nb, equal_nan=True), f"{name}: backends differ"
+        print(f"{name:<16} {t_np:8.3f}s {t_nb:8.3f}s {t_np / t_nb:7.1f}x")
+    print(f"\nIdentical outputs ({accel.numba.get_num_threads()} Numba threads).")
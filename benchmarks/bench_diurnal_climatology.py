@@ -0,0 +1,55 @@
+import xarray as xr
+import numpy as np
+
+from _common import timed
+
+from diurnal_climatology import compute_climatology, hourly_cycle
+
+# Check + benchmark of the (month, hour, lat, lon) diurnal climatology (diurnal_climatology.py):
+#   - the reshape path (regular hourly axis) and the indexed fallback (axis with a gap)
+#     both match xarray's groupby over month and hour
+#   - the collapsed hourly cycle matches groupby('valid_time.hour').mean(dim=xr.ALL_DIMS)
+# Run: python benchmarks/bench_diurnal_climatology.py
+
+YEARS = 4
+SHAPE = (24 * 365 * YEARS + 24, 32, 32)   # one leap day
+
+
+def make_field(n_steps, start='2000-01-01T00'):
+    rng = np.random.default_rng(0)
+    times = np.datetime64(start) + np.arange(n_steps).astype('timedelta64[h]')
+    hours = times.astype('int64') % 24
+    months = times.astype('datetime64[M]').astype('int64') % 12
+    cycle = 6 * np.sin(2 * np.pi * (hours - 9) / 24) + 8 * np.cos(2 * np.pi * (months - 6) / 12)
+    values = 12 + cycle[:, np.newaxis, np.newaxis] + rng.normal(0, 2, (n_steps,) + SHAPE[1:])
+    values[::131, 4, 9] = np.nan
+    return xr.DataArray(values, dims=('valid_time', 'latitude', 'longitude'),
+                        coords={'valid_time': times.astype('datetime64[ns]'),
+                                'latitude': np.linspace(60, 40, SHAPE[1]),
+                                'longitude': np.linspace(-10, 20, SHAPE[2])}, name='temp_hourly')
+
+
+def groupby_climatology(da):
+    month_hour = da['valid_time'].dt.month * 100 + da['valid_time'].dt.hour
+    clim = da.groupby(month_hour.rename('month_hour')).mean('valid_time')
+    return clim.values.reshape((12, 24) + da.shape[1:])
+
+
+if __name__ == '__main__':
+    da = make_field(SHAPE[0])
+    # Drop 5 steps in the middle: that year takes the indexed fallback
+    gappy = xr.concat([da.isel(valid_time=slice(0, 10000)), da.isel(valid_time=slice(10005, None))],
+                      dim='valid_time')
+    print(f"Field: {SHAPE} ({da.size / 1e6:.1f} M values)\n")
+
+    print(f"{'axis':<10} {'groupby':>9} {'climatology':>12} {'speedup':>8}")
+    for name, field in [('regular', da), ('with gap', gappy)]:
+        t_ref, ref = timed(groupby_climatology, field)
+        t_new, clim = timed(compute_climatology, field)
+        np.testing.assert_allclose(clim['mean'].values, ref, rtol=0, atol=1e-4)
+        print(f"{name:<10} {t_ref:8.3f}s {t_new:11.3f}s {t_ref / t_new:7.1f}x")
+
+    clim = compute_climatology(da)
+    expected = da.groupby('valid_time.hour').mean(dim=xr.ALL_DIMS).values
+    np.testing.assert_allclose(hourly_cycle(clim).values, expected, rtol=0, atol=1e-4)
+    print("\nClimatologies match groupby (float32 cache precision).")
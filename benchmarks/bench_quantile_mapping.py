@@ -0,0 +1,77 @@
+import xarray as xr
+import numpy as np
+
+from _common import timed
+
+from quantile_mapping import quantile_grid, map_quantiles
+
+# Check + benchmark of the quantile-mapping kernel (quantile_mapping.py):
+#   - tail='nan' matches the original xarray delta.interp(quantile=ranks)
+#   - tail='clamp' matches np.interp; tail='extrapolate' continues the end intervals
+#   - speed vs xarray .interp for the default 99 levels and a 1000-level grid
+# Run: python benchmarks/bench_quantile_mapping.py
+
+SHAPE = (3000, 32, 32)   # ~8 years of days x 32x32 cells
+GRIDS = [99, 1000]
+
+
+def random_ranks(shape, seed=0):
+    # pct ranks in (0, 1], a few exactly on the grid ends and some NaN
+    rng = np.random.default_rng(seed)
+    ranks = rng.uniform(0, 1, shape)
+    flat = ranks.reshape(-1)
+    flat[::997] = 0.01
+    flat[1::997] = 0.99
+    flat[2::1009] = np.nan
+    return ranks
+
+
+def delta_curve(quantiles):
+    # Smooth, monotone delta curve like a CMIP6 warming signal
+    return 1.5 + 2.0 * quantiles ** 2
+
+
+def legacy_interp(ranks, quantiles, curve):
+    delta = xr.DataArray(curve, coords={'quantile': quantiles}, dims='quantile')
+    ranks_da = xr.DataArray(ranks, dims=('time', 'lat', 'lon'))
+    return delta.interp(quantile=ranks_da, method='linear').values
+
+
+def check_tails(ranks, quantiles, curve):
+    flat = ranks.ravel()
+    out_nan = map_quantiles(ranks, quantiles, curve, 'nan')
+    expected = np.interp(flat, quantiles, curve, left=np.nan, right=np.nan).reshape(ranks.shape)
+    np.testing.assert_allclose(out_nan, expected, rtol=0, atol=1e-12)
+
+    out_clamp = map_quantiles(ranks, quantiles, curve, 'clamp')
+    expected = np.interp(flat, quantiles, curve).reshape(ranks.shape)
+    expected[np.isnan(ranks)] = np.nan
+    np.testing.assert_allclose(out_clamp, expected, rtol=0, atol=1e-12)
+
+    out_extra = map_quantiles(ranks, quantiles, curve, 'extrapolate')
+    inside = (ranks >= quantiles[0]) & (ranks <= quantiles[-1])
+    np.testing.assert_allclose(out_extra[inside], out_nan[inside], rtol=0, atol=1e-12)
+    below = ranks < quantiles[0]
+    slope = (curve[1] - curve[0]) / (quantiles[1] - quantiles[0])
+    np.testing.assert_allclose(out_extra[below], curve[0] + slope * (ranks[below] - quantiles[0]),
+                               rtol=0, atol=1e-12)
+    above = ranks > quantiles[-1]
+    slope = (curve[-1] - curve[-2]) / (quantiles[-1] - quantiles[-2])
+    np.testing.assert_allclose(out_extra[above], curve[-1] + slope * (ranks[above] - quantiles[-1]),
+                               rtol=0, atol=1e-12)
+
+
+if __name__ == '__main__':
+    ranks = random_ranks(SHAPE)
+    print(f"Ranks: {SHAPE} ({ranks.size / 1e6:.1f} M values)\n")
+    print(f"{'levels':>7} {'xarray .interp':>15} {'kernel':>10} {'speedup':>8}")
+    for n in GRIDS:
+        quantiles = quantile_grid(n)
+        curve = delta_curve(quantiles)
+
+        t_legacy, legacy = timed(legacy_interp, ranks, quantiles, curve, repeat=1)
+        t_kernel, kernel = timed(map_quantiles, ranks, quantiles, curve)
+        np.testing.assert_allclose(kernel, legacy, rtol=0, atol=1e-10, equal_nan=True)
+        check_tails(ranks, quantiles, curve)
+        print(f"{n:>7} {t_legacy:14.3f}s {t_kernel:9.3f}s {t_legacy / t_kernel:7.1f}x")
+    print("\nAll tail modes match their references.")
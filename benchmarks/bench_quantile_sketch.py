@@ -0,0 +1,79 @@
+import numpy as np
+import os
+import tempfile
+import time
+
+import _common  # repository root on sys.path
+
+from quantile_sketch import QuantileSketch
+
+# Check + benchmark of the KLL quantile sketch (quantile_sketch.py):
+#   - rank error of streamed and merged sketches stays within error_bound()
+#   - exact mode equals np.quantile
+#   - save / load round trip gives the same quantiles
+#   - speed vs np.quantile on the flattened array
+# Run: python benchmarks/bench_quantile_sketch.py
+
+N_VALUES = 20_000_000
+CHUNK = 744 * 1024          # one month of hours over 32x32 cells
+QUANTILES = np.linspace(0.01, 0.99, 100)
+
+
+def streamed(values, exact=False):
+    sketch = QuantileSketch(exact=exact)
+    for start in range(0, values.size, CHUNK):
+        sketch.update(values[start:start + CHUNK])
+    return sketch
+
+
+def merged(values, parts=4):
+    # e.g. workers or cell partitions, each with its own sketch
+    sketches = [streamed(part) for part in np.array_split(values, parts)]
+    for other in sketches[1:]:
+        sketches[0].merge(other)
+    return sketches[0]
+
+
+def max_rank_error(sketch, sorted_values):
+    estimates = sketch.quantile(QUANTILES)
+    ranks = np.searchsorted(sorted_values, estimates, side='right') / sorted_values.size
+    return np.max(np.abs(ranks - QUANTILES))
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(12, 8, N_VALUES // 2), rng.gamma(2, 4, N_VALUES // 2) + 20])
+    rng.shuffle(values)
+    values[::1013] = np.nan
+    print(f"Values: {values.size / 1e6:.0f} M, chunks of {CHUNK}\n")
+
+    t0 = time.perf_counter()
+    sketch = streamed(values)
+    t_sketch = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    q_exact = np.quantile(values[~np.isnan(values)], QUANTILES)
+    t_exact = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    q_sketch = sketch.quantile(QUANTILES)
+    t_query = time.perf_counter() - t0
+
+    sorted_values = np.sort(values[~np.isnan(values)])
+    bound = sketch.error_bound()
+    for name, s in [('streamed', sketch), ('merged', merged(values))]:
+        err = max_rank_error(s, sorted_values)
+        assert err <= bound, f"{name}: rank error {err:.4f} exceeds bound {bound:.4f}"
+        print(f"{name:<9} max rank error {err:.4%} (bound {bound:.2%}), {s.num_retained()} items kept")
+
+    exact = streamed(values, exact=True)
+    np.testing.assert_array_equal(exact.quantile(QUANTILES), q_exact)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sketch.npz')
+        sketch.save(path)
+        np.testing.assert_array_equal(QuantileSketch.load(path).quantile(QUANTILES), q_sketch)
+
+    print(f"\n{'np.quantile (flattened)':<26} {t_exact:7.3f}s")
+    print(f"{'sketch build (streamed)':<26} {t_sketch:7.3f}s")
+    print(f"{'sketch query (100 q)':<26} {t_query * 1e3:7.2f}ms")
+    print(f"Max |sketch - exact| value error: {np.max(np.abs(q_sketch - q_exact)):.4f}")
+    print("Exact mode matches np.quantile; save/load round trip is identical.")
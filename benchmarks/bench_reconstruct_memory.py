@@ -0,0 +1,84 @@
+import xarray as xr
+import numpy as np
+import sys
+import time
+import resource
+import tracemalloc
+import subprocess
+
+import _common  # repository root on sys.path
+
+from daily_extremes import daily_extremes
+from reconstruct_hourly import compute_hourly, compute_hourly_lean
+
+# Memory benchmark: original reconstruction (hourly ffill cubes, float64) vs the lean
+# float32 in-place path on the (day, 24, lat, lon) view, on a synthetic hourly cube.
+# Reports the tracemalloc peak (NumPy allocations) and the peak RSS of a fresh process
+# per variant, and checks that both give the same temperatures (float32 tolerance).
+# Run: python benchmarks/bench_reconstruct_memory.py [n_days] [n_cells_per_side]
+
+N_DAYS = 365
+N_SIDE = 48
+VARIANTS = {'original': compute_hourly, 'lean': compute_hourly_lean}
+
+
+def synthetic_inputs(n_days, n_side, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.datetime64('2010-01-01T00', 'h') + np.arange(n_days * 24)
+    hours = np.arange(times.size) % 24
+    diurnal = 6 * np.sin(2 * np.pi * (hours - 9) / 24)[:, np.newaxis, np.newaxis]
+    temp = 25 + diurnal + rng.normal(0, 1.5, (times.size, n_side, n_side))
+    coords = {'valid_time': times.astype('datetime64[ns]'),
+              'latitude': np.linspace(20, 19, n_side), 'longitude': np.linspace(78, 79, n_side)}
+    ds_obs = xr.Dataset({'temp_hourly': (('valid_time', 'latitude', 'longitude'), temp.astype('float32'))},
+                        coords=coords)
+    obs_daily = daily_extremes(ds_obs['temp_hourly'], 'valid_time')
+    ds_fut = xr.Dataset({'tmax_shifted': obs_daily['tmax'] + 2.5, 'tmin_shifted': obs_daily['tmin'] + 1.5})
+    return ds_obs, ds_fut
+
+
+def run_variant(name, n_days, n_side):
+    ds_obs, ds_fut = synthetic_inputs(n_days, n_side)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = VARIANTS[name](ds_obs, ds_fut)['temp_future'].values
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base  # KiB on Linux
+    return out, elapsed, peak, rss
+
+
+def main():
+    n_days = int(sys.argv[1]) if len(sys.argv) > 1 else N_DAYS
+    n_side = int(sys.argv[2]) if len(sys.argv) > 2 else N_SIDE
+    input_mb = n_days * 24 * n_side * n_side * 4 / 1e6
+    print(f"Synthetic hourly cube: {n_days} days x {n_side}x{n_side} cells ({input_mb:.0f} MB float32)\n")
+
+    # Peak RSS is per process: measure each variant in a fresh interpreter
+    results = {}
+    for name in VARIANTS:
+        output = subprocess.run([sys.executable, __file__, '--variant', name, str(n_days), str(n_side)],
+                                check=True, capture_output=True, text=True).stdout.split()
+        results[name] = [float(v) for v in output[-3:]]
+
+    print(f"{'variant':<10} {'seconds':>9} {'tracemalloc peak MB':>20} {'RSS growth MB':>14}")
+    for name, (elapsed, peak, rss) in results.items():
+        print(f"{name:<10} {elapsed:9.2f} {peak / 1e6:20.0f} {rss / 1024:14.0f}")
+    ratio = results['original'][1] / results['lean'][1]
+    print(f"\nPeak allocation reduced {ratio:.1f}x (lean peak = {results['lean'][1] / 1e6 / input_mb:.1f}x the input).")
+
+    # Equality check in this process
+    a = run_variant('original', n_days, n_side)[0]
+    b = run_variant('lean', n_days, n_side)[0]
+    np.testing.assert_allclose(b, a, rtol=0, atol=1e-3)
+    print(f"Max abs difference: {np.max(np.abs(a - b)):.2e} (float32 rounding)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--variant':
+        _, elapsed, peak, rss = run_variant(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        print(elapsed, peak, rss)
+    else:
+        main()
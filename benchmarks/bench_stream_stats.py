@@ -0,0 +1,92 @@
+import numpy as np
+import time
+
+import _common  # repository root on sys.path
+
+from stream_stats import StatsAccumulator, CoMomentAccumulator, hour_of_day_mean, histogram_quantiles
+
+# Check + benchmark of the one-pass accumulators (stream_stats.py) against full-array NumPy:
+#   - per-cell mean / variance, hour-of-day means and per-cell correlation match
+#   - merging partial accumulators gives the same result as one sequential pass
+#   - histogram quantiles are within one bin width of np.quantile
+# Run: python benchmarks/bench_stream_stats.py
+
+SHAPE = (24 * 365 * 2, 16, 16)   # two years of hours, 16x16 cells
+BLOCK = 744
+
+
+def make_fields(seed=0):
+    rng = np.random.default_rng(seed)
+    hours = np.arange(SHAPE[0]) % 24
+    diurnal = 5 * np.sin(2 * np.pi * (hours - 9) / 24)[:, np.newaxis, np.newaxis]
+    hist = 15 + diurnal + rng.normal(0, 3, SHAPE)
+    fut = hist + 2.5 + rng.normal(0, 0.5, SHAPE)
+    hist[::101, 2, 3] = np.nan
+    fut[::89, 5, 7] = np.nan
+    times = np.datetime64('1990-01-01T00') + np.arange(SHAPE[0]).astype('timedelta64[h]')
+    return hist, fut, times
+
+
+def streamed(hist, fut, times, starts):
+    stats = StatsAccumulator(SHAPE[1:])
+    comoment = CoMomentAccumulator(SHAPE[1:])
+    for start in starts:
+        block = slice(start, start + BLOCK)
+        stats.add(fut[block], times[block])
+        comoment.add(fut[block], hist[block])
+    return stats, comoment
+
+
+def reference(hist, fut, times):
+    mean = np.nanmean(fut, axis=0)
+    var = np.nanvar(fut, axis=0)
+    hours = times.astype('datetime64[h]').astype('int64') % 24
+    hour_means = np.array([np.nanmean(fut[hours == h]) for h in range(24)])
+    both = ~(np.isnan(hist) | np.isnan(fut))
+    x = np.where(both, fut, np.nan)
+    y = np.where(both, hist, np.nan)
+    dx = x - np.nanmean(x, axis=0)
+    dy = y - np.nanmean(y, axis=0)
+    corr = np.nansum(dx * dy, axis=0) / np.sqrt(np.nansum(dx ** 2, axis=0) * np.nansum(dy ** 2, axis=0))
+    return mean, var, hour_means, corr
+
+
+if __name__ == '__main__':
+    hist, fut, times = make_fields()
+    starts = list(range(0, SHAPE[0], BLOCK))
+    print(f"Fields: {SHAPE} ({fut.size / 1e6:.1f} M values), {len(starts)} blocks\n")
+
+    t0 = time.perf_counter()
+    stats, comoment = streamed(hist, fut, times, starts)
+    t_stream = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    mean, var, hour_means, corr = reference(hist, fut, times)
+    t_ref = time.perf_counter() - t0
+
+    summary = stats.to_dict()
+    np.testing.assert_allclose(stats.mean, mean, rtol=0, atol=1e-10)
+    np.testing.assert_allclose(stats.m2 / stats.n, var, rtol=1e-10)
+    np.testing.assert_allclose(hour_of_day_mean(summary), hour_means, rtol=0, atol=1e-10)
+    np.testing.assert_allclose(comoment.corr(), corr, rtol=0, atol=1e-10)
+
+    # Two halves accumulated separately (e.g. two workers), then merged
+    half = len(starts) // 2
+    a_stats, a_co = streamed(hist, fut, times, starts[half:])
+    b_stats, b_co = streamed(hist, fut, times, starts[:half])
+    a_stats.merge(b_stats)
+    a_co.merge(b_co)
+    np.testing.assert_allclose(a_stats.mean, stats.mean, rtol=0, atol=1e-10)
+    np.testing.assert_allclose(a_stats.m2, stats.m2, rtol=1e-10)
+    np.testing.assert_array_equal(a_stats.hist, stats.hist)
+    np.testing.assert_allclose(a_co.corr(), comoment.corr(), rtol=0, atol=1e-10)
+
+    quantiles = np.linspace(0.01, 0.99, 100)
+    q_exact = np.nanquantile(fut, quantiles)
+    q_hist = histogram_quantiles(summary, quantiles)
+    bin_width = np.diff(summary['edges']).max()
+    assert np.abs(q_hist - q_exact).max() <= bin_width, "histogram quantiles off by more than one bin"
+
+    print(f"{'one-pass accumulators':<24} {t_stream:7.3f}s")
+    print(f"{'full-array numpy':<24} {t_ref:7.3f}s")
+    print(f"\nMax quantile error {np.abs(q_hist - q_exact).max():.4f} (bin width {bin_width:.2f}).")
+    print("Streamed, merged and full-array statistics match.")
@@ -0,0 +1,74 @@
+import xarray as xr
+import numpy as np
+import time
+
+import _common  # repository root on sys.path
+
+from taylor_stats import taylor_time_series, pooled
+
+# Check + benchmark of the per-time-step Taylor statistics (taylor_stats.py):
+#   - every step matches the original single-snapshot computation of
+#     paper_plots/generate_taylor_diagram.py (np.std, centered RMSD, np.corrcoef)
+#   - the pooled point satisfies crmsd^2 = s_ref^2 + s^2 - 2 s_ref s R
+#   - timing for a full multi-decade hourly record
+# Run: python benchmarks/bench_taylor_stats.py
+
+SHAPE = (24 * 365 * 12, 24, 24)   # 12 years of hours (~105k steps), 24x24 cells
+CHECK_STEPS = [0, 1, 5000, 77777, SHAPE[0] - 1]
+
+
+def make_fields():
+    rng = np.random.default_rng(0)
+    times = np.datetime64('1990-01-01T00') + np.arange(SHAPE[0]).astype('timedelta64[h]')
+    coords = {'valid_time': times.astype('datetime64[ns]')}
+    ref = rng.normal(15, 4, SHAPE).astype('float32')
+    before = (ref + rng.normal(2, 3, SHAPE)).astype('float32')
+    after = (ref + rng.normal(2, 0.5, SHAPE)).astype('float32')
+    ref[::97, 3, 3] = np.nan
+    after[::53, 7, 1] = np.nan
+    dims = ('valid_time', 'latitude', 'longitude')
+    return {name: xr.DataArray(values, dims=dims, coords=coords)
+            for name, values in [('ref', ref), ('before', before), ('after', after)]}
+
+
+def snapshot(ref, before, after, time_idx):
+    # The original per-snapshot code of generate_taylor_diagram.py
+    ref_vals = ref[time_idx].ravel().astype('float64')
+    before_vals = before[time_idx].ravel().astype('float64')
+    after_vals = after[time_idx].ravel().astype('float64')
+    valid = ~np.isnan(ref_vals) & ~np.isnan(before_vals) & ~np.isnan(after_vals)
+    ref_anom = ref_vals[valid] - ref_vals[valid].mean()
+    out = {'sdev_ref': np.std(ref_anom)}
+    for label, vals in [('before', before_vals), ('after', after_vals)]:
+        anom = vals[valid] - vals[valid].mean()
+        out[f'sdev_{label}'] = np.std(anom)
+        out[f'crmsd_{label}'] = np.sqrt(np.mean((anom - ref_anom) ** 2))
+        out[f'corr_{label}'] = np.corrcoef(ref_anom, anom)[0, 1]
+    return out
+
+
+if __name__ == '__main__':
+    fields = make_fields()
+    print(f"Fields: {SHAPE} ({fields['ref'].size / 1e6:.0f} M values each)\n")
+
+    t0 = time.perf_counter()
+    ds_stats = taylor_time_series(fields['ref'], {'before': fields['before'], 'after': fields['after']})
+    elapsed = time.perf_counter() - t0
+
+    values = {name: da.values for name, da in fields.items()}
+    for time_idx in CHECK_STEPS:
+        expected = snapshot(values['ref'], values['before'], values['after'], time_idx)
+        for key, value in expected.items():
+            np.testing.assert_allclose(ds_stats[key].values[time_idx], value, rtol=1e-9, atol=1e-9)
+
+    point = pooled(ds_stats, ['before', 'after'])
+    for label in ['before', 'after']:
+        lhs = point[f'crmsd_{label}'] ** 2
+        rhs = (point['sdev_ref'] ** 2 + point[f'sdev_{label}'] ** 2
+               - 2 * point['sdev_ref'] * point[f'sdev_{label}'] * point[f'corr_{label}'])
+        np.testing.assert_allclose(lhs, rhs, rtol=1e-9)
+        print(f"{label:<7} pooled corr {point[f'corr_{label}']:.4f}, "
+              f"median per-step corr {np.nanmedian(ds_stats[f'corr_{label}'].values):.4f}")
+
+    print(f"\nAll {SHAPE[0]} time steps in {elapsed:.2f}s; "
+          f"{len(CHECK_STEPS)} checked steps match the snapshot computation.")
@@ -0,0 +1,95 @@
+import xarray as xr
+import numpy as np
+
+HOURS_PER_DAY = 24
+
+
+def get_time_name(ds):
+    # ERA5 usually has 'valid_time'. We'll use the coordinate name present.
+    return 'valid_time' if 'valid_time' in ds.coords else 'time'
+
+
+def is_regular_hourly(times):
+    # A "regular" hourly axis is one we can reshape to (day, 24) without any gaps:
+    # it starts at midnight, covers whole days and is spaced exactly 1 hour apart.
+    times = np.asarray(times, dtype='datetime64[ns]')
+    if times.size == 0 or times.size % HOURS_PER_DAY != 0:
+        return False
+    if times[0] != times[0].astype('datetime64[D]'):
+        return False
+    steps = np.diff(times)
+    return bool(np.all(steps == np.timedelta64(1, 'h')))
+
+
+def daily_view(values, times):
+    # Reshape an hourly (time, ...) array to (day, 24, ...) without copying.
+    # Returns (view, day_times) or (None, None) if the axis is not regular.
+    times = np.asarray(times, dtype='datetime64[ns]')
+    if not is_regular_hourly(times):
+        return None, None
+    n_days = times.size // HOURS_PER_DAY
+    view = values.reshape((n_days, HOURS_PER_DAY) + values.shape[1:])
+    day_times = times[::HOURS_PER_DAY]
+    return view, day_times
+
+
+def daily_extremes(da, time_name=None):
+    # Daily Tmax/Tmin (and the hour at which they occur) from an hourly (time, lat, lon) cube.
+    #
+    # Fast path: on a regular hourly axis the cube is read ONCE and reshaped to
+    # (day, 24, lat, lon), so max/min/argmax/argmin are cheap reductions over axis 1
+    # of the same in-memory array (instead of one full resample pass per statistic).
+    # Fallback: if there are gaps the steps are scattered onto a (day, 24) grid of the
+    # days that are present (missing hours NaN) and reduced the same way.
+    if time_name is None:
+        time_name = 'valid_time' if 'valid_time' in da.dims else 'time'
+
+    other_dims = [d for d in da.dims if d != time_name]
+    da = da.transpose(time_name, *other_dims)
+    times = da[time_name].values
+
+    values = da.values
+    view, day_times = daily_view(values, times)
+
+    if view is None:
+        view, day_times = _daily_grid(values, times)
+        # Whole days that are just not contiguous (one calendar month of every year,
+        # append windows) are expected; only hours missing inside a day are worth a note
+        if times.size < day_times.size * HOURS_PER_DAY:
+            print(" -> Irregular hourly axis (hours missing within days), filled with NaN...")
+
+    # nan-aware reductions so a missing hour doesn't wipe out the whole day
+    tmax = np.nanmax(view, axis=1)
+    tmin = np.nanmin(view, axis=1)
+    # argmax/argmin need a finite fill; all-NaN days are masked afterwards
+    all_nan = np.isnan(view).all(axis=1)
+    tmax_hour = np.argmax(np.where(np.isnan(view), -np.inf, view), axis=1).astype('float32')
+    tmin_hour = np.argmin(np.where(np.isnan(view), np.inf, view), axis=1).astype('float32')
+    tmax_hour[all_nan] = np.nan
+    tmin_hour[all_nan] = np.nan
+
+    coords = {time_name: day_times}
+    for d in other_dims:
+        coords[d] = da[d]
+    dims = (time_name,) + tuple(other_dims)
+
+    ds_out = xr.Dataset()
+    ds_out['tmax'] = xr.DataArray(tmax, coords=coords, dims=dims)
+    ds_out['tmin'] = xr.DataArray(tmin, coords=coords, dims=dims)
+    ds_out['tmax_hour'] = xr.DataArray(tmax_hour, coords=coords, dims=dims)
+    ds_out['tmin_hour'] = xr.DataArray(tmin_hour, coords=coords, dims=dims)
+    return ds_out
+
+
+def _daily_grid(values, times):
+    # Gap-tolerant path: place every step at (its day, its hour) of a NaN-filled
+    # (day, 24, ...) array covering only the days that have data. Non-contiguous
+    # selections (e.g. one calendar month of every year) get no bins for absent days.
+    times = np.asarray(times, dtype='datetime64[ns]')
+    days = times.astype('datetime64[D]')
+    day_times, day_idx = np.unique(days, return_inverse=True)
+    hour_idx = ((times - days) // np.timedelta64(1, 'h')).astype('int64')
+    grid = np.full((day_times.size, HOURS_PER_DAY) + values.shape[1:], np.nan,
+                   dtype=np.result_type(values.dtype, np.float32))
+    grid[day_idx, hour_idx] = values
+    return grid, day_times.astype('datetime64[ns]')
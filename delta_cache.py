@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# Persisted CMIP6 delta tables.
+# The monthly quantile deltas only depend on the two CMIP6 files, the variable and the
+# quantile grid, so they are the same for every ERA5 domain run against one GCM pair.
+# Each table (12 months x n_quantiles) is stored as a small .npz file named after a key
+# built from the content hashes of both files, the variable and the quantile grid;
+# row m-1 holds month m. A changed file, variable or grid simply gives a new key.
+# Delete the cache directory (or set MQDM_DELTA_CACHE to another one) to start over.
+
+CACHE_DIR = os.environ.get('MQDM_DELTA_CACHE', '.delta_cache')
+HASH_INDEX = 'file_hashes.json'
+# Bump when the delta computation changes, so old tables are not reused
+CACHE_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    # Content hash of a file. Hashes are remembered per (size, mtime), so an
+    # unchanged multi-GB CMIP6 file is only read once.
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+
+    index = _load_index()
+    entry = index.get(path)
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    index[path] = {'stamp': stamp, 'sha256': digest.hexdigest()}
+    _save_index(index)
+    return index[path]['sha256']
+
+
+def _load_index():
+    path = os.path.join(CACHE_DIR, HASH_INDEX)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        # Half-written by a concurrent run: rebuild
+        return {}
+
+
+def _save_index(index):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, HASH_INDEX)
+    tmp_path = f"{path}.{os.getpid()}.part"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def cache_key(hist_path, fut_path, var_name, quantiles):
+    quantiles = np.ascontiguousarray(quantiles, dtype='float64')
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}|{var_name}|".encode())
+    digest.update(file_hash(hist_path).encode())
+    digest.update(file_hash(fut_path).encode())
+    digest.update(quantiles.tobytes())
+    return digest.hexdigest()[:32]
+
+
+def source_path(ds):
+    # File a Dataset was opened from (None for in-memory or multi-file datasets)
+    path = ds.encoding.get('source')
+    return path if path and os.path.isfile(path) else None
+
+
+def load_or_compute(hist_path, fut_path, var_name, quantiles, compute):
+    # Delta table for (hist, fut, variable, quantile grid): loaded from the cache,
+    # or compute() -> (12, n_quantiles) array, stored and returned.
+    if hist_path is None or fut_path is None:
+        return compute()
+
+    key = cache_key(hist_path, fut_path, var_name, quantiles)
+    path = os.path.join(CACHE_DIR, f"delta_{var_name}_{key}.npz")
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            if np.array_equal(cached['quantiles'], quantiles):
+                return cached['delta']
+
+    delta = compute()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Written under a temporary name so parallel workers never read a partial file
+    tmp_path = f"{path}.{os.getpid()}.part.npz"
+    np.savez_compressed(tmp_path, delta=delta, quantiles=np.asarray(quantiles, dtype='float64'),
+                        variable=var_name, hist=os.path.basename(hist_path),
+                        fut=os.path.basename(fut_path))
+    os.replace(tmp_path, path)
+    return delta
@@ -0,0 +1,125 @@
+import os
+import argparse
+import numpy as np
+import xarray as xr
+
+import storage
+from daily_extremes import daily_view
+
+# Per-cell diurnal climatology (month, hour, lat, lon) of an hourly output, computed
+# once and cached next to the dataset as <name>_diurnal.nc.
+#
+# The record is read one year at a time. On a regular hourly axis (whole days starting
+# at 00 UTC, 1 h steps) a block is reshaped to (day, 24, lat, lon) and summed over the
+# days of each calendar month, with no groupby. Irregular blocks (gaps, partial days)
+# fall back to an indexed add over (month, hour). The cache stores means and counts,
+# so domain-wide cycles can be weighted exactly, and it carries the source fingerprint
+# so it is rebuilt when the dataset changes.
+
+CACHE_SUFFIX = '_diurnal.nc'
+
+
+def climatology_path(dataset_path):
+    return os.path.splitext(dataset_path.rstrip('/'))[0] + CACHE_SUFFIX
+
+
+def accumulate_block(sums, counts, values, times):
+    # Add a (time, ...) block into sums / counts of shape (12, 24, ...)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    view, day_times = daily_view(filled, times)
+    if view is not None:
+        valid = daily_view(valid, times)[0]
+        months = day_times.astype('datetime64[M]').astype('int64') % 12
+        for month in np.unique(months):
+            sel = months == month
+            sums[month] += view[sel].sum(axis=0)
+            counts[month] += valid[sel].sum(axis=0)
+    else:
+        times = np.asarray(times, dtype='datetime64[h]')
+        months = times.astype('datetime64[M]').astype('int64') % 12
+        hours = times.astype('int64') % 24
+        np.add.at(sums, (months, hours), filled)
+        np.add.at(counts, (months, hours), valid)
+
+
+def compute_climatology(da, time_name='valid_time'):
+    # (month, hour, ...) mean and count of a (time, ...) DataArray, one year per read
+    da = da.transpose(time_name, ...)
+    cell_shape = da.shape[1:]
+    sums = np.zeros((12, 24) + cell_shape)
+    counts = np.zeros((12, 24) + cell_shape, dtype='int64')
+
+    years = da[time_name].values.astype('datetime64[Y]')
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    stops = np.r_[starts[1:], years.size]
+    for start, stop in zip(starts, stops):
+        block = da.isel({time_name: slice(start, stop)})
+        accumulate_block(sums, counts, block.values.astype('float64'), block[time_name].values)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts > 0, sums / counts, np.nan)
+    dims = ('month', 'hour') + da.dims[1:]
+    coords = {'month': np.arange(1, 13), 'hour': np.arange(24)}
+    coords.update({dim: da[dim].values for dim in da.dims[1:] if dim in da.coords})
+    return xr.Dataset({'mean': (dims, mean.astype('float32')), 'count': (dims, counts.astype('int32'))},
+                      coords=coords, attrs={'variable': da.name or ''})
+
+
+def build_climatology(dataset_path, var_name):
+    path = climatology_path(dataset_path)
+    print(f"Building diurnal climatology {path}...")
+    da = storage.open_dataset(dataset_path)[var_name]
+    time_name = 'valid_time' if 'valid_time' in da.dims else 'time'
+    ds_clim = compute_climatology(da, time_name)
+    ds_clim.attrs['source_fingerprint'] = list(storage.file_fingerprint(dataset_path))
+    tmp_path = path + '.part'
+    ds_clim.to_netcdf(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def is_current(dataset_path, var_name):
+    path = climatology_path(dataset_path)
+    if not os.path.exists(path):
+        return False
+    with xr.open_dataset(path) as ds_clim:
+        fingerprint = [int(v) for v in np.atleast_1d(ds_clim.attrs.get('source_fingerprint', []))]
+        return (fingerprint == list(storage.file_fingerprint(dataset_path))
+                and ds_clim.attrs.get('variable') == var_name)
+
+
+def load_climatology(dataset_path, var_name):
+    # Cached (month, hour, lat, lon) climatology of dataset_path; rebuilt if stale
+    if not is_current(dataset_path, var_name):
+        build_climatology(dataset_path, var_name)
+    with xr.open_dataset(climatology_path(dataset_path)) as ds_clim:
+        return ds_clim.load()
+
+
+def hourly_cycle(ds_clim, dims=None):
+    # Count-weighted mean over all dims except 'hour' (or over `dims`)
+    dims = dims or [d for d in ds_clim['mean'].dims if d != 'hour']
+    weighted = (ds_clim['mean'].fillna(0) * ds_clim['count']).sum(dims)
+    return weighted / ds_clim['count'].sum(dims)
+
+
+def diurnal_range(ds_clim):
+    # Per-cell range of the annual-mean diurnal cycle (max - min over hours)
+    cycle = hourly_cycle(ds_clim, dims=['month'])
+    return cycle.max('hour') - cycle.min('hour')
+
+
+if __name__ == '__main__':
+    from stream_stats import DATASETS
+    parser = argparse.ArgumentParser(description='Cache per-cell diurnal climatologies of the pipeline outputs.')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the caches are current.')
+    args = parser.parse_args()
+    for name, var in DATASETS.values():
+        path = storage.artifact_path(name)
+        if not os.path.exists(path):
+            continue
+        if args.force or not is_current(path, var):
+            build_climatology(path, var)
+        else:
+            print(f"{climatology_path(path)} is up to date.")
@@ -1,6 +1,8 @@
 import cdsapi
 import zipfile
 import os
+import argparse
+import xarray as xr
 
 # --- CONIFGURATION ---
 DATASET = 'projections-cmip6'
@@ -12,8 +14,10 @@ MONTHS = [f"{m:02d}" for m in range(1, 13)]
 DAYS = [f"{d:02d}" for d in range(1, 32)]
 
 OUTPUT_DIR = 'data/raw'
+# Clean member files for ensemble.py: cmip6_clean_<model>__<experiment>.nc
+ENSEMBLE_DIR = 'ensemble'
 
-def download_variable(variable_name, output_filename):
+def download_variable(variable_name, output_filename, model=MODEL, experiment=EXPERIMENT):
     c = cdsapi.Client()
     
     zip_filename = output_filename.replace('.nc', '.zip')
@@ -25,9 +29,9 @@ def download_variable(variable_name, output_filename):
         
     if os.path.exists(full_nc_path):
         print(f"File already exists: {full_nc_path}")
-        return
+        return full_nc_path
 
-    print(f"Downloading {variable_name} for {YEAR}...")
+    print(f"Downloading {variable_name} for {YEAR} ({model}, {experiment})...")
     
     try:
         c.retrieve(
@@ -35,10 +39,10 @@ def download_variable(variable_name, output_filename):
             {
                 'format': 'zip',
                 'temporal_resolution': 'daily',
-                'experiment': EXPERIMENT,
+                'experiment': experiment,
                 'level': 'single_levels',
                 'variable': variable_name,
-                'model': MODEL,
+                'model': model,
                 'year': YEAR,
                 'month': MONTHS,
                 'day': DAYS,
@@ -53,13 +57,13 @@ def download_variable(variable_name, output_filename):
             extracted_files = zip_ref.namelist()
             if not extracted_files:
                 print("Error: Zip file is empty.")
-                return
+                return None
             
             # Find the NetCDF file in the zip
             nc_files = [f for f in extracted_files if f.endswith('.nc')]
             if not nc_files:
                 print("Error: No .nc file found in zip.")
-                return
+                return None
             
             # Use the first .nc file found (usually there's only one data file)
             original_nc_name = nc_files[0]
@@ -75,13 +79,56 @@ def download_variable(variable_name, output_filename):
         # Clean up zip file
         os.remove(full_zip_path)
         print("Zip file removed.")
+        return full_nc_path
         
     except Exception as e:
         print(f"Failed to download/extract {variable_name}: {e}")
+        return None
+
+def standardize_member(tmax_file, tmin_file, clean_file):
+    # Merge Tmax/Tmin of one model x experiment into an ensemble member file
+    # (same renaming and unit handling as standardize_data.py)
+    ds = xr.merge([xr.open_dataset(tmax_file, engine='netcdf4'),
+                   xr.open_dataset(tmin_file, engine='netcdf4')])
+    rename_dict = {}
+    for var in ds.data_vars:
+        if 'tasmax' in var:
+            rename_dict[var] = 'tmax_daily'
+        elif 'tasmin' in var:
+            rename_dict[var] = 'tmin_daily'
+    ds = ds.rename(rename_dict)
+    for var in ['tmax_daily', 'tmin_daily']:
+        if var in ds and ds[var].mean() > 200:
+            ds[var] = ds[var] - 273.15
+            ds[var].attrs['units'] = 'Celsius'
+    os.makedirs(os.path.dirname(clean_file), exist_ok=True)
+    ds.to_netcdf(clean_file)
+    print(f"Saved ensemble member: {clean_file}")
 
 if __name__ == '__main__':
-    # Download Daily Maximum Temperature
-    download_variable('daily_maximum_near_surface_air_temperature', f'cmip6_tmax_{YEAR}.nc')
-    
-    # Download Daily Minimum Temperature
-    download_variable('daily_minimum_near_surface_air_temperature', f'cmip6_tmin_{YEAR}.nc')
+    parser = argparse.ArgumentParser(description='Download CMIP6 daily Tmax/Tmin.')
+    parser.add_argument('--model', nargs='+', default=None,
+                        help=f'One or more CMIP6 models (default: {MODEL}).')
+    parser.add_argument('--experiment', nargs='+', default=None,
+                        help=f'One or more experiments, e.g. ssp2_4_5 ssp5_8_5 (default: {EXPERIMENT}).')
+    args = parser.parse_args()
+
+    if args.model is None and args.experiment is None:
+        # Single default model/experiment, original file names
+        # Download Daily Maximum Temperature
+        download_variable('daily_maximum_near_surface_air_temperature', f'cmip6_tmax_{YEAR}.nc')
+
+        # Download Daily Minimum Temperature
+        download_variable('daily_minimum_near_surface_air_temperature', f'cmip6_tmin_{YEAR}.nc')
+    else:
+        # Ensemble: every model x experiment, merged into ensemble/ for ensemble.py
+        for model in args.model or [MODEL]:
+            for experiment in args.experiment or [EXPERIMENT]:
+                tag = f'{model}__{experiment}'
+                tmax_path = download_variable('daily_maximum_near_surface_air_temperature',
+                                              f'cmip6_tmax_{tag}_{YEAR}.nc', model, experiment)
+                tmin_path = download_variable('daily_minimum_near_surface_air_temperature',
+                                              f'cmip6_tmin_{tag}_{YEAR}.nc', model, experiment)
+                if tmax_path and tmin_path:
+                    standardize_member(tmax_path, tmin_path,
+                                       os.path.join(ENSEMBLE_DIR, f'cmip6_clean_{tag}.nc'))
@@ -3,6 +3,7 @@ import zipfile
 import os
 import xarray as xr
 import numpy as np
+import argparse
 
 # --- CONFIGURATION ---
 DATASET = 'projections-cmip6'
@@ -15,7 +16,7 @@ DAYS = [f"{d:02d}" for d in range(1, 32)]
 
 OUTPUT_DIR = 'data/raw'
 
-def download_variable(variable_name, output_filename):
+def download_variable(variable_name, output_filename, model=MODEL):
     c = cdsapi.Client()
     
     zip_filename = output_filename.replace('.nc', '.zip')
@@ -40,7 +41,7 @@ def download_variable(variable_name, output_filename):
                 'experiment': EXPERIMENT,
                 'level': 'single_levels',
                 'variable': variable_name,
-                'model': MODEL,
+                'model': model,
                 'year': YEAR,
                 'month': MONTHS,
                 'day': DAYS,
@@ -78,11 +79,10 @@ def download_variable(variable_name, output_filename):
         print(f"Failed to download/extract {variable_name}: {e}")
         return None
 
-def standardize_history(tmax_file, tmin_file):
+def standardize_history(tmax_file, tmin_file, clean_file="cmip6_hist_clean.nc"):
     print("\n--- Starting Merge and Standardization ---")
     
-    sample_file = "cmip6_hist_sample.nc"
-    clean_file = "cmip6_hist_clean.nc"
+    sample_file = clean_file.replace('_clean', '_sample')
     
     try:
         # Load
@@ -128,13 +128,30 @@ def standardize_history(tmax_file, tmin_file):
     except Exception as e:
         print(f"Standardization Failed: {e}")
 
-if __name__ == '__main__':
+def download_history(model=None):
+    # model=None: default model, original file names. Otherwise the historical run
+    # of that model is written to ensemble/cmip6_hist_clean_<model>.nc for ensemble.py
+    tag = f'_{model}' if model else ''
     # 1. Download Data
-    tmax_path = download_variable('daily_maximum_near_surface_air_temperature', f'cmip6_hist_tmax_{YEAR}.nc')
-    tmin_path = download_variable('daily_minimum_near_surface_air_temperature', f'cmip6_hist_tmin_{YEAR}.nc')
+    tmax_path = download_variable('daily_maximum_near_surface_air_temperature',
+                                  f'cmip6_hist_tmax{tag}_{YEAR}.nc', model or MODEL)
+    tmin_path = download_variable('daily_minimum_near_surface_air_temperature',
+                                  f'cmip6_hist_tmin{tag}_{YEAR}.nc', model or MODEL)
     
     # 2. Merge and Standardize (if downloads successful)
     if tmax_path and tmin_path:
-        standardize_history(tmax_path, tmin_path)
+        if model:
+            os.makedirs('ensemble', exist_ok=True)
+            standardize_history(tmax_path, tmin_path, os.path.join('ensemble', f'cmip6_hist_clean{tag}.nc'))
+        else:
+            standardize_history(tmax_path, tmin_path)
     else:
         print("Skipping standardization due to download failure.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download and standardize CMIP6 historical Tmax/Tmin.')
+    parser.add_argument('--model', nargs='+', default=None,
+                        help=f'Download the historical run of these models for ensemble.py (default: {MODEL} only).')
+    args = parser.parse_args()
+    for model in args.model or [None]:
+        download_history(model)
@@ -1,13 +1,13 @@
-import cdsapi
-import os
-from datetime import datetime
+import argparse
+
+from download_scheduler import cds_backend, directory_backend, run_downloads
 
 # --- CONFIGURATION ---
 # Region of Interest [North, West, South, East]
-# Current Default: A region in South India (Telangana/AP). 
+# Current Default: A region in South India (Telangana/AP).
 # PLEASE UPDATE this to your specific study area.
 # ERA5 resolution is ~0.25 degrees. A 2x2 degree box gives ~64 grid points.
-AREA = [18.0, 78.0, 16.0, 80.0] 
+AREA = [18.0, 78.0, 16.0, 80.0]
 
 # Time Period
 YEARS = [str(y) for y in range(2010, 2024)] # 2010 to 2023
@@ -21,42 +21,55 @@ VARIABLE = '2m_temperature'
 # Output Directory
 OUTPUT_DIR = 'data/raw'
 
-def download_era5_hourly():
-    c = cdsapi.Client()
-    
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        
-    print(f"Starting download for Area: {AREA}")
-    print(f"Variable: {VARIABLE}")
-    
+DATASET = 'reanalysis-era5-single-levels'
+
+def era5_filename(year, month):
+    return f"era5_{VARIABLE}_{year}_{month}.nc"
+
+def build_tasks():
+    tasks = []
     for year in YEARS:
         for month in MONTHS:
-            output_file = os.path.join(OUTPUT_DIR, f"era5_{VARIABLE}_{year}_{month}.nc")
-            
-            if os.path.exists(output_file):
-                print(f"File already exists, skipping: {output_file}")
-                continue
-                
-            print(f"Downloading data for {year}-{month}...")
-            
-            try:
-                c.retrieve(
-                    'reanalysis-era5-single-levels',
-                    {
-                        'product_type': 'reanalysis',
-                        'format': 'netcdf',
-                        'variable': VARIABLE,
-                        'year': year,
-                        'month': month,
-                        'day': DAYS,
-                        'time': TIMES,
-                        'area': AREA,
-                    },
-                    output_file)
-                print(f"Saved: {output_file}")
-            except Exception as e:
-                print(f"Failed to download {year}-{month}: {e}")
+            request = {
+                'product_type': 'reanalysis',
+                'format': 'netcdf',
+                'variable': VARIABLE,
+                'year': year,
+                'month': month,
+                'day': DAYS,
+                'time': TIMES,
+                'area': AREA,
+            }
+            tasks.append((DATASET, request, era5_filename(year, month)))
+    return tasks
+
+def download_era5_hourly(workers=4, mock_dir=None, verify_checksum=False, adopt_existing=False):
+    if mock_dir:
+        print(f"Using local mock backend: {mock_dir}")
+        retrieve = directory_backend(mock_dir, lambda r: era5_filename(r['year'], r['month']))
+    else:
+        retrieve = cds_backend()
+
+    print(f"Starting download for Area: {AREA}")
+    print(f"Variable: {VARIABLE}")
+
+    summary = run_downloads(build_tasks(), retrieve, OUTPUT_DIR, max_workers=workers,
+                            verify_checksum=verify_checksum, adopt_existing=adopt_existing)
+
+    print(f"\nDownloaded: {len(summary['downloaded'])}, "
+          f"Skipped: {len(summary['skipped'])}, Failed: {len(summary['failed'])}")
+    return summary
 
 if __name__ == '__main__':
-    download_era5_hourly()
+    parser = argparse.ArgumentParser(description='Download hourly ERA5 2m temperature (concurrent, resumable).')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of concurrent CDS requests (default: 4).')
+    parser.add_argument('--mock-dir', default=None,
+                        help='Serve requests from this local directory instead of the CDS (no network).')
+    parser.add_argument('--verify-checksum', action='store_true',
+                        help='Re-hash completed files against the manifest before skipping them.')
+    parser.add_argument('--adopt-existing', action='store_true',
+                        help='Record files downloaded before the manifest existed instead of re-downloading them.')
+    args = parser.parse_args()
+    download_era5_hourly(workers=args.workers, mock_dir=args.mock_dir,
+                         verify_checksum=args.verify_checksum, adopt_existing=args.adopt_existing)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Concurrent, resumable download scheduler.
+# - a bounded number of requests run at once (thread pool; the work is I/O bound)
+# - every file is downloaded to a temporary '.part' name and renamed when complete,
+#   so a crash never leaves a truncated file under the final name
+# - a manifest (size + sha256) records completed files; only files that match their
+#   manifest entry are treated as done on the next run
+# - the backend is any callable with the cdsapi signature retrieve(dataset, request, target),
+#   so the scheduler can run against a local directory instead of the CDS
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    # Atomic write: readers only ever see a complete manifest
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + '.part'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_complete(output_dir, filename, manifest, verify_checksum=False):
+    path = os.path.join(output_dir, filename)
+    entry = manifest.get(filename)
+    if entry is None or not os.path.exists(path):
+        return False
+    if os.path.getsize(path) != entry['size']:
+        return False
+    if verify_checksum and file_checksum(path) != entry['sha256']:
+        return False
+    return True
+
+
+# --- Backends ---
+
+def cds_backend():
+    # Real CDS API. One client per thread (cdsapi clients keep a session).
+    import cdsapi
+    local = threading.local()
+
+    def retrieve(dataset, request, target):
+        if not hasattr(local, 'client'):
+            local.client = cdsapi.Client()
+        local.client.retrieve(dataset, request, target)
+
+    return retrieve
+
+
+def directory_backend(source_dir, filename_fn):
+    # Stand-in for the CDS: "retrieves" a request by copying the matching file from
+    # a local directory. filename_fn(request) gives the source file name.
+    def retrieve(dataset, request, target):
+        source = os.path.join(source_dir, filename_fn(request))
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"Mock backend has no file for request: {source}")
+        shutil.copyfile(source, target)
+
+    return retrieve
+
+
+# --- Scheduler ---
+
+def run_downloads(tasks, retrieve, output_dir, max_workers=4, verify_checksum=False,
+                  adopt_existing=False):
+    # tasks: list of (dataset, request, filename)
+    # Returns a dict with the filenames that were downloaded, skipped and failed.
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    manifest = load_manifest(output_dir)
+    manifest_lock = threading.Lock()
+    summary = {'downloaded': [], 'skipped': [], 'failed': []}
+
+    def record(filename):
+        path = os.path.join(output_dir, filename)
+        entry = {'size': os.path.getsize(path), 'sha256': file_checksum(path)}
+        with manifest_lock:
+            manifest[filename] = entry
+            save_manifest(output_dir, manifest)
+
+    def download_one(dataset, request, filename):
+        target = os.path.join(output_dir, filename)
+        tmp_target = target + '.part'
+        try:
+            retrieve(dataset, request, tmp_target)
+            os.replace(tmp_target, target)
+            record(filename)
+            return filename, None
+        except Exception as e:
+            if os.path.exists(tmp_target):
+                os.remove(tmp_target)
+            return filename, e
+
+    pending = []
+    for dataset, request, filename in tasks:
+        if is_complete(output_dir, filename, manifest, verify_checksum):
+            summary['skipped'].append(filename)
+            continue
+        if adopt_existing and filename not in manifest and os.path.exists(os.path.join(output_dir, filename)):
+            # Files downloaded before the manifest existed
+            print(f"Adopting existing file into manifest: {filename}")
+            record(filename)
+            summary['skipped'].append(filename)
+            continue
+        pending.append((dataset, request, filename))
+
+    print(f"{len(summary['skipped'])} files complete, {len(pending)} to download "
+          f"({max_workers} concurrent requests)")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        jobs = [pool.submit(download_one, *task) for task in pending]
+        for job in as_completed(jobs):
+            filename, error = job.result()
+            if error is None:
+                print(f"Saved: {filename}")
+                summary['downloaded'].append(filename)
+            else:
+                print(f"Failed to download {filename}: {error}")
+                summary['failed'].append(filename)
+
+    return summary
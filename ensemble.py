@@ -0,0 +1,201 @@
+import os
+import re
+import glob
+import time
+import argparse
+import warnings
+import numpy as np
+import xarray as xr
+
+import storage
+import alpha_store
+from daily_extremes import daily_extremes, get_time_name
+from qdm_engine import month_of, monthly_ranks, apply_delta_members
+import mqdm_daily_shift
+from mqdm_daily_shift import VARIABLES, cmip6_delta_table
+
+warnings.filterwarnings("ignore")
+
+# Ensemble batch mode: many GCM x SSP members against the same ERA5 reference.
+# Everything that only depends on ERA5 is computed once:
+#   - daily Tmax/Tmin of era5_clean
+#   - their per-month percentage ranks
+#   - the diurnal shape factor alpha (read from the alpha store, see alpha_store.py)
+# The members' delta tables are then stacked (member, 12, quantile) and applied in one
+# vectorized call per variable (qdm_engine.apply_delta_members).
+#
+# Members are read from ENSEMBLE_DIR with the naming used by download_cmip6.py:
+#   cmip6_clean_<model>__<experiment>.nc   future daily tmax_daily / tmin_daily
+#   cmip6_hist_clean_<model>.nc            historical run of that model
+
+ENSEMBLE_DIR = 'ensemble'
+MEMBER_RE = re.compile(r'cmip6_clean_(?P<model>.+)__(?P<experiment>.+)\.nc$')
+
+
+def find_members(ensemble_dir=ENSEMBLE_DIR):
+    members = []
+    for fut_path in sorted(glob.glob(os.path.join(ensemble_dir, 'cmip6_clean_*__*.nc'))):
+        match = MEMBER_RE.search(os.path.basename(fut_path))
+        model, experiment = match['model'], match['experiment']
+        hist_path = os.path.join(ensemble_dir, f'cmip6_hist_clean_{model}.nc')
+        if not os.path.exists(hist_path):
+            # Another model's historical run would add inter-model bias to every delta
+            print(f"Warning: skipping {model}__{experiment}: no {hist_path} "
+                  f"(run download_cmip6_hist.py --model {model}).")
+            continue
+        members.append({'name': f'{model}__{experiment}', 'hist': hist_path, 'fut': fut_path})
+    return members
+
+
+def member_delta_tables(members, quantiles):
+    # {variable: (member, 12, quantile)} from the (cached) per-member delta tables
+    tables = {variable: [] for variable in VARIABLES}
+    for member in members:
+        ds_hist = storage.open_dataset(member['hist'])
+        ds_fut = storage.open_dataset(member['fut'])
+        for variable, var_name in VARIABLES.items():
+            tables[variable].append(cmip6_delta_table(ds_hist, ds_fut, var_name, quantiles))
+    return {variable: np.stack(stack) for variable, stack in tables.items()}
+
+
+def run_ensemble(members, stacked=False, hourly=True, output_dir=ENSEMBLE_DIR):
+    if not members:
+        print(f"No ensemble members found in {output_dir}/ (expected cmip6_clean_<model>__<experiment>.nc).")
+        return
+    print(f"Ensemble of {len(members)} members: {', '.join(m['name'] for m in members)}")
+
+    # --- Shared ERA5 preprocessing (once for all members) ---
+    t0 = time.perf_counter()
+    era5_path = storage.artifact_path('era5_clean')
+    ds_era5 = storage.open_dataset(era5_path)
+    era5_time_name = get_time_name(ds_era5)
+    era5_daily = storage.cached('daily_extremes', era5_path,
+                                lambda: daily_extremes(ds_era5['temp_hourly'], era5_time_name))
+    template = era5_daily['tmax']
+    days = era5_daily[era5_time_name].values
+    months = month_of(days)
+
+    print("Ranking ERA5 daily extremes...")
+    daily = {variable: era5_daily[variable].values for variable in VARIABLES}
+    ranks = {variable: monthly_ranks(daily[variable], months) for variable in VARIABLES}
+
+    if hourly:
+        hourly_template = ds_era5['temp_hourly'].transpose(*template.dims)
+        hours = hourly_template[era5_time_name].values
+        # Day of every hour, i.e. the reindex(method='ffill') of reconstruct_hourly
+        hour_day = np.searchsorted(days, hours, side='right') - 1
+        # Memory-mapped; _hourly reads the codes one block of days at a time
+        alpha_codes = alpha_store.load_alpha(era5_path)
+    shared_seconds = time.perf_counter() - t0
+    print(f"Shared ERA5 preprocessing: {shared_seconds:.2f} s")
+
+    # --- Batched member shifts ---
+    t0 = time.perf_counter()
+    # Grid / tail as set by mqdm_daily_shift.configure_mapping (read at call time)
+    quantiles, tail = mqdm_daily_shift.QUANTILES, mqdm_daily_shift.TAIL
+    tables = member_delta_tables(members, quantiles)
+    shifted = {variable: apply_delta_members(daily[variable], ranks[variable], months,
+                                             tables[variable], quantiles, tail)
+               for variable in VARIABLES}
+    batch_seconds = time.perf_counter() - t0
+    print(f"Batched MQDM shift of {len(members)} members: {batch_seconds:.2f} s")
+
+    member_names = [m['name'] for m in members]
+    os.makedirs(output_dir, exist_ok=True)
+    timings = []
+
+    if stacked:
+        # The stacked daily file is written once for all members (shared time)
+        t0 = time.perf_counter()
+        ds_daily = xr.Dataset({f'{variable}_shifted': (('member',) + template.dims, shifted[variable])
+                               for variable in VARIABLES},
+                              coords=dict(template.coords, member=member_names))
+        path = os.path.join(output_dir, storage.artifact_path('era5_future_daily_ensemble'))
+        storage.write_dataset(ds_daily, path)
+        print(f"Saved {path}")
+        batch_seconds += time.perf_counter() - t0
+        if hourly:
+            # Create the file with its member dim but no data (compute=False), then
+            # write one member's hourly slab at a time
+            import dask.array
+            path = os.path.join(output_dir, storage.artifact_path('era5_future_hourly_ensemble'))
+            empty = dask.array.empty((len(members),) + hourly_template.shape, dtype='float32',
+                                     chunks=(1,) + hourly_template.shape)
+            ds_hourly = xr.Dataset({'temp_future': (('member',) + hourly_template.dims, empty)},
+                                   coords=dict(hourly_template.coords, member=member_names))
+            storage.write_dataset(ds_hourly, path, compute=False)
+            for i, name in enumerate(member_names):
+                t0 = time.perf_counter()
+                slab = _hourly(shifted, i, alpha_codes, hour_day)[np.newaxis]
+                ds_member = xr.Dataset({'temp_future': (('member',) + hourly_template.dims, slab)},
+                                       coords={'member': [name]})
+                storage.write_region(ds_member, path, 'member', i)
+                timings.append((name, time.perf_counter() - t0))
+                print(f" -> Finished {name}")
+            print(f"Saved {path}")
+        else:
+            timings = [(name, 0.0) for name in member_names]
+    else:
+        for i, name in enumerate(member_names):
+            t0 = time.perf_counter()
+            ds_daily = xr.Dataset({f'{variable}_shifted': template.copy(data=shifted[variable][i])
+                                   for variable in VARIABLES})
+            storage.write_dataset(ds_daily, os.path.join(output_dir, storage.artifact_path(f'era5_future_daily_{name}')))
+            if hourly:
+                ds_hourly = xr.Dataset({'temp_future': hourly_template.copy(data=_hourly(shifted, i, alpha_codes, hour_day))})
+                ds_hourly['temp_future'].attrs = {
+                    'units': 'Celsius',
+                    'long_name': 'MQDM Shifted Hourly 2m Temperature',
+                    'description': f'Reconstructed hourly time series for ensemble member {name}.'
+                }
+                storage.write_dataset(ds_hourly, os.path.join(output_dir, storage.artifact_path(f'era5_future_hourly_{name}')))
+            timings.append((name, time.perf_counter() - t0))
+            print(f" -> Finished {name}")
+
+    # --- Throughput report ---
+    shared_per_member = (shared_seconds + batch_seconds) / len(members)
+    n_values = template.size * (24 if hourly else 1)
+    print("\n--- Ensemble Throughput ---")
+    print(f"{'member':<40} {'seconds':>9} {'Mvalues/s':>10}")
+    for name, seconds in timings:
+        total = seconds + shared_per_member
+        print(f"{name:<40} {total:9.2f} {n_values / total / 1e6:10.2f}")
+    return timings
+
+
+def _hourly(shifted, i, alpha_codes, hour_day, block_days=366):
+    # T_fut = Tmin_fut + alpha * (Tmax_fut - Tmin_fut) for member i. The memory-mapped
+    # alpha codes are dequantized one block of days at a time, as in
+    # reconstruct_hourly.compute_hourly_stored.
+    tmin = shifted['tmin'][i].astype('float32')
+    dtr = shifted['tmax'][i].astype('float32') - tmin
+    out = np.empty(alpha_codes.shape, dtype='float32')
+    step = block_days * 24
+    for start in range(0, hour_day.size, step):
+        block = slice(start, start + step)
+        idx = hour_day[block]
+        values = alpha_store.dequantize(alpha_codes[block])
+        values *= dtr[idx]
+        values += tmin[idx]
+        out[block] = values
+    # Hours before the first day have no daily values (NaN, as with ffill)
+    out[hour_day < 0] = np.nan
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Downscale a GCM x SSP ensemble against one ERA5 reference.')
+    parser.add_argument('--ensemble-dir', default=ENSEMBLE_DIR,
+                        help='Directory with cmip6_clean_<model>__<experiment>.nc members (default: ensemble/).')
+    parser.add_argument('--members', nargs='+', default=None,
+                        help='Only these members (<model>__<experiment>).')
+    parser.add_argument('--stacked', action='store_true',
+                        help='Write one stacked file with a member dimension instead of one file per member.')
+    parser.add_argument('--daily-only', action='store_true',
+                        help='Skip the hourly reconstruction.')
+    args = parser.parse_args()
+
+    members = find_members(args.ensemble_dir)
+    if args.members:
+        members = [m for m in members if m['name'] in args.members]
+    run_ensemble(members, stacked=args.stacked, hourly=not args.daily_only, output_dir=args.ensemble_dir)
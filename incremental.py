@@ -0,0 +1,42 @@
+import os
+import numpy as np
+
+import storage
+from qdm_engine import month_of
+
+# Helpers for --append runs: find which time steps of an output must be (re)computed
+# after new ERA5 steps arrive.
+#
+# Schaake reordering and the hourly reconstruction are per step / per day, but MQDM ranks
+# every ERA5 day against all years of the same calendar month. New days in month M
+# therefore change the shifted values of every year's month M. The "dirty" set is every
+# step in a calendar month that received new steps; all stages use the same rule, so the
+# appended outputs match a full recompute exactly.
+
+
+def last_time(path, dim):
+    # Last step already present in an output (None if it does not exist yet)
+    if not os.path.exists(path):
+        return None
+    return storage.open_dataset(path)[dim].values.max()
+
+
+def dirty_mask(times, last):
+    # Boolean mask over `times`: steps to recompute given the last step already written
+    times = np.asarray(times)
+    if last is None:
+        return np.ones(times.shape, dtype=bool)
+    new = times > last
+    if not new.any():
+        return new
+    months = month_of(times)
+    return np.isin(months, np.unique(months[new]))
+
+
+def contiguous_runs(mask):
+    # Slices of consecutive True entries (e.g. one slice per affected month and year)
+    idx = np.flatnonzero(mask)
+    if idx.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(idx) != 1) + 1
+    return [slice(int(run[0]), int(run[-1]) + 1) for run in np.split(idx, breaks)]
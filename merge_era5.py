@@ -1,45 +1,107 @@
 import xarray as xr
 import glob
 import os
+import argparse
 
-def merge_era5():
+import storage
+
+# Dask chunking of the monthly files: one month of hourly steps per chunk
+MERGE_CHUNKS = {'valid_time': 744}
+
+KELVIN_UNITS = {'K', 'kelvin', 'Kelvin', 'degK'}
+CELSIUS_UNITS = {'C', 'Celsius', 'celsius', 'degC', 'degree_Celsius', 'degrees_Celsius'}
+
+def is_kelvin(da, time_name='valid_time'):
+    # Decide units from metadata; only if that is missing/unknown look at a small
+    # sample (first time step) instead of computing the mean of the whole cube.
+    units = da.attrs.get('units')
+    if units in KELVIN_UNITS:
+        return True
+    if units in CELSIUS_UNITS:
+        return False
+    sample = da.isel({time_name: 0}) if time_name in da.dims else da
+    return float(sample.mean()) > 200
+
+def standardize(ds):
+    # Renaissance
+    if 't2m' in ds:
+        ds = ds.rename({'t2m': 'temp_hourly'})
+    elif 'var167' in ds:
+        ds = ds.rename({'var167': 'temp_hourly'})
+
+    # Standardize Units (lazy: nothing is computed until the write)
+    if 'temp_hourly' in ds and is_kelvin(ds['temp_hourly']):
+        print("Converting to Celsius...")
+        attrs = dict(ds['temp_hourly'].attrs)
+        ds['temp_hourly'] = ds['temp_hourly'] - 273.15
+        attrs['units'] = 'Celsius'
+        ds['temp_hourly'].attrs = attrs
+    return ds
+
+def _last_time(path):
+    ds_existing = storage.open_dataset(path)
+    return ds_existing['valid_time'].values.max()
+
+def _files_after(files, last_time):
+    # Only the time coordinate of each file is read
+    new_files = []
+    for f in files:
+        with xr.open_dataset(f, engine='netcdf4') as ds:
+            if ds['valid_time'].values.max() > last_time:
+                new_files.append(f)
+    return new_files
+
+def merge_era5(append=False):
     print("Merging ERA5 files from data/raw/...")
     file_pattern = "data/raw/era5_2m_temperature_*.nc"
     files = sorted(glob.glob(file_pattern))
-    
+
     if not files:
         print("No ERA5 files found!")
         return
 
     print(f"Found {len(files)} files.")
-    
-    # Open all files
+    output_path = storage.artifact_path('era5_clean')
+
+    if append and os.path.exists(output_path):
+        last_time = _last_time(output_path)
+        files = _files_after(files, last_time)
+        if not files:
+            print(f"No new time steps after {last_time}. {output_path} is up to date.")
+            return
+        print(f"Appending {len(files)} new files after {last_time}...")
+    elif append:
+        print(f"{output_path} does not exist yet. Running a full merge.")
+        append = False
+
+    # Open all files (lazily, one month per dask chunk)
     try:
-        ds = xr.open_mfdataset(files, combine='by_coords', engine='netcdf4')
-        print("Dataset loaded. Dimensions:", ds.dims)
-        
-        # Renaissance
-        if 't2m' in ds:
-            ds = ds.rename({'t2m': 'temp_hourly'})
-        elif 'var167' in ds:
-            ds = ds.rename({'var167': 'temp_hourly'})
-            
-        # Standardize Units
-        if 'temp_hourly' in ds:
-             if ds['temp_hourly'].mean() > 200:
-                print("Converting to Celsius...")
-                ds['temp_hourly'] = ds['temp_hourly'] - 273.15
-                ds['temp_hourly'].attrs['units'] = 'Celsius'
-        
+        ds = xr.open_mfdataset(files, combine='by_coords', engine='netcdf4',
+                               chunks=MERGE_CHUNKS, parallel=True)
+        print("Dataset opened. Dimensions:", dict(ds.sizes))
+
+        ds = standardize(ds)
+
+        if append:
+            ds = ds.sel(valid_time=ds['valid_time'] > last_time)
+            print(f"Appending {ds.sizes['valid_time']} time steps to {output_path}...")
+            storage.append_dataset(ds, output_path, 'valid_time')
+            print(f"Success: {output_path} extended to {ds['valid_time'].values.max()}.")
+            return
+
         # Save
-        print("Saving to era5_clean.nc (this might take a moment)...")
-        # Encoding compression to save space
-        encoding = {'temp_hourly': {'zlib': True, 'complevel': 5}}
-        ds.to_netcdf('era5_clean.nc', encoding=encoding)
-        print("Success: era5_clean.nc created.")
-        
+        print(f"Saving to {output_path} (this might take a moment)...")
+        # Compressed, chunked layout (see storage.py); chunks are computed and
+        # written by dask in parallel. The time axis is left extendable for --append.
+        storage.write_dataset(ds, output_path)
+        print(f"Success: {output_path} created.")
+
     except Exception as e:
         print(f"Merge failed: {e}")
 
 if __name__ == "__main__":
-    merge_era5()
+    parser = argparse.ArgumentParser(description='Merge monthly ERA5 files into the clean hourly dataset.')
+    parser.add_argument('--append', action='store_true',
+                        help='Only add time steps newer than the existing merged dataset.')
+    args = parser.parse_args()
+    merge_era5(append=args.append)
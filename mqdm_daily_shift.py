@@ -2,147 +2,286 @@ import xarray as xr
 import numpy as np
 import scipy.stats as stats
 import warnings
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import storage
+import accel
+import delta_cache
+import regrid
+from incremental import last_time, dirty_mask, contiguous_runs
+from daily_extremes import daily_extremes, get_time_name
+from quantile_mapping import quantile_grid, TAILS
+from qdm_engine import month_of, monthly_delta_table, qdm_shift, cell_delta_table, qdm_shift_field
 
 # Suppress annoying xarray warnings
 warnings.filterwarnings("ignore")
 
-def mqdm_daily_shift():
-    print("Starting MQDM Daily Shift...")
+QUANTILES = quantile_grid(99) # 99 percentiles
+# Ranks outside the quantile grid: 'nan' (default), 'clamp' or 'extrapolate'
+TAIL = 'nan'
+
+# ERA5 daily statistic -> CMIP6 variable
+VARIABLES = {'tmax': 'tmax_daily', 'tmin': 'tmin_daily'}
+
+def configure_mapping(n_quantiles=None, tail=None):
+    # Quantile grid / tail handling for this run (--quantiles / --tails)
+    global QUANTILES, TAIL
+    if n_quantiles is not None:
+        QUANTILES = quantile_grid(n_quantiles)
+    if tail is not None:
+        if tail not in TAILS:
+            raise ValueError(f"Unknown tail option: {tail}")
+        TAIL = tail
+
+def cmip6_domain_mean(ds, var_name):
+    # Check which dims exist
+    dims_to_reduce = [d for d in ['lat', 'lon', 'latitude', 'longitude'] if d in ds.dims]
+    if dims_to_reduce:
+        return ds[var_name].mean(dim=dims_to_reduce)
+    return ds[var_name]
+
+def cmip6_delta_table(ds_hist, ds_fut, var_name, quantiles=None):
+    # (12, n_quantiles) delta table of one CMIP6 variable. Loaded from the persisted
+    # cache when the same GCM pair / variable / grid was seen before (delta_cache.py).
+    quantiles = QUANTILES if quantiles is None else quantiles
+    def compute():
+        hist_all = cmip6_domain_mean(ds_hist, var_name)
+        fut_all = cmip6_domain_mean(ds_fut, var_name)
+        return monthly_delta_table(hist_all.values, month_of(hist_all['time'].values),
+                                   fut_all.values, month_of(fut_all['time'].values), quantiles)
+    return delta_cache.load_or_compute(delta_cache.source_path(ds_hist), delta_cache.source_path(ds_fut),
+                                       var_name, quantiles, compute)
+
+def _grid_names(da, candidates):
+    return [next(d for d in names if d in da.dims) for names in candidates]
+
+def cmip6_delta_field(ds_hist, ds_fut, var_name, era5_var, method, quantiles=None):
+    # Spatially resolved alternative to cmip6_delta_table for domains spanning several
+    # GCM cells: deltas per GCM cell (12, n_quantiles, lat, lon), regridded to the grid
+    # of era5_var (time, latitude, longitude) with cached weights (regrid.py).
+    quantiles = QUANTILES if quantiles is None else quantiles
+    lat, lon = _grid_names(ds_hist[var_name], [('lat', 'latitude'), ('lon', 'longitude')])
+    def compute():
+        hist = ds_hist[var_name].transpose('time', lat, lon)
+        fut = ds_fut[var_name].transpose('time', lat, lon)
+        return cell_delta_table(hist.values, month_of(hist['time'].values),
+                                fut.values, month_of(fut['time'].values), quantiles)
+    cells = delta_cache.load_or_compute(delta_cache.source_path(ds_hist), delta_cache.source_path(ds_fut),
+                                        f'{var_name}_cells', quantiles, compute)
+
+    era5_lat, era5_lon = era5_var.dims[1:]
+    w_lat, w_lon = regrid.regrid_weights(ds_hist[lat].values, ds_hist[lon].values,
+                                         era5_var[era5_lat].values, era5_var[era5_lon].values, method)
+    return regrid.regrid(cells, w_lat, w_lon)
 
-    # 1. Load Data
-    print("Loading datasets...")
-    # ERA5 (Hourly)
-    ds_era5 = xr.open_dataset('era5_clean.nc', engine='netcdf4')
-    # CMIP6 Historical (Daily)
-    ds_hist = xr.open_dataset('cmip6_hist_clean.nc', engine='netcdf4')
-    # CMIP6 Future (Daily)
-    ds_fut = xr.open_dataset('cmip6_clean.nc', engine='netcdf4')
+def shift_variable(era5_var, ds_hist, ds_fut, var_name, quantiles=None, regrid_method=None, tail=None):
+    # MQDM shift of one (time, latitude, longitude) ERA5 daily variable.
+    # regrid_method=None: one domain-mean delta curve for all cells (original behaviour);
+    # 'bilinear' / 'conservative': per-GCM-cell deltas regridded to the ERA5 grid.
+    # quantiles / tail default to the configured QUANTILES / TAIL.
+    quantiles = QUANTILES if quantiles is None else quantiles
+    tail = TAIL if tail is None else tail
+    era5_months = month_of(era5_var[era5_var.dims[0]].values)
+    if regrid_method is None:
+        delta = cmip6_delta_table(ds_hist, ds_fut, var_name, quantiles)
+        return qdm_shift(era5_var.values, era5_months, delta, quantiles, tail)
+    delta_field = cmip6_delta_field(ds_hist, ds_fut, var_name, era5_var, regrid_method, quantiles)
+    return qdm_shift_field(era5_var.values, era5_months, delta_field, quantiles, tail)
 
+def mqdm_month_job(month, quantiles=None, settings=None, regrid_method=None, tail=None):
+    # One independent unit of work: a single calendar month (all years) of both variables.
+    # Runs in a worker process, so it opens the files itself and reads
+    # only this month's slice of the hourly ERA5 cube.
+    if settings is not None:
+        storage.configure(*settings)
+    ds_era5 = storage.open_dataset(storage.artifact_path('era5_clean'))
+    ds_hist = storage.open_dataset('cmip6_hist_clean.nc')
+    ds_fut = storage.open_dataset('cmip6_clean.nc')
+
+    era5_time_name = get_time_name(ds_era5)
+    hourly = ds_era5['temp_hourly']
+    hourly_m = hourly.sel({era5_time_name: hourly[era5_time_name].dt.month == month})
+    if hourly_m.sizes[era5_time_name] == 0:
+        return month, None
+
+    # The slice is non-contiguous (one month of every year): daily_extremes only
+    # returns the days present. Tmax and Tmin share the one reduction.
+    era5_daily = daily_extremes(hourly_m, era5_time_name)
+    era5_daily = era5_daily.sel({era5_time_name: era5_daily[era5_time_name].dt.month == month})
+
+    shifted = {}
+    for variable, var_name in VARIABLES.items():
+        values = shift_variable(era5_daily[variable], ds_hist, ds_fut, var_name, quantiles, regrid_method, tail)
+        shifted[variable] = era5_daily[variable].copy(data=values)
+    return month, shifted
+
+def _mqdm_parallel(workers, regrid_method=None):
+    # Workers are fresh processes: hand them the store settings of this one
+    settings = (storage.STORE_FORMAT, storage.COMPRESSOR)
+    # Send the 12 calendar-month jobs to a process pool and assemble the
+    # results into preallocated daily arrays (no concat/sort).
+    print(f"Dispatching 12 month jobs to {workers} workers...")
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(mqdm_month_job, month, QUANTILES, settings, regrid_method, TAIL)
+                for month in range(1, 13)]
+        for job in as_completed(jobs):
+            month, shifted = job.result()
+            print(f" -> Finished month {month}")
+            if shifted is not None:
+                results[month] = shifted
+
+    template = next(iter(results.values()))['tmax']
+    time_name = template.dims[0]
+    days = np.unique(np.concatenate([r['tmax'][time_name].values for r in results.values()]))
+
+    ds_out = xr.Dataset()
+    for variable in VARIABLES:
+        data = np.full((days.size,) + template.shape[1:], np.nan)
+        for month, shifted in results.items():
+            # Only this job's own month: blocks never overwrite each other
+            block = shifted[variable]
+            block = block.sel({time_name: block[time_name].dt.month == month})
+            idx = np.searchsorted(days, block[time_name].values)
+            data[idx] = block.values
+        coords = {time_name: days}
+        coords.update({d: template[d] for d in template.dims[1:]})
+        ds_out[f'{variable}_shifted'] = xr.DataArray(data, coords=coords, dims=template.dims)
+    return ds_out
+
+def compute_daily_shift(ds_era5, ds_hist, ds_fut, era5_daily=None, regrid_method=None):
+    # In-memory core of the MQDM step: returns the shifted daily Dataset.
+    # era5_daily: precomputed daily_extremes() of ds_era5, if already available.
+    # regrid_method: None (domain-mean deltas) or 'bilinear' / 'conservative' (see shift_variable).
     print(f"ERA5 Range: {ds_era5['valid_time'].min().values} to {ds_era5['valid_time'].max().values}")
 
     # 2. Resample ERA5 to Daily
     print("Resampling ERA5 to daily Tmax/Tmin...")
     # Rename 'valid_time' to 'time' if needed to match standard conventions, or use keyword
     # ERA5 usually has 'valid_time'. We'll use the coordinate name present.
-    era5_time_name = 'valid_time' if 'valid_time' in ds_era5.coords else 'time'
-    
-    era5_daily_max = ds_era5['temp_hourly'].resample({era5_time_name: '1D'}).max()
-    era5_daily_min = ds_era5['temp_hourly'].resample({era5_time_name: '1D'}).min()
-    
-    # Store results here
-    tmax_shifted_list = []
-    tmin_shifted_list = []
-    
+    era5_time_name = get_time_name(ds_era5)
+
+    # Single pass over the hourly cube for both extremes
+    if era5_daily is None:
+        era5_daily = daily_extremes(ds_era5['temp_hourly'], era5_time_name)
+    era5_daily_max = era5_daily['tmax']
+    era5_daily_min = era5_daily['tmin']
+
     # Grid Handling:
     # If CMIP6 grid is different (1x1) vs ERA5 (9x9), we need to broadcast or interpolate.
     # Since CMIP6 is coarser, we can treat its distribution as representative for the region
     # and apply the *deltas* globally to the ERA5 grid, OR interpolate the deltas.
-    # For this script, we assume we apply the single CMIP6 loc's deltas to all ERA5 points 
+    # By default, we apply the single CMIP6 loc's deltas to all ERA5 points
     # (since the ERA5 domain is small, 2x2 degrees, this is physically reasonable).
-    
-    # 3. Monthly Loop
-    print("\nProcessing Months...")
-    months = range(1, 13)
-    quantiles = np.linspace(0.01, 0.99, 99) # 99 percentiles
-    
-    # Pre-compute CMIP6 quantiles (simplifies loop)
-    # Check which dims exist
-    dims_to_reduce = [d for d in ['lat', 'lon', 'latitude', 'longitude'] if d in ds_hist.dims]
-    print(f"Reducing CMIP6 over dimensions: {dims_to_reduce}")
-    
-    if dims_to_reduce:
-        hist_tmax_all = ds_hist['tmax_daily'].mean(dim=dims_to_reduce)
-        hist_tmin_all = ds_hist['tmin_daily'].mean(dim=dims_to_reduce)
-    else:
-        hist_tmax_all = ds_hist['tmax_daily']
-        hist_tmin_all = ds_hist['tmin_daily']
-        
-    dims_to_reduce_fut = [d for d in ['lat', 'lon', 'latitude', 'longitude'] if d in ds_fut.dims]
-    if dims_to_reduce_fut:
-        fut_tmax_all = ds_fut['tmax_daily'].mean(dim=dims_to_reduce_fut)
-        fut_tmin_all = ds_fut['tmin_daily'].mean(dim=dims_to_reduce_fut)
-    else:
-        fut_tmax_all = ds_fut['tmax_daily']
-        fut_tmin_all = ds_fut['tmin_daily']
-
-    # Prepare outputs initialized with ERA5 shape (but daily time)
-    # We can't easily initialize xarray datasets empty, so we'll construct lists.
-    
-    for month in months:
-        print(f" -> Month {month}")
-        
-        # --- A. Calculate DELTAS from CMIP6 ---
-        # Select month
-        hist_m_tmax = hist_tmax_all.sel(time=hist_tmax_all['time'].dt.month == month)
-        fut_m_tmax = fut_tmax_all.sel(time=fut_tmax_all['time'].dt.month == month)
-        
-        hist_m_tmin = hist_tmin_all.sel(time=hist_tmin_all['time'].dt.month == month)
-        fut_m_tmin = fut_tmin_all.sel(time=fut_tmin_all['time'].dt.month == month)
-        
-        # Compute Quantiles (Q)
-        # dims: (quantile: 99)
-        Q_hist_tmax = hist_m_tmax.quantile(quantiles, dim='time')
-        Q_fut_tmax = fut_m_tmax.quantile(quantiles, dim='time')
-        Delta_tmax = Q_fut_tmax - Q_hist_tmax
-        
-        Q_hist_tmin = hist_m_tmin.quantile(quantiles, dim='time')
-        Q_fut_tmin = fut_m_tmin.quantile(quantiles, dim='time')
-        Delta_tmin = Q_fut_tmin - Q_hist_tmin
-        
-        # --- B. Apply to ERA5 ---
-        # Select ERA5 month
-        # era5_daily_max is (time, lat, lon)
-        era5_m_tmax = era5_daily_max.sel({era5_time_name: era5_daily_max[era5_time_name].dt.month == month})
-        era5_m_tmin = era5_daily_min.sel({era5_time_name: era5_daily_min[era5_time_name].dt.month == month})
-        
-        if era5_m_tmax.sizes[era5_time_name] == 0:
-            continue
-
-        # Function to apply delta based on rank
-        # We wrap this to apply over the spatial grid if needed, 
-        # but xarray broadcasting usually handles the scalar addition fine.
-        # The Step is: Identify Rank of each value -> Interpolate Delta -> Add
-        
-        def apply_shift(data_array, delta_quantiles, quantiles_lev):
-            # 1. Compute Rank (0..1)
-            # We use xarray's rank or rank along time?
-            # Creating a CDF for the data itself is expensive if we do it per pixel.
-            # A faster way: Convert data to ranks relative to ITSELF.
-            # But the 'Delta' is defined on the *Model* quantiles.
-            # Wait, Standard QDM applies Delta(tau) where tau is the quantile of the OBSERVATION (ERA5).
-            
-            # Map data to quantiles 0..1
-            # We can use q = data.rank() / n
-            valid_mask = data_array.notnull()
-            ranks = data_array.rank(dim=era5_time_name, pct=True)
-            
-            # Interpolate Deltas
-            # Delta_tmax is coords=(quantile,). ranks is (time, lat, lon).
-            # We use interp() on the quantile dimension
-            deltas_interpolated = delta_quantiles.interp(quantile=ranks, method='linear')
-            
-            # Shift
-            return data_array + deltas_interpolated
-
-        # Apply
-        shifted_tmax = apply_shift(era5_m_tmax, Delta_tmax, quantiles)
-        shifted_tmin = apply_shift(era5_m_tmin, Delta_tmin, quantiles)
-        
-        tmax_shifted_list.append(shifted_tmax)
-        tmin_shifted_list.append(shifted_tmin)
-
-    # 4. Concatenate and Sort
-    print("Concatenating monthly results...")
+    # Larger domains spanning several GCM cells: regrid_method interpolates per-cell deltas.
+
+    # 3. Monthly Quantile Deltas
+    # dims: (month: 12, quantile: 99), or (month, quantile, lat, lon) when regridded;
+    # cached across runs for the same GCM pair
+    print("\nComputing monthly CMIP6 quantile deltas...")
+    if regrid_method is not None:
+        print(f"Using per-cell deltas regridded to ERA5 ({regrid_method}).")
+    quantiles = QUANTILES
+
+    # 4. Apply to ERA5
+    # Standard QDM applies Delta(tau) where tau is the quantile of the OBSERVATION (ERA5),
+    # ranked within its calendar month. All months are handled in one call and the
+    # results are written back in the original time order (no concat/sort needed).
+    print("Applying shifts to all months...")
+    tmax_shifted = shift_variable(era5_daily_max, ds_hist, ds_fut, 'tmax_daily', quantiles, regrid_method)
+    tmin_shifted = shift_variable(era5_daily_min, ds_hist, ds_fut, 'tmin_daily', quantiles, regrid_method)
+
     ds_out = xr.Dataset()
-    
-    # Concat along time
-    ds_out['tmax_shifted'] = xr.concat(tmax_shifted_list, dim=era5_time_name).sortby(era5_time_name)
-    ds_out['tmin_shifted'] = xr.concat(tmin_shifted_list, dim=era5_time_name).sortby(era5_time_name)
-    
+    ds_out['tmax_shifted'] = era5_daily_max.copy(data=tmax_shifted)
+    ds_out['tmin_shifted'] = era5_daily_min.copy(data=tmin_shifted)
+    return ds_out
+
+def mqdm_daily_shift_append(regrid_method=None):
+    # Incremental update after new ERA5 steps were appended to era5_clean.
+    # Only the calendar months that received new days are recomputed (all years of
+    # them, since ranks are per calendar month); those days are rewritten in place
+    # and the new days appended.
+    era5_path = storage.artifact_path('era5_clean')
+    daily_path = storage.artifact_path('era5_future_daily')
+
+    ds_era5 = storage.open_dataset(era5_path)
+    era5_time_name = get_time_name(ds_era5)
+    last_day = last_time(daily_path, era5_time_name)
+    if last_day is None:
+        print(f"{daily_path} does not exist yet. Running a full shift.")
+        return mqdm_daily_shift(regrid_method=regrid_method)
+
+    hourly_days = ds_era5[era5_time_name].values.astype('datetime64[D]')
+    mask = dirty_mask(hourly_days, last_day.astype('datetime64[D]'))
+    if not mask.any():
+        print(f"No new days after {last_day}. {daily_path} is up to date.")
+        return
+
+    runs = contiguous_runs(mask)
+    print(f"Recomputing {len(runs)} month blocks affected by new days after {last_day}...")
+    blocks = [daily_extremes(ds_era5['temp_hourly'].isel({era5_time_name: run}), era5_time_name)
+              for run in runs]
+    era5_daily = xr.concat(blocks, dim=era5_time_name)
+
+    ds_hist = storage.open_dataset('cmip6_hist_clean.nc')
+    ds_fut = storage.open_dataset('cmip6_clean.nc')
+    ds_out = compute_daily_shift(ds_era5, ds_hist, ds_fut, era5_daily, regrid_method)
+
+    print(f"Updating {daily_path}...")
+    storage.update_dataset(ds_out, daily_path, era5_time_name)
+    print("Done!")
+
+def mqdm_daily_shift(workers=1, regrid_method=None):
+    print("Starting MQDM Daily Shift...")
+
+    if workers > 1:
+        ds_out = _mqdm_parallel(workers, regrid_method)
+    else:
+        # 1. Load Data
+        print("Loading datasets...")
+        # ERA5 (Hourly)
+        era5_path = storage.artifact_path('era5_clean')
+        ds_era5 = storage.open_dataset(era5_path)
+        # CMIP6 Historical (Daily)
+        ds_hist = storage.open_dataset('cmip6_hist_clean.nc')
+        # CMIP6 Future (Daily)
+        ds_fut = storage.open_dataset('cmip6_clean.nc')
+
+        # Daily extremes are shared with reconstruct_hourly when the stages run in one process
+        era5_daily = storage.cached('daily_extremes', era5_path,
+                                    lambda: daily_extremes(ds_era5['temp_hourly'], get_time_name(ds_era5)))
+        ds_out = compute_daily_shift(ds_era5, ds_hist, ds_fut, era5_daily, regrid_method)
+
     # 5. Save
-    print("Saving era5_future_daily.nc...")
-    ds_out.to_netcdf('era5_future_daily.nc')
+    save_daily(ds_out)
+
+def save_daily(ds_out, path=None):
+    path = path or storage.artifact_path('era5_future_daily')
+    print(f"Saving {path}...")
+    storage.write_dataset(ds_out, path)
     print("Done!")
 
 if __name__ == '__main__':
-    mqdm_daily_shift()
+    parser = argparse.ArgumentParser(description='Monthly Quantile Delta Mapping of ERA5 daily Tmax/Tmin.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes for the calendar-month jobs (default: 1, serial).')
+    parser.add_argument('--append', action='store_true',
+                        help='Only update the months affected by new ERA5 days.')
+    parser.add_argument('--regrid', choices=regrid.METHODS, default=None,
+                        help='Compute deltas per GCM cell and regrid them to the ERA5 grid '
+                             '(default: one domain-mean delta curve for all cells).')
+    parser.add_argument('--quantiles', type=int, default=None,
+                        help='Number of quantile levels k/(n+1) (default: 99, i.e. 0.01..0.99).')
+    parser.add_argument('--tails', choices=TAILS, default=None,
+                        help='Ranks outside the quantile grid: nan (default), clamp to the end '
+                             'deltas, or extrapolate linearly.')
+    parser.add_argument('--backend', choices=accel.BACKENDS, default=None,
+                        help='Ranking kernels: numpy (default), numba (parallel, optional dependency) or auto.')
+    args = parser.parse_args()
+    configure_mapping(args.quantiles, args.tails)
+    accel.configure(args.backend)
+    if args.append:
+        mqdm_daily_shift_append(regrid_method=args.regrid)
+    else:
+        mqdm_daily_shift(workers=args.workers, regrid_method=args.regrid)
@@ -1,34 +1,37 @@
-import xarray as xr
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import sys
 
-def plot_diurnal_cycle(hist_file, future_file, output_file='dtr_plot.png'):
-    print("Loading datasets for Diurnal Cycle Plot...")
-    ds_hist = xr.open_dataset(hist_file)
-    ds_fut = xr.open_dataset(future_file)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diurnal_climatology import load_climatology, hourly_cycle, diurnal_range
+
+def plot_diurnal_cycle(hist_file, future_file, output_file='dtr_plot.png', map_file=None):
+    print("Loading diurnal climatologies for Diurnal Cycle Plot...")
+    # Cached (month, hour, lat, lon) climatologies (<dataset>_diurnal.nc), built on first
+    # use; see diurnal_climatology.py
+    clim_hist = load_climatology(hist_file, 'temp_hourly')
+    clim_fut = load_climatology(future_file, 'temp_coherent')
     
     print("Calculating mean diurnal cycle grouped by hour...")
-    # Group by the 'hour' component of the time dimension and calculate the mean
-    # Variable names: temp_hourly for historical, temp_coherent for future
-    # Time coordinate is 'valid_time' instead of 'time'
-    hist_hourly_mean = ds_hist['temp_hourly'].groupby('valid_time.hour').mean(dim=xr.ALL_DIMS)
-    fut_hourly_mean = ds_fut['temp_coherent'].groupby('valid_time.hour').mean(dim=xr.ALL_DIMS)
+    # Count-weighted mean over months and cells (UTC hour of 'valid_time')
+    hist_hourly_mean = hourly_cycle(clim_hist).values
+    fut_hourly_mean = hourly_cycle(clim_fut).values
     
     # Convert from Kelvin to Celsius for better readability in the paper
-    if hist_hourly_mean.mean().values > 200:
+    if np.nanmean(hist_hourly_mean) > 200:
         hist_hourly_mean = hist_hourly_mean - 273.15
         fut_hourly_mean = fut_hourly_mean - 273.15
         ylabel = 'Mean Temperature (°C)'
     else:
         ylabel = 'Mean Temperature'
         
-    hours = hist_hourly_mean['hour'].values
+    hours = np.arange(24)
     
     # Plotting
     plt.figure(figsize=(10, 6))
-    plt.plot(hours, hist_hourly_mean.values, marker='o', linestyle='-', color='#1f77b4', linewidth=2.5, markersize=8, label='Historical Reference (ERA5)')
-    plt.plot(hours, fut_hourly_mean.values, marker='s', linestyle='-', color='#d62728', linewidth=2.5, markersize=8, label='Future Downscaled (Coherent)')
+    plt.plot(hours, hist_hourly_mean, marker='o', linestyle='-', color='#1f77b4', linewidth=2.5, markersize=8, label='Historical Reference (ERA5)')
+    plt.plot(hours, fut_hourly_mean, marker='s', linestyle='-', color='#d62728', linewidth=2.5, markersize=8, label='Future Downscaled (Coherent)')
     
     plt.title('Average Diurnal Temperature Cycle Preservation', fontsize=16, fontweight='bold')
     plt.xlabel('Hour of Day (UTC)', fontsize=14)
@@ -42,11 +45,22 @@ def plot_diurnal_cycle(hist_file, future_file, output_file='dtr_plot.png'):
     plt.legend(fontsize=12, loc='upper left')
     
     # Fill the gap to show the warming delta visually
-    plt.fill_between(hours, hist_hourly_mean.values, fut_hourly_mean.values, color='red', alpha=0.1)
+    plt.fill_between(hours, hist_hourly_mean, fut_hourly_mean, color='red', alpha=0.1)
     
     plt.tight_layout()
     plt.savefig(output_file, dpi=300, bbox_inches='tight')
     print(f"Saved Diurnal Cycle plot to {output_file}")
+    
+    if map_file:
+        # Per-cell change of the diurnal range (annual-mean cycle, future - historical)
+        change = diurnal_range(clim_fut) - diurnal_range(clim_hist)
+        limit = float(np.nanmax(np.abs(change.values))) or 1.0
+        plt.figure(figsize=(9, 6))
+        change.plot(cmap='RdBu_r', vmin=-limit, vmax=limit, cbar_kwargs={'label': 'Change in diurnal range'})
+        plt.title('Per-Cell Change of the Mean Diurnal Range (Future - Historical)', fontsize=14, fontweight='bold')
+        plt.tight_layout()
+        plt.savefig(map_file, dpi=300, bbox_inches='tight')
+        print(f"Saved diurnal range change map to {map_file}")
 
 if __name__ == "__main__":
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -54,6 +68,7 @@ if __name__ == "__main__":
     fut = os.path.join(base_dir, 'era5_spatially_coherent.nc')
     
     if os.path.exists(hist) and os.path.exists(fut):
-        plot_diurnal_cycle(hist, fut, output_file=os.path.join(base_dir, 'paper_plots', 'diurnal_cycle_publication.png'))
+        plot_diurnal_cycle(hist, fut, output_file=os.path.join(base_dir, 'paper_plots', 'diurnal_cycle_publication.png'),
+                           map_file=os.path.join(base_dir, 'paper_plots', 'diurnal_range_change_map.png'))
     else:
         print("Data files not found.")
@@ -1,25 +1,31 @@
-import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+import sys
+import argparse
 
-def plot_qq(hist_file, future_file, output_file='qq_plot.png'):
-    print("Loading datasets for Q-Q Plot...")
-    ds_hist = xr.open_dataset(hist_file)
-    ds_fut = xr.open_dataset(future_file)
-    
-    # Extract values and flatten arrays, removing NaNs
-    hist_vals = ds_hist['temp_hourly'].values.flatten()
-    fut_vals = ds_fut['temp_coherent'].values.flatten()
-    
-    hist_vals = hist_vals[~np.isnan(hist_vals)]
-    fut_vals = fut_vals[~np.isnan(fut_vals)]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stream_stats import load_or_build, sketch_quantiles
+
+def plot_qq(hist_file, future_file, output_file='qq_plot.png', exact=False):
+    print("Loading streamed summaries for Q-Q Plot...")
+    # One-pass summaries (<dataset>_stats.npz), built on first use; see stream_stats.py
+    summary_hist = load_or_build(hist_file, 'temp_hourly')
+    summary_fut = load_or_build(future_file, 'temp_coherent')
     
     print("Calculating quantiles...")
-    # Compute 100 quantiles (1st to 99th percentile)
+    # Compute 100 quantiles (1st to 99th percentile) from the persisted KLL sketches
     quantiles = np.linspace(0.01, 0.99, 100)
-    q_hist = np.quantile(hist_vals, quantiles)
-    q_fut = np.quantile(fut_vals, quantiles)
+    q_hist = sketch_quantiles(summary_hist, quantiles)
+    q_fut = sketch_quantiles(summary_fut, quantiles)
+    
+    if exact:
+        # Regression check: exact quantiles (one more streamed pass, every value kept)
+        exact_hist = sketch_quantiles(load_or_build(hist_file, 'temp_hourly', exact=True), quantiles)
+        exact_fut = sketch_quantiles(load_or_build(future_file, 'temp_coherent', exact=True), quantiles)
+        print(f"Max |sketch - exact|: historical {np.max(np.abs(q_hist - exact_hist)):.4f}, "
+              f"future {np.max(np.abs(q_fut - exact_fut)):.4f}")
+        q_hist, q_fut = exact_hist, exact_fut
     
     # Plotting
     plt.figure(figsize=(8, 8))
@@ -41,11 +47,16 @@ def plot_qq(hist_file, future_file, output_file='qq_plot.png'):
     print(f"Saved Q-Q plot to {output_file}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Q-Q plot of historical vs future coherent temperatures.')
+    parser.add_argument('--exact', action='store_true',
+                        help='Use exact quantiles (slow) and report the sketch error.')
+    args = parser.parse_args()
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     hist = os.path.join(base_dir, 'era5_clean.nc')
     fut = os.path.join(base_dir, 'era5_spatially_coherent.nc')
     
     if os.path.exists(hist) and os.path.exists(fut):
-        plot_qq(hist, fut, output_file=os.path.join(base_dir, 'paper_plots', 'qq_plot_publication.png'))
+        plot_qq(hist, fut, output_file=os.path.join(base_dir, 'paper_plots', 'qq_plot_publication.png'),
+                exact=args.exact)
     else:
         print("Data files not found. Please ensure era5_clean.nc and era5_spatially_coherent.nc exist in the root directory.")
@@ -2,6 +2,10 @@ import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from taylor_stats import taylor_time_series, pooled, seasonal_hourly, SEASONS
 
 try:
     import skill_metrics as sm
@@ -10,42 +14,31 @@ except ImportError:
     print("Please install it by running: pip install SkillMetrics")
     exit(1)
 
-def plot_taylor(ref_file, fut_before_file, fut_after_file, output_file='taylor_diagram.png'):
+def plot_taylor(ref_file, fut_before_file, fut_after_file, output_file='taylor_diagram.png',
+                distribution_file=None):
     print("Loading datasets for Taylor Diagram...")
     ds_ref = xr.open_dataset(ref_file)
     ds_before = xr.open_dataset(fut_before_file)
     ds_after = xr.open_dataset(fut_after_file)
     
-    # Pick a specific time index to compare spatial coherence
-    time_idx = 0
-    ref_vals = ds_ref['temp_hourly'].isel(valid_time=time_idx).values.flatten()
-    before_vals = ds_before['temp_future'].isel(valid_time=time_idx).values.flatten()
-    after_vals = ds_after['temp_coherent'].isel(valid_time=time_idx).values.flatten()
-    
-    # Remove NaNs
-    valid_idx = ~np.isnan(ref_vals) & ~np.isnan(before_vals) & ~np.isnan(after_vals)
-    ref_valid = ref_vals[valid_idx]
-    before_valid = before_vals[valid_idx]
-    after_valid = after_vals[valid_idx]
-    
-    # Compare anomalies (value - mean)
-    ref_anom = ref_valid - np.mean(ref_valid)
-    before_anom = before_valid - np.mean(before_valid)
-    after_anom = after_valid - np.mean(after_valid)
-    
-    sdev = np.array([np.std(ref_anom), np.std(before_anom), np.std(after_anom)])
-    
-    crmsd = np.array([0.0, 
-                      np.sqrt(np.mean((before_anom - ref_anom)**2)), 
-                      np.sqrt(np.mean((after_anom - ref_anom)**2))])
+    # Spatial-pattern statistics at every time step (row-wise over the (T, S) matrix,
+    # streamed in blocks; see taylor_stats.py)
+    print("Computing Taylor statistics for every time step...")
+    ds_stats = taylor_time_series(ds_ref['temp_hourly'],
+                                  {'before': ds_before['temp_future'], 'after': ds_after['temp_coherent']})
     
-    ccoef = np.array([1.0, 
-                      np.corrcoef(ref_anom, before_anom)[0,1], 
-                      np.corrcoef(ref_anom, after_anom)[0,1]])
+    # One point per field: variances / covariances pooled over all time steps
+    point = pooled(ds_stats, ['before', 'after'])
+    sdev = np.array([point['sdev_ref'], point['sdev_before'], point['sdev_after']])
+    crmsd = np.array([0.0, point['crmsd_before'], point['crmsd_after']])
+    ccoef = np.array([1.0, point['corr_before'], point['corr_after']])
     
     print("\nCalculated Metrics:")
     print(f"Standard Deviations: Reference={sdev[0]:.2f}, Before={sdev[1]:.2f}, After={sdev[2]:.2f}")
     print(f"Correlations: Reference={ccoef[0]:.2f}, Before={ccoef[1]:.2f}, After={ccoef[2]:.2f}")
+    for label in ['before', 'after']:
+        q = np.nanquantile(ds_stats[f'corr_{label}'].values, [0.05, 0.5, 0.95])
+        print(f"Per-step correlation ({label}): median={q[1]:.3f}, 5-95%=[{q[0]:.3f}, {q[2]:.3f}]")
     
     markers = {
         'Historical Reference': {'labelColor': 'r', 'symbol': 'o', 'size': 15, 'faceColor': 'r', 'edgeColor': 'r'},
@@ -63,6 +56,49 @@ def plot_taylor(ref_file, fut_before_file, fut_after_file, output_file='taylor_d
     plt.title('Taylor Diagram: Spatial Coherence Validation', y=1.08, fontsize=16, fontweight='bold')
     plt.savefig(output_file, dpi=300, bbox_inches='tight')
     print(f"\nSaved Taylor Diagram to {output_file}")
+    
+    if distribution_file:
+        plot_distributions(ds_stats, distribution_file)
+
+def plot_distributions(ds_stats, output_file):
+    # Distributions over all time steps and (season, hour) means of the per-step statistics
+    colors = {'before': 'b', 'after': 'g'}
+    names = {'before': 'Before Shuffle (Broken)', 'after': 'After Shuffle (Coherent)'}
+    fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+    
+    bins = np.linspace(-1, 1, 101)
+    for label in ['before', 'after']:
+        axes[0].hist(ds_stats[f'corr_{label}'].values, bins=bins, density=True, alpha=0.5,
+                     color=colors[label], label=names[label])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = ds_stats[f'crmsd_{label}'].values / ds_stats['sdev_ref'].values
+        axes[1].hist(ratio[np.isfinite(ratio)], bins=100, density=True, alpha=0.5,
+                     color=colors[label], label=names[label])
+    axes[0].set_xlabel('Spatial correlation with ERA5 (per time step)')
+    axes[1].set_xlabel('Centered RMSD / reference std (per time step)')
+    for ax in axes[:2]:
+        ax.set_ylabel('Density')
+        ax.legend()
+        ax.grid(True, linestyle='--', alpha=0.6)
+    
+    means = seasonal_hourly(ds_stats)
+    styles = dict(zip(SEASONS, ['-', '--', '-.', ':']))
+    for label in ['before', 'after']:
+        for season in SEASONS:
+            sel = means['season'].values == season
+            axes[2].plot(means['hour'].values[sel], means[f'corr_{label}'].values[sel],
+                         linestyle=styles[season], color=colors[label], label=f"{label} {season}")
+    axes[2].set_xlabel('Hour of Day (UTC)')
+    axes[2].set_ylabel('Mean spatial correlation')
+    axes[2].set_xticks(np.arange(0, 24, 3))
+    axes[2].legend(fontsize=8, ncol=2)
+    axes[2].grid(True, linestyle='--', alpha=0.6)
+    
+    fig.suptitle(f"Taylor Statistics over {ds_stats.sizes['valid_time']} Time Steps", fontsize=16, fontweight='bold')
+    fig.tight_layout()
+    fig.savefig(output_file, dpi=300, bbox_inches='tight')
+    print(f"Saved Taylor statistics distributions to {output_file}")
+    plt.close(fig)
 
 if __name__ == "__main__":
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -71,6 +107,7 @@ if __name__ == "__main__":
     after = os.path.join(base_dir, 'era5_spatially_coherent.nc')
     
     if all(os.path.exists(f) for f in [ref, before, after]):
-        plot_taylor(ref, before, after, output_file=os.path.join(base_dir, 'paper_plots', 'taylor_diagram_publication.png'))
+        plot_taylor(ref, before, after, output_file=os.path.join(base_dir, 'paper_plots', 'taylor_diagram_publication.png'),
+                    distribution_file=os.path.join(base_dir, 'paper_plots', 'taylor_statistics_distributions.png'))
     else:
         print("Data files not found. Ensure era5_clean.nc, era5_future_hourly.nc, and era5_spatially_coherent.nc exist.")
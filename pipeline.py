@@ -0,0 +1,299 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+
+import storage
+import accel
+
+# Dependency-aware pipeline driver (replaces the unconditional steps of run_pipeline.sh).
+# Every stage declares its inputs (data + code) and outputs. A stage is rerun only if an
+# output is missing or an input fingerprint changed since its last successful run.
+# All stages run in this one process, so xarray is imported once and files/daily
+# extremes opened by one stage are reused by the next (see storage.py).
+
+STATE_FILE = '.pipeline_state.json'
+
+def _run_merge(append=False):
+    from merge_era5 import merge_era5
+    merge_era5(append=append)
+
+def _run_mqdm(append=False):
+    from mqdm_daily_shift import mqdm_daily_shift, mqdm_daily_shift_append
+    if append:
+        mqdm_daily_shift_append()
+    else:
+        mqdm_daily_shift()
+
+def _run_reconstruct(append=False):
+    from reconstruct_hourly import reconstruct_hourly, reconstruct_hourly_append
+    if append:
+        reconstruct_hourly_append()
+    else:
+        reconstruct_hourly()
+
+def _run_validate():
+    from validate_and_break import validate_and_break
+    validate_and_break()
+
+def _run_schaake(append=False):
+    from schaake_shuffle import schaake_shuffle, schaake_shuffle_append
+    if append:
+        schaake_shuffle_append()
+    else:
+        schaake_shuffle()
+
+def _run_diagnostics():
+    from spatial_diagnostics import run_diagnostics
+    run_diagnostics()
+
+def run_fused(keep_intermediates=False):
+    # MQDM -> hourly reconstruction -> validation -> Schaake Shuffle with the arrays
+    # handed over in memory. No compress/decompress round-trip of the hourly cube:
+    # only era5_spatially_coherent (and the plots) are written, plus the
+    # intermediates if requested.
+    from daily_extremes import daily_extremes, get_time_name
+    from mqdm_daily_shift import compute_daily_shift, save_daily
+    from reconstruct_hourly import compute_hourly, save_hourly
+    from validate_and_break import validate_and_break
+    from schaake_shuffle import compute_coherent, save_coherent, verify_coherence
+
+    print("Loading datasets...")
+    era5_path = storage.artifact_path('era5_clean')
+    ds_era5 = storage.open_dataset(era5_path)
+    ds_hist = storage.open_dataset('cmip6_hist_clean.nc')
+    ds_fut = storage.open_dataset('cmip6_clean.nc')
+    era5_daily = storage.cached('daily_extremes', era5_path,
+                                lambda: daily_extremes(ds_era5['temp_hourly'], get_time_name(ds_era5)))
+
+    ds_daily = compute_daily_shift(ds_era5, ds_hist, ds_fut, era5_daily)
+    ds_hourly = compute_hourly(ds_era5, ds_daily, era5_daily)
+    # Materialize once; validation and the shuffle both read it
+    ds_hourly = ds_hourly.load()
+
+    if keep_intermediates:
+        save_daily(ds_daily)
+        save_hourly(ds_hourly)
+
+    validate_and_break(ds_era5, ds_hourly)
+
+    ds_coherent = compute_coherent(ds_era5, ds_hourly)
+    save_coherent(ds_coherent)
+    verify_coherence()
+
+STAGE_NAMES = ['merge', 'mqdm', 'reconstruct', 'validate', 'schaake', 'diagnostics']
+
+def pipeline_stages(append=False):
+    # Built on demand so artifact paths follow the configured store format.
+    # append: stages with an incremental mode only update the steps affected by
+    # new ERA5 months (see incremental.py).
+    A = storage.artifact_path
+    return [
+        {
+            'name': 'merge',
+            'phase': '3.1',
+            'run': lambda: _run_merge(append),
+            'inputs': ['data/raw/era5_2m_temperature_*.nc', 'merge_era5.py'],
+            'outputs': [A('era5_clean')],
+        },
+        {
+            'name': 'mqdm',
+            'phase': '3.1',
+            'run': lambda: _run_mqdm(append),
+            'inputs': [A('era5_clean'), 'cmip6_hist_clean.nc', 'cmip6_clean.nc',
+                       'mqdm_daily_shift.py', 'qdm_engine.py', 'quantile_mapping.py', 'daily_extremes.py', 'incremental.py',
+                       'delta_cache.py', 'regrid.py'],
+            'outputs': [A('era5_future_daily')],
+        },
+        {
+            'name': 'reconstruct',
+            'phase': '3.2',
+            'run': lambda: _run_reconstruct(append),
+            'inputs': [A('era5_clean'), A('era5_future_daily'),
+                       'reconstruct_hourly.py', 'daily_extremes.py', 'incremental.py'],
+            'outputs': [A('era5_future_hourly')],
+        },
+        {
+            'name': 'validate',
+            'phase': '4',
+            'run': _run_validate,
+            'inputs': [A('era5_clean'), A('era5_future_hourly'), 'validate_and_break.py',
+                       'spatial_diagnostics.py'],
+            'outputs': ['validation_histogram.png', 'spatial_break_analysis.png'],
+        },
+        {
+            'name': 'schaake',
+            'phase': '5',
+            'run': lambda: _run_schaake(append),
+            'inputs': [A('era5_clean'), A('era5_future_hourly'), 'schaake_shuffle.py', 'incremental.py'],
+            'outputs': [A('era5_spatially_coherent')],
+        },
+        {
+            'name': 'diagnostics',
+            'phase': '5',
+            'run': _run_diagnostics,
+            'inputs': [A('era5_clean'), A('era5_future_hourly'), A('era5_spatially_coherent'),
+                       'spatial_diagnostics.py'],
+            'outputs': ['spatial_diagnostics.json', 'spatial_coherence_diagnostics.png'],
+        },
+    ]
+
+def fused_stages(keep_intermediates=False):
+    # merge, then one stage covering mqdm + reconstruct + validate + schaake
+    A = storage.artifact_path
+    stages = pipeline_stages()
+    intermediates = [A('era5_future_daily'), A('era5_future_hourly')]
+    outputs = [A('era5_spatially_coherent'), 'validation_histogram.png', 'spatial_break_analysis.png']
+    if keep_intermediates:
+        outputs += intermediates
+    inputs = []
+    # (diagnostics reads the hourly intermediate from disk, so it is not part of --fused)
+    for stage in stages[1:5]:
+        inputs += [p for p in stage['inputs'] if p not in inputs and p not in intermediates]
+    fused = {
+        'name': 'fused',
+        'phase': '3-5',
+        'run': lambda: run_fused(keep_intermediates),
+        'inputs': inputs + ['pipeline.py', 'storage.py'],
+        'outputs': outputs,
+    }
+    return [stages[0], fused]
+
+def _content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _files(path):
+    # A Zarr store is a directory: fingerprint every file inside it
+    if not os.path.isdir(path):
+        return [path]
+    found = []
+    for root, _, names in os.walk(path):
+        found += [os.path.join(root, n) for n in names]
+    return sorted(found)
+
+def fingerprint(patterns, use_hash=False):
+    # {path: fingerprint} for every file matched by the input patterns.
+    # mtime/size by default (cheap); content hash with use_hash (robust to touch/copy).
+    prints = {}
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            prints[pattern] = None
+        for path in [f for match in matches for f in _files(match)]:
+            if use_hash:
+                prints[path] = _content_hash(path)
+            else:
+                stat = os.stat(path)
+                prints[path] = [stat.st_size, stat.st_mtime_ns]
+    return prints
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+def save_state(state):
+    tmp_path = STATE_FILE + '.part'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, STATE_FILE)
+
+def stale_reason(stage, state, use_hash=False):
+    # Why the stage must run, or None if it is up to date
+    missing = [p for p in stage['outputs'] if not os.path.exists(p)]
+    if missing:
+        return f"missing output {missing[0]}"
+    previous = state.get(stage['name'])
+    if previous is None:
+        return "never run"
+    current = fingerprint(stage['inputs'], use_hash)
+    if previous.get('inputs') != current:
+        changed = sorted(p for p in set(current) | set(previous.get('inputs', {}))
+                         if current.get(p) != previous.get('inputs', {}).get(p))
+        return f"input changed: {changed[0]}"
+    return None
+
+def run_pipeline(only=None, force=False, use_hash=False, dry_run=False,
+                 fused=False, keep_intermediates=False, store_format=None, compressor=None,
+                 append=False, backend=None):
+    storage.configure(store_format, compressor)
+    accel.configure(backend)
+    if fused and append:
+        raise ValueError("--append updates the stored intermediates; it cannot be combined with --fused")
+    state = load_state()
+    timings = []
+    stages = fused_stages(keep_intermediates) if fused else pipeline_stages(append)
+
+    for stage in stages:
+        if only and stage['name'] not in only:
+            continue
+
+        reason = "forced" if force else stale_reason(stage, state, use_hash)
+        if reason is None:
+            print(f"[Phase {stage['phase']}] {stage['name']}: up to date, skipping.")
+            timings.append((stage['name'], 'skipped', 0.0))
+            continue
+
+        print(f"\n[Phase {stage['phase']}] {stage['name']}: running ({reason})...")
+        if dry_run:
+            timings.append((stage['name'], 'would run', 0.0))
+            continue
+
+        # Drop cached handles of files this stage is about to rewrite
+        for output in stage['outputs']:
+            storage.invalidate(output)
+
+        t0 = time.perf_counter()
+        stage['run']()
+        elapsed = time.perf_counter() - t0
+
+        missing = [p for p in stage['outputs'] if not os.path.exists(p)]
+        if missing:
+            print(f"Error: stage '{stage['name']}' did not produce {missing}. Stopping.")
+            timings.append((stage['name'], 'failed', elapsed))
+            break
+
+        state[stage['name']] = {
+            'inputs': fingerprint(stage['inputs'], use_hash),
+            'seconds': round(elapsed, 3),
+        }
+        save_state(state)
+        timings.append((stage['name'], 'ran', elapsed))
+
+    print("\n--- Stage Timings ---")
+    for name, status, elapsed in timings:
+        print(f"{name:<12} {status:<10} {elapsed:9.2f} s")
+    return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental MQDM pipeline runner.')
+    parser.add_argument('--only', nargs='+', choices=STAGE_NAMES + ['fused'],
+                        help='Run only these stages.')
+    parser.add_argument('--force', action='store_true', help='Rerun stages even if up to date.')
+    parser.add_argument('--hash', action='store_true',
+                        help='Fingerprint inputs by content hash instead of mtime/size.')
+    parser.add_argument('--dry-run', action='store_true', help='Only report which stages would run.')
+    parser.add_argument('--fused', action='store_true',
+                        help='Run MQDM -> reconstruction -> Schaake in memory, writing only the final output.')
+    parser.add_argument('--keep-intermediates', action='store_true',
+                        help='With --fused, also write era5_future_daily.nc and era5_future_hourly.nc.')
+    parser.add_argument('--format', choices=['netcdf', 'zarr'], default=None,
+                        help='Storage format for pipeline artifacts (default: netcdf).')
+    parser.add_argument('--compressor', choices=['zlib', 'lz4', 'none'], default=None,
+                        help='Compressor for pipeline artifacts (default: zlib level 5).')
+    parser.add_argument('--backend', choices=accel.BACKENDS, default=None,
+                        help='Ranking / reorder kernels: numpy (default), numba or auto.')
+    parser.add_argument('--append', action='store_true',
+                        help='Update existing outputs with new ERA5 months instead of recomputing them.')
+    args = parser.parse_args()
+    run_pipeline(only=args.only, force=args.force, use_hash=args.hash, dry_run=args.dry_run,
+                 fused=args.fused, keep_intermediates=args.keep_intermediates,
+                 store_format=args.format, compressor=args.compressor, append=args.append,
+                 backend=args.backend)
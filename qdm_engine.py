@@ -0,0 +1,179 @@
+import numpy as np
+
+import accel
+from quantile_mapping import interp_weights, lookup, lookup_field
+
+# Vectorized Monthly Quantile Delta Mapping engine.
+# Works on plain NumPy arrays so all 12 months are handled without
+# per-month xarray .sel / quantile / rank / interp / concat round-trips.
+
+MONTHS = np.arange(1, 13)
+
+
+def month_of(times):
+    # Calendar month (1..12) of each timestamp: datetime64, or cftime objects
+    # (noleap / 360_day CMIP6 calendars), which cannot be cast to datetime64
+    times = np.asarray(times)
+    if times.dtype == object:
+        return np.fromiter((t.month for t in times.ravel()), dtype='int64',
+                           count=times.size).reshape(times.shape)
+    times = times.astype('datetime64[M]')
+    return (times.astype('int64') % 12) + 1
+
+
+def monthly_quantiles(series, months, quantiles):
+    # Quantile table (12, n_quantiles) of a 1D series for every calendar month.
+    # One lexsort orders the whole series by (month, value); each month is then a
+    # contiguous sorted segment and its quantiles are just index arithmetic
+    # (linear interpolation, same definition as np.quantile / xarray .quantile).
+    series = np.asarray(series, dtype='float64')
+    months = np.asarray(months)
+    quantiles = np.asarray(quantiles, dtype='float64')
+
+    valid = ~np.isnan(series)
+    series = series[valid]
+    months = months[valid]
+
+    order = np.lexsort((series, months))
+    sorted_vals = series[order]
+
+    counts = np.bincount(months, minlength=13)[1:]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    table = np.full((12, quantiles.size), np.nan)
+    has_data = counts > 0
+    if not has_data.any():
+        return table
+
+    # Fractional position of every quantile inside every month segment
+    n = counts[has_data][:, np.newaxis]
+    pos = quantiles[np.newaxis, :] * (n - 1)
+    lo = np.floor(pos).astype('int64')
+    hi = np.minimum(lo + 1, n - 1)
+    frac = pos - lo
+
+    base = starts[has_data][:, np.newaxis]
+    v_lo = sorted_vals[base + lo]
+    v_hi = sorted_vals[base + hi]
+    table[has_data] = v_lo + (v_hi - v_lo) * frac
+    return table
+
+
+def monthly_delta_table(hist_series, hist_months, fut_series, fut_months, quantiles):
+    # Delta(month, tau) = Q_fut(month, tau) - Q_hist(month, tau)
+    Q_hist = monthly_quantiles(hist_series, hist_months, quantiles)
+    Q_fut = monthly_quantiles(fut_series, fut_months, quantiles)
+    return Q_fut - Q_hist
+
+
+def pct_rank(data, axis=0):
+    # Percentage rank along `axis` with average ranks for ties and NaNs ignored,
+    # i.e. the same as xarray's DataArray.rank(pct=True), from a single argsort.
+    if accel.use_numba():
+        return accel.pct_rank(data, axis)
+    data = np.moveaxis(np.asarray(data, dtype='float64'), axis, 0)
+    n = data.shape[0]
+
+    order = np.argsort(data, axis=0, kind='stable') # NaNs sort last
+    s = np.take_along_axis(data, order, axis=0)
+
+    idx = np.arange(n).reshape((n,) + (1,) * (data.ndim - 1))
+    idx = np.broadcast_to(idx, s.shape)
+
+    # Tie runs: first and last sorted position of every run of equal values
+    new_run = np.ones(s.shape, dtype=bool)
+    new_run[1:] = s[1:] != s[:-1]
+    end_run = np.ones(s.shape, dtype=bool)
+    end_run[:-1] = new_run[1:]
+    first = np.maximum.accumulate(np.where(new_run, idx, 0), axis=0)
+    last = np.minimum.accumulate(np.where(end_run, idx, n - 1)[::-1], axis=0)[::-1]
+
+    valid_count = (~np.isnan(data)).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_sorted = ((first + last) / 2.0 + 1.0) / valid_count
+    pct_sorted[np.isnan(s)] = np.nan
+
+    ranks = np.empty_like(pct_sorted)
+    np.put_along_axis(ranks, order, pct_sorted, axis=0)
+    return np.moveaxis(ranks, 0, axis)
+
+
+def monthly_ranks(data, months):
+    # Per-cell pct ranks of a (time, ...) array, ranked within each calendar month.
+    # Written back in the original time order.
+    data = np.asarray(data)
+    ranks = np.full(data.shape, np.nan)
+    for month in MONTHS:
+        idx = np.flatnonzero(months == month)
+        if idx.size == 0:
+            continue
+        ranks[idx] = pct_rank(data[idx], axis=0)
+    return ranks
+
+
+def apply_delta(data, ranks, months, delta_table, quantiles, tail='nan'):
+    # data + Delta(month, rank), linear in the quantile grid.
+    # Ranks outside the grid: see quantile_mapping.TAILS (default NaN, same
+    # behaviour as xarray .interp).
+    out = np.full(data.shape, np.nan)
+    for month in MONTHS:
+        idx = np.flatnonzero(months == month)
+        if idx.size == 0:
+            continue
+        lo, w = interp_weights(ranks[idx], quantiles, tail)
+        out[idx] = data[idx] + lookup(delta_table[month - 1], lo, w)
+    return out
+
+
+def qdm_shift(data, months, delta_table, quantiles, tail='nan'):
+    # Full MQDM shift of a (time, lat, lon) daily array in one call.
+    ranks = monthly_ranks(data, months)
+    return apply_delta(data, ranks, months, delta_table, quantiles, tail)
+
+
+def apply_delta_members(data, ranks, months, delta_tables, quantiles, tail='nan'):
+    # apply_delta() for a stack of delta tables (member, 12, n_quantiles) at once:
+    # the ranks and their position in the quantile grid are computed once and shared
+    # by all members. Returns (member,) + data.shape.
+    delta_tables = np.asarray(delta_tables)
+    out = np.full((delta_tables.shape[0],) + data.shape, np.nan)
+    for month in MONTHS:
+        idx = np.flatnonzero(months == month)
+        if idx.size == 0:
+            continue
+        lo, w = interp_weights(ranks[idx], quantiles, tail)
+        # (member, n_quantiles) curves evaluated at the shared positions
+        out[:, idx] = data[idx] + lookup(delta_tables[:, month - 1], lo, w)
+    return out
+
+
+def cell_delta_table(hist, hist_months, fut, fut_months, quantiles):
+    # Delta table per grid cell: (12, n_quantiles, ...) from (time, ...) CMIP6 arrays.
+    # GCM grids are coarse, so a loop over cells is cheap.
+    hist = np.asarray(hist)
+    fut = np.asarray(fut)
+    spatial = hist.shape[1:]
+    table = np.full((12, np.size(quantiles)) + spatial, np.nan)
+    for cell in np.ndindex(*spatial):
+        table[(slice(None), slice(None)) + cell] = monthly_delta_table(
+            hist[(slice(None),) + cell], hist_months, fut[(slice(None),) + cell], fut_months, quantiles)
+    return table
+
+
+def apply_delta_field(data, ranks, months, delta_field, quantiles, tail='nan'):
+    # apply_delta() with a delta curve per cell: delta_field is (12, n_quantiles, ...)
+    # on the grid of data[0]. The quantile lookup is vectorized over all cells.
+    out = np.full(data.shape, np.nan)
+    for month in MONTHS:
+        idx = np.flatnonzero(months == month)
+        if idx.size == 0:
+            continue
+        lo, w = interp_weights(ranks[idx], quantiles, tail)
+        out[idx] = data[idx] + lookup_field(delta_field[month - 1], lo, w)
+    return out
+
+
+def qdm_shift_field(data, months, delta_field, quantiles, tail='nan'):
+    # qdm_shift() with spatially resolved deltas (see apply_delta_field)
+    ranks = monthly_ranks(data, months)
+    return apply_delta_field(data, ranks, months, delta_field, quantiles, tail)
@@ -0,0 +1,58 @@
+import numpy as np
+
+# Quantile-mapping kernels shared by the QDM engine.
+# Looking up a delta curve at the empirical CDF value (pct rank) of each observation is
+# a piecewise-linear interpolation on the quantile grid. The bracketing grid interval is
+# found with one searchsorted (O(log n_quantiles) per value), so fine grids such as
+# 1000 levels cost about the same as the default 99. The position in the grid does not
+# depend on the curve, so it can be computed once and reused for many curves (members,
+# cells).
+#
+# Tails: ranks below the first / above the last grid level are
+#   'nan'          NaN (the behaviour of xarray .interp, and the default)
+#   'clamp'        the end value of the curve
+#   'extrapolate'  linear continuation of the first / last grid interval
+
+TAILS = ('nan', 'clamp', 'extrapolate')
+
+
+def quantile_grid(n_quantiles=99):
+    # n equally spaced levels k / (n + 1), k = 1..n: 99 -> 0.01 .. 0.99
+    return np.arange(1, n_quantiles + 1) / (n_quantiles + 1)
+
+
+def interp_weights(x, xp, tail='nan'):
+    # Bracketing indices lo and weights w such that the interpolated value of a curve
+    # fp is fp[lo] * (1 - w) + fp[lo + 1] * w (np.interp for tail='clamp').
+    if tail not in TAILS:
+        raise ValueError(f"Unknown tail option: {tail} (expected one of {TAILS})")
+    x = np.asarray(x, dtype='float64')
+    xp = np.asarray(xp, dtype='float64')
+    if tail == 'clamp':
+        x = np.clip(x, xp[0], xp[-1])
+    lo = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, xp.size - 2)
+    with np.errstate(invalid='ignore'):
+        w = (x - xp[lo]) / (xp[lo + 1] - xp[lo])
+        if tail == 'nan':
+            w[~((x >= xp[0]) & (x <= xp[-1]))] = np.nan
+    return lo, w
+
+
+def lookup(fp, lo, w, axis=-1):
+    # Evaluate curve(s) fp at precomputed (lo, w). fp's `axis` is the quantile axis;
+    # leading axes of fp (e.g. members) are kept in front of lo's shape.
+    fp = np.moveaxis(np.asarray(fp), axis, -1)
+    return fp[..., lo] * (1 - w) + fp[..., lo + 1] * w
+
+
+def map_quantiles(x, xp, fp, tail='nan'):
+    # Value of the curve fp (defined on quantile grid xp) at the pct ranks x
+    lo, w = interp_weights(x, xp, tail)
+    return lookup(fp, lo, w)
+
+
+def lookup_field(field, lo, w):
+    # Evaluate one curve per cell: field is (n_quantiles, ...) and lo/w are
+    # (n, ...) on the same cells
+    return (np.take_along_axis(field, lo, axis=0) * (1 - w)
+            + np.take_along_axis(field, lo + 1, axis=0) * w)
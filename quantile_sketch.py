@@ -0,0 +1,155 @@
+import numpy as np
+
+# Mergeable KLL quantile sketch (Karnin, Lang & Liberty 2016).
+#
+# Values are kept in a stack of compactors. Level h holds items of weight 2^h. When a
+# level exceeds its capacity it is sorted and every other item (random offset) is
+# promoted to the next level. This halves the number of items but keeps the total
+# weight. Capacities shrink geometrically (factor 2/3) towards the lower levels, so
+# the sketch stays at about 3k items no matter how many values it has seen.
+# Sketches of different chunks, workers or cell partitions merge by concatenating
+# levels and compacting again.
+#
+# Rank error: with k=200 the normalized rank error of a single quantile is about 1.3%
+# with 99% confidence (error_bound(); the same empirical fit that Apache DataSketches
+# uses for KLL). benchmarks/bench_quantile_sketch.py checks this against np.quantile.
+#
+# exact=True keeps every value (no compaction). quantile() then equals np.quantile,
+# and that mode is kept for regression comparisons.
+
+DEFAULT_K = 200
+CAPACITY_DECAY = 2.0 / 3.0
+MIN_CAPACITY = 2
+
+
+class QuantileSketch:
+    def __init__(self, k=DEFAULT_K, exact=False, seed=0):
+        self.k = int(k)
+        self.exact = exact
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self._rng = np.random.default_rng(seed)
+        self._chunks = []          # exact mode: values are concatenated only when queried
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(MIN_CAPACITY, int(np.ceil(self.k * CAPACITY_DECAY ** depth)))
+
+    def update(self, values):
+        # Add a chunk of values (any shape); NaNs are ignored
+        values = np.asarray(values, dtype='float64').ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.n += values.size
+        self.vmin = min(self.vmin, float(values.min()))
+        self.vmax = max(self.vmax, float(values.max()))
+        if self.exact:
+            self._chunks.append(values)
+            return self
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        if other.exact != self.exact:
+            raise ValueError("Cannot merge an exact and an approximate quantile sketch")
+        if self.exact:
+            self._chunks.extend(other._chunks + [other.levels[0]])
+            self.n += other.n
+            self.vmin = min(self.vmin, other.vmin)
+            self.vmax = max(self.vmax, other.vmax)
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        self._compress()
+        return self
+
+    def _flush(self):
+        if self._chunks:
+            self.levels[0] = np.concatenate([self.levels[0]] + self._chunks)
+            self._chunks = []
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if items.size > self.capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays at this level
+                keep = items[:items.size % 2]
+                promoted = items[keep.size + self._rng.integers(2)::2]
+                self.levels[h] = keep
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def weighted_items(self):
+        # Sorted items and their cumulative weights
+        self._flush()
+        weights = np.concatenate([np.full(items.size, 2.0 ** h) for h, items in enumerate(self.levels)])
+        items = np.concatenate(self.levels)
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        q = np.asarray(q, dtype='float64')
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        if self.exact:
+            self._flush()
+            return np.quantile(self.levels[0], q)
+        items, cum = self.weighted_items()
+        idx = np.searchsorted(cum, q * cum[-1], side='left')
+        out = items[np.clip(idx, 0, items.size - 1)]
+        out = np.where(q <= 0, self.vmin, out)
+        return np.where(q >= 1, self.vmax, out)
+
+    def rank(self, x):
+        # Approximate fraction of values <= x
+        if self.n == 0:
+            return np.full(np.shape(x), np.nan)
+        items, cum = self.weighted_items()
+        idx = np.searchsorted(items, x, side='right')
+        return np.where(idx > 0, cum[np.maximum(idx - 1, 0)], 0.0) / cum[-1]
+
+    def error_bound(self):
+        # Normalized rank error of a single quantile (99% confidence); 0 in exact mode
+        if self.exact or self.n <= self.k:
+            return 0.0
+        return 2.296 / self.k ** 0.9723
+
+    def num_retained(self):
+        self._flush()
+        return int(sum(items.size for items in self.levels))
+
+    def to_arrays(self, prefix='sketch_'):
+        self._flush()
+        return {prefix + 'items': np.concatenate(self.levels),
+                prefix + 'level_sizes': np.array([items.size for items in self.levels]),
+                prefix + 'meta': np.array([self.k, int(self.exact), self.n, self.vmin, self.vmax])}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix='sketch_'):
+        k, exact, n, vmin, vmax = arrays[prefix + 'meta']
+        sketch = cls(int(k), exact=bool(exact))
+        bounds = np.cumsum(arrays[prefix + 'level_sizes'])[:-1]
+        sketch.levels = list(np.split(np.asarray(arrays[prefix + 'items'], dtype='float64'), bounds))
+        sketch.n, sketch.vmin, sketch.vmax = int(n), float(vmin), float(vmax)
+        return sketch
+
+    def save(self, path):
+        np.savez_compressed(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls.from_arrays(data)
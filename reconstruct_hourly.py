@@ -1,28 +1,26 @@
 import xarray as xr
 import numpy as np
+import argparse
 
-def reconstruct_hourly():
-    print("Starting Hourly Reconstruction...")
-    
-    # 1. Load Data
-    print("Loading datasets...")
-    # Historical Hourly
-    ds_obs = xr.open_dataset('era5_clean.nc', engine='netcdf4')
-    # Future Daily (Shifted)
-    ds_fut_daily = xr.open_dataset('era5_future_daily.nc', engine='netcdf4')
-    
-    # Check variable name
+import storage
+import alpha_store
+from incremental import last_time, dirty_mask, contiguous_runs
+from daily_extremes import daily_extremes, get_time_name, daily_view
+
+def diurnal_alpha(ds_obs, obs_daily=None):
+    # Observed diurnal shape factor on the hourly axis of ds_obs.
+    # Only depends on ERA5, so it is shared by all ensemble members (ensemble.py).
+    # obs_daily: precomputed daily_extremes() of ds_obs, if already available.
     var_name_obs = 'temp_hourly'
-    if var_name_obs not in ds_obs:
-        print(f"Error: Variable {var_name_obs} not found in era5_clean.nc")
-        return
 
     # 2. Compute Observed Daily Statistics
     print("Computing observed daily Tmax/Tmin...")
     # We need to map these back to hourly
-    # Resample to daily
-    obs_tmax_daily = ds_obs[var_name_obs].resample(valid_time='1D').max()
-    obs_tmin_daily = ds_obs[var_name_obs].resample(valid_time='1D').min()
+    # Daily extremes in a single pass (gap-tolerant if the hourly axis has gaps)
+    if obs_daily is None:
+        obs_daily = daily_extremes(ds_obs[var_name_obs], 'valid_time')
+    obs_tmax_daily = obs_daily['tmax']
+    obs_tmin_daily = obs_daily['tmin']
     
     # 3. Broadcast Daily Observed to Hourly
     print("Broadcasting daily observed stats to hourly...")
@@ -49,7 +47,14 @@ def reconstruct_hourly():
     # If DTR is 0, temp is constant, so alpha is irrelevant if we map correctly.
     # But usually we can set alpha to 0.5 or just 0. Let's use 0.
     alpha = alpha.fillna(0)
-    
+    return alpha
+
+def compute_hourly(ds_obs, ds_fut_daily, obs_daily=None, alpha=None):
+    # In-memory core of the reconstruction: returns the future hourly Dataset.
+    # obs_daily / alpha: precomputed daily_extremes() of ds_obs / diurnal_alpha(), if available.
+    if alpha is None:
+        alpha = diurnal_alpha(ds_obs, obs_daily)
+
     # 5. Broadcast Future Daily to Hourly
     print("Broadcasting future daily stats to hourly...")
     
@@ -81,8 +86,6 @@ def reconstruct_hourly():
     dtr_fut = fut_tmax_hourly - fut_tmin_hourly
     temp_future = fut_tmin_hourly + (alpha * dtr_fut)
     
-    # 7. Save
-    print("Saving era5_future_hourly.nc...")
     ds_out = xr.Dataset()
     ds_out['temp_future'] = temp_future
     ds_out['temp_future'].attrs = {
@@ -90,11 +93,208 @@ def reconstruct_hourly():
         'long_name': 'MQDM Shifted Hourly 2m Temperature',
         'description': 'Reconstructed hourly time series based on CMIP6 daily shifts and ERA5 diurnal cycle.'
     }
+    return ds_out
+
+def reconstruct_lean(obs_view, obs_tmax, obs_tmin, fut_tmax, fut_tmin):
+    # T_fut = Tmin_fut + alpha * (Tmax_fut - Tmin_fut) on the (day, 24, lat, lon) view.
+    # Daily fields are (day, lat, lon) and broadcast over the hour axis instead of being
+    # ffilled to hourly cubes; one float32 output cube is updated in place, so peak
+    # memory is about input + output instead of ~8 hourly float64 cubes.
+    out = np.array(obs_view, dtype='float32')
+    dtr = np.subtract(obs_tmax, obs_tmin, dtype='float32')
+    # Avoid division by zero; alpha is set to 0 on zero-DTR days (as in diurnal_alpha)
+    dtr[dtr == 0] = np.nan
+
+    out -= obs_tmin.astype('float32')[:, np.newaxis]
+    out /= dtr[:, np.newaxis]
+    np.nan_to_num(out, copy=False, nan=0.0)            # alpha
+
+    out *= np.subtract(fut_tmax, fut_tmin, dtype='float32')[:, np.newaxis]
+    out += fut_tmin.astype('float32')[:, np.newaxis]
+    return out
+
+def compute_hourly_lean(ds_obs, ds_fut_daily, obs_daily=None):
+    # Memory-lean variant of compute_hourly (float32, in place, no hourly ffill cubes).
+    # Falls back to compute_hourly if the hourly axis has gaps or the days don't line up.
+    var_name_obs = 'temp_hourly'
+    da = ds_obs[var_name_obs].transpose('valid_time', ...)
+    view, day_times = daily_view(da.values, da['valid_time'].values)
+
+    fut_time_name = get_time_name(ds_fut_daily)
+    fut_days = ds_fut_daily[fut_time_name].values.astype('datetime64[D]')
+    if view is None or not np.array_equal(fut_days, day_times.astype('datetime64[D]')):
+        print(" -> Hourly and daily axes don't line up, using the standard reconstruction...")
+        return compute_hourly(ds_obs, ds_fut_daily, obs_daily)
+
+    if obs_daily is None:
+        obs_daily = daily_extremes(da, 'valid_time')
+    dims = da.dims[1:]
+    fields = [obs_daily['tmax'].transpose(..., *dims).values, obs_daily['tmin'].transpose(..., *dims).values,
+              ds_fut_daily['tmax_shifted'].transpose(..., *dims).values,
+              ds_fut_daily['tmin_shifted'].transpose(..., *dims).values]
+
+    print("Reconstructing future hourly temperatures (float32, in place)...")
+    out = reconstruct_lean(view, *fields)
+
+    ds_out = xr.Dataset()
+    ds_out['temp_future'] = da.copy(data=out.reshape(da.shape))
+    ds_out['temp_future'].attrs = {
+        'units': 'Celsius',
+        'long_name': 'MQDM Shifted Hourly 2m Temperature',
+        'description': 'Reconstructed hourly time series based on CMIP6 daily shifts and ERA5 diurnal cycle.'
+    }
+    return ds_out
+
+def compute_hourly_stored(ds_obs, ds_fut_daily, alpha_codes, block_days=366):
+    # Reconstruction from the precomputed, quantized alpha store (alpha_store.py):
+    # no observed daily extremes or alpha are computed, and the memory-mapped codes
+    # are read one block of days at a time.
+    da = ds_obs['temp_hourly'].transpose('valid_time', ...)
+    hours = da['valid_time'].values
+    dims = da.dims[1:]
+
+    fut_time_name = get_time_name(ds_fut_daily)
+    # Day of every hour, i.e. the reindex(method='ffill') of compute_hourly
+    hour_day = np.searchsorted(ds_fut_daily[fut_time_name].values, hours, side='right') - 1
+    fut_tmin = ds_fut_daily['tmin_shifted'].transpose(..., *dims).values.astype('float32')
+    fut_dtr = ds_fut_daily['tmax_shifted'].transpose(..., *dims).values.astype('float32') - fut_tmin
+
+    print("Reconstructing future hourly temperatures from the alpha store...")
+    out = np.empty(da.shape, dtype='float32')
+    step = block_days * 24
+    for start in range(0, hours.size, step):
+        block = slice(start, start + step)
+        idx = hour_day[block]
+        values = alpha_store.dequantize(alpha_codes[block])
+        values *= fut_dtr[idx]
+        values += fut_tmin[idx]
+        out[block] = values
+    # Hours before the first future day have no daily values (NaN, as with ffill)
+    out[hour_day < 0] = np.nan
+
+    ds_out = xr.Dataset()
+    ds_out['temp_future'] = da.copy(data=out)
+    ds_out['temp_future'].attrs = {
+        'units': 'Celsius',
+        'long_name': 'MQDM Shifted Hourly 2m Temperature',
+        'description': 'Reconstructed hourly time series based on CMIP6 daily shifts and ERA5 diurnal cycle.'
+    }
+    return ds_out
+
+def reconstruct_hourly(lean=False, use_alpha_store=False):
+    print("Starting Hourly Reconstruction...")
+    
+    # 1. Load Data
+    print("Loading datasets...")
+    # Historical Hourly
+    obs_path = storage.artifact_path('era5_clean')
+    ds_obs = storage.open_dataset(obs_path)
+    # Future Daily (Shifted)
+    ds_fut_daily = storage.open_dataset(storage.artifact_path('era5_future_daily'))
+    
+    # Check variable name
+    var_name_obs = 'temp_hourly'
+    if var_name_obs not in ds_obs:
+        print(f"Error: Variable {var_name_obs} not found in {obs_path}")
+        return
+
+    if use_alpha_store:
+        # Alpha is read from the store: no observed daily extremes needed
+        ds_out = compute_hourly_stored(ds_obs, ds_fut_daily, alpha_store.load_alpha(obs_path))
+    else:
+        obs_daily = storage.cached('daily_extremes', obs_path,
+                                   lambda: daily_extremes(ds_obs[var_name_obs], 'valid_time'))
+        if lean:
+            ds_out = compute_hourly_lean(ds_obs, ds_fut_daily, obs_daily)
+        else:
+            ds_out = compute_hourly(ds_obs, ds_fut_daily, obs_daily)
     
-    # Compressing
-    encoding = {'temp_future': {'zlib': True, 'complevel': 5}}
-    ds_out.to_netcdf('era5_future_hourly.nc', encoding=encoding)
+    # 7. Save
+    save_hourly(ds_out)
+
+def day_blocks(ds_obs, ds_fut_daily, block_days=31):
+    # Generator of (hourly obs, daily future) pairs covering block_days whole days each.
+    # Both files are opened lazily, so each block reads only its own slab.
+    fut_time_name = get_time_name(ds_fut_daily)
+    days = ds_obs['valid_time'].values.astype('datetime64[D]')
+    day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    block_starts = day_starts[::block_days]
+    block_stops = np.r_[block_starts[1:], days.size]
+    for start, stop in zip(block_starts, block_stops):
+        ds_obs_block = ds_obs.isel(valid_time=slice(start, stop)).load()
+        ds_fut_block = ds_fut_daily.sel({fut_time_name: slice(days[start], days[stop - 1])}).load()
+        yield ds_obs_block, ds_fut_block
+
+def reconstruct_hourly_streaming(block_days=31, path=None):
+    # Reconstruct and write one block of days at a time: the first block creates the
+    # output, later blocks are appended. Peak memory depends on block_days, not on
+    # the length of the record.
+    print(f"Starting Hourly Reconstruction (streaming, {block_days} days per block)...")
+    path = path or storage.artifact_path('era5_future_hourly')
+    ds_obs = storage.open_dataset(storage.artifact_path('era5_clean'))
+    ds_fut_daily = storage.open_dataset(storage.artifact_path('era5_future_daily'))
+
+    for i, (ds_obs_block, ds_fut_block) in enumerate(day_blocks(ds_obs, ds_fut_daily, block_days)):
+        ds_block = compute_hourly_lean(ds_obs_block, ds_fut_block)
+        if i == 0:
+            storage.write_dataset(ds_block, path)
+        else:
+            storage.append_dataset(ds_block, path, 'valid_time')
+        print(f" -> Block {i + 1}: {ds_block['valid_time'].values[-1]}")
+    print(f"Done! Saved {path}")
+
+def reconstruct_hourly_append():
+    # Incremental update: only hours in calendar months that received new ERA5 steps
+    # are reconstructed (their daily shifts changed too, see incremental.py); existing
+    # hours are rewritten in place and new hours appended.
+    hourly_path = storage.artifact_path('era5_future_hourly')
+    ds_obs = storage.open_dataset(storage.artifact_path('era5_clean'))
+    ds_fut_daily = storage.open_dataset(storage.artifact_path('era5_future_daily'))
+    fut_time_name = get_time_name(ds_fut_daily)
+
+    last_hour = last_time(hourly_path, 'valid_time')
+    if last_hour is None:
+        print(f"{hourly_path} does not exist yet. Running a full reconstruction.")
+        return reconstruct_hourly()
+
+    mask = dirty_mask(ds_obs['valid_time'].values, last_hour)
+    if not mask.any():
+        print(f"No new hours after {last_hour}. {hourly_path} is up to date.")
+        return
+
+    runs = contiguous_runs(mask)
+    print(f"Reconstructing {len(runs)} month blocks affected by new hours after {last_hour}...")
+    for run in runs:
+        ds_obs_block = ds_obs.isel(valid_time=run)
+        first_day, last_day = ds_obs_block['valid_time'].values[[0, -1]].astype('datetime64[D]')
+        ds_fut_block = ds_fut_daily.sel({fut_time_name: slice(first_day, last_day)})
+        ds_block = compute_hourly(ds_obs_block, ds_fut_block)
+        storage.update_dataset(ds_block, hourly_path, 'valid_time')
+    print("Done!")
+
+def save_hourly(ds_out, path=None):
+    path = path or storage.artifact_path('era5_future_hourly')
+    print(f"Saving {path}...")
+    # Compressed, chunked layout (see storage.py)
+    storage.write_dataset(ds_out, path)
     print("Done!")
 
 if __name__ == '__main__':
-    reconstruct_hourly()
+    parser = argparse.ArgumentParser(description='Reconstruct future hourly temperatures from shifted daily extremes.')
+    parser.add_argument('--append', action='store_true',
+                        help='Only update the months affected by new ERA5 hours.')
+    parser.add_argument('--lean', action='store_true',
+                        help='Memory-lean float32 in-place reconstruction on the (day, 24, lat, lon) view.')
+    parser.add_argument('--alpha-store', action='store_true',
+                        help='Read the diurnal shape factor from the precomputed era5_clean_alpha.npy '
+                             '(built on first use, rebuilt when era5_clean changes).')
+    parser.add_argument('--stream-days', type=int, default=None,
+                        help='Reconstruct and write this many days at a time '
+                             '(peak memory independent of the record length).')
+    args = parser.parse_args()
+    if args.append:
+        reconstruct_hourly_append()
+    elif args.stream_days:
+        reconstruct_hourly_streaming(block_days=args.stream_days)
+    else:
+        reconstruct_hourly(lean=args.lean, use_alpha_store=args.alpha_store)
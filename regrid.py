@@ -0,0 +1,119 @@
+import os
+import hashlib
+import numpy as np
+
+import delta_cache
+
+# Regridding of CMIP6 fields (e.g. per-cell quantile deltas) onto the ERA5 grid.
+# Both grids are rectilinear, so the weights are separable: one (target, source) matrix
+# for latitude and one for longitude. A (..., src_lat, src_lon) field is regridded with
+# a single einsum, whose cost is linear in the number of target cells.
+#
+# Methods:
+#   bilinear      linear interpolation between source cell centres; targets outside the
+#                 source centres take the nearest edge value.
+#   conservative  fraction of each target cell covered by each source cell, from cell
+#                 bounds halfway between centres (latitude overlaps weighted by area).
+#
+# Weights are cached per grid pair and method as .npz in the delta cache directory.
+
+METHODS = ('bilinear', 'conservative')
+
+
+def _bilinear_1d(src, dst):
+    # (len(dst), len(src)) interpolation matrix along one axis
+    src = np.asarray(src, dtype='float64')
+    dst = np.asarray(dst, dtype='float64')
+    weights = np.zeros((dst.size, src.size))
+    if src.size == 1:
+        weights[:, 0] = 1.0
+        return weights
+    order = np.argsort(src)
+    s = src[order]
+    x = np.clip(dst, s[0], s[-1])
+    lo = np.clip(np.searchsorted(s, x, side='right') - 1, 0, s.size - 2)
+    w = (x - s[lo]) / (s[lo + 1] - s[lo])
+    rows = np.arange(dst.size)
+    weights[rows, order[lo]] = 1 - w
+    weights[rows, order[lo + 1]] += w
+    return weights
+
+
+def _bounds(centres):
+    # Cell edges halfway between (sorted) centres, extrapolated at both ends
+    c = np.sort(np.asarray(centres, dtype='float64'))
+    if c.size == 1:
+        # Single cell: assume a 1-degree cell
+        return np.array([c[0] - 0.5, c[0] + 0.5])
+    mid = (c[1:] + c[:-1]) / 2
+    return np.concatenate([[2 * c[0] - mid[0]], mid, [2 * c[-1] - mid[-1]]])
+
+
+def _conservative_1d(src, dst, to_area=None):
+    # (len(dst), len(src)) overlap fractions along one axis
+    src = np.asarray(src, dtype='float64')
+    dst = np.asarray(dst, dtype='float64')
+    src_order = np.argsort(src)
+    dst_order = np.argsort(dst)
+    sb = _bounds(src)
+    db = _bounds(dst)
+    if to_area is not None:
+        sb, db = to_area(sb), to_area(db)
+
+    lo = np.maximum(db[:-1, np.newaxis], sb[np.newaxis, :-1])
+    hi = np.minimum(db[1:, np.newaxis], sb[np.newaxis, 1:])
+    overlap = np.clip(hi - lo, 0, None)
+    covered = overlap.sum(axis=1, keepdims=True)
+    # Targets outside the source grid: nearest source cell
+    outside = covered[:, 0] == 0
+    overlap[outside] = _bilinear_1d(np.sort(src), np.sort(dst))[outside].round()
+    covered[outside] = 1.0
+    sorted_weights = overlap / covered
+
+    weights = np.zeros((dst.size, src.size))
+    weights[np.ix_(dst_order, src_order)] = sorted_weights
+    return weights
+
+
+def _lat_area(bounds):
+    # Area coordinate of latitude bounds (sin(lat)), clipped to the poles
+    return np.sin(np.deg2rad(np.clip(bounds, -90, 90)))
+
+
+def compute_weights(src_lat, src_lon, dst_lat, dst_lon, method='bilinear'):
+    if method == 'bilinear':
+        return _bilinear_1d(src_lat, dst_lat), _bilinear_1d(src_lon, dst_lon)
+    if method == 'conservative':
+        return (_conservative_1d(src_lat, dst_lat, to_area=_lat_area),
+                _conservative_1d(src_lon, dst_lon))
+    raise ValueError(f"Unknown regridding method: {method}")
+
+
+def grid_key(src_lat, src_lon, dst_lat, dst_lon, method):
+    digest = hashlib.sha256(method.encode())
+    for coord in (src_lat, src_lon, dst_lat, dst_lon):
+        coord = np.ascontiguousarray(coord, dtype='float64')
+        digest.update(str(coord.size).encode())
+        digest.update(coord.tobytes())
+    return digest.hexdigest()[:32]
+
+
+def regrid_weights(src_lat, src_lon, dst_lat, dst_lon, method='bilinear'):
+    # (W_lat, W_lon) for a grid pair, loaded from / stored in the cache
+    key = grid_key(src_lat, src_lon, dst_lat, dst_lon, method)
+    path = os.path.join(delta_cache.CACHE_DIR, f"regrid_{method}_{key}.npz")
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return cached['w_lat'], cached['w_lon']
+
+    w_lat, w_lon = compute_weights(src_lat, src_lon, dst_lat, dst_lon, method)
+    os.makedirs(delta_cache.CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.part.npz"
+    np.savez_compressed(tmp_path, w_lat=w_lat, w_lon=w_lon)
+    os.replace(tmp_path, path)
+    return w_lat, w_lon
+
+
+def regrid(field, w_lat, w_lon):
+    # (..., src_lat, src_lon) -> (..., dst_lat, dst_lon)
+    return np.einsum('ij,...jk,lk->...il', w_lat, field, w_lon, optimize=True)
@@ -1,15 +1,84 @@
 import xarray as xr
 import numpy as np
-import scipy.stats as stats
+import argparse
 
-def schaake_shuffle():
-    print("Starting Schaake Shuffle (Spatially Coherent Extension)...")
-    
-    # 1. Load Data
-    print("Loading datasets...")
-    ds_obs = xr.open_dataset('era5_clean.nc', engine='netcdf4') # Template source
-    ds_fut = xr.open_dataset('era5_future_hourly.nc', engine='netcdf4') # Target to reorder
+import storage
+import accel
+from spatial_diagnostics import correlation_matrix, coherence_error
+from incremental import last_time, dirty_mask, contiguous_runs
+
+def index_dtype(n):
+    # Smallest signed integer type that can address n positions
+    if n <= np.iinfo(np.int16).max:
+        return np.int16
+    if n <= np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+def stable_order(template, axis=-1, block=256):
+    # Stable argsort of `template` along `axis`, stored in the smallest index dtype.
+    # np.argsort always returns int64, so it runs over blocks of another axis and
+    # writes into the preallocated narrow array: only one block of int64 indices
+    # exists at a time.
+    axis = axis % template.ndim
+    order = np.empty(template.shape, dtype=index_dtype(template.shape[axis]))
+    if template.ndim == 1:
+        order[...] = np.argsort(template, kind='stable')
+        return order
+    outer = 1 if axis == 0 else 0
+    for start in range(0, template.shape[outer], block):
+        window = (slice(None),) * outer + (slice(start, start + block),)
+        order[window] = np.argsort(template[window], axis=axis, kind='stable')
+    return order
+
+def schaake_reorder(template, values, axis=-1):
+    # Re-arrange `values` along `axis` so they follow the rank pattern of `template`.
+    # template, values: same shape; every other axis is an independent sample.
+    #
+    # We want to re-arrange the VALUES of X_fut spatially to match the RANK PATTERN of X_obs.
+    # Standard Schaake Shuffle reconstructs vector dependence. For a given timestep t:
+    #    Vector Y_fut(t) = [y1, y2, ... yN].
+    #    Vector Y_obs(t) = [x1, x2, ... xN].
+    #    We want Y_new(t) to have distribution of Y_fut but correlation of Y_obs:
+    #      Y_new(t) = Sort(Y_fut(t)) [ Rank(Y_obs(t)) ]
+    #    So if Obs has the cold spot at loc 5, Future should put its coldest value at loc 5.
     
+    # Implementation (one argsort + one scatter):
+    #   order = argsort(X_obs) lists positions from coldest to warmest.
+    #   The k-th smallest future value belongs at position order[k]:
+    #     Y[order[k]] = Sort(Y_fut)[k]
+    #   Example: X_obs = [20, 30, 10] -> order = [2, 0, 1]
+    #            Sort(Y_fut) = [15, 25, 35] -> Y = [25, 35, 15] (Mid, High, Low).
+    # This is the inverse permutation of `order`, so it gives exactly the same result as
+    # gathering Sort(Y_fut)[argsort(argsort(X_obs))], without the second sort or the
+    # full-size int64 rank/row index arrays.
+    if accel.use_numba():
+        return accel.schaake_reorder(template, values, axis)
+    values_sorted = np.sort(values, axis=axis)
+    # Stable sort: tied template cells (routine in packed int16 ERA5) keep their
+    # order, so the result is deterministic and matches the Numba backend
+    order = stable_order(template, axis)
+    
+    reordered = np.empty_like(values_sorted)
+    np.put_along_axis(reordered, order, values_sorted, axis=axis)
+    return reordered
+
+def shuffle_block(X_obs, X_fut):
+    # Schaake Shuffle of a block of time steps.
+    # X_obs, X_fut: (time, lat, lon). Each time step (row) is shuffled independently,
+    # so the record can be processed in any number of time blocks.
+    block_shape = X_fut.shape
+    X_obs = X_obs.reshape(block_shape[0], -1) # Shape (Time, Space)
+    X_fut = X_fut.reshape(block_shape[0], -1) # Shape (Time, Space)
+    
+    # Reorder each row (time step) along the spatial axis
+    X_coherent = schaake_reorder(X_obs, X_fut, axis=1)
+    
+    return X_coherent.reshape(block_shape)
+
+def compute_coherent(ds_obs, ds_fut, block_size=None):
+    # In-memory (or lazy, when the inputs are dask-chunked) core of the shuffle:
+    # returns the spatially coherent Dataset.
     var_obs = 'temp_hourly'
     var_fut = 'temp_future'
     
@@ -20,143 +89,122 @@ def schaake_shuffle():
          ds_obs = ds_obs.isel(valid_time=slice(0, min_len))
          ds_fut = ds_fut.isel(valid_time=slice(0, min_len))
 
-    # 2. Prepare Dimensions (Flatten Spatial)
-    print("Flattening spatial dimensions...")
-    # Stack lat/lon into a single 'location' dimension
-    # We want shape (time, space)
+    print(f"Data Shape: {ds_fut[var_fut].shape}")
+    if block_size:
+        print(f"Streaming mode: {block_size} time steps per block")
     
-    # Historical
-    da_obs_flat = ds_obs[var_obs].stack(space=('latitude', 'longitude'))
-    # Future
-    da_fut_flat = ds_fut[var_fut].stack(space=('latitude', 'longitude'))
-    
-    # Convert to numpy for fast processing
-    X_obs = da_obs_flat.values # Shape (Time, Space)
-    X_fut = da_fut_flat.values # Shape (Time, Space)
-    
-    print(f"Data Shape: {X_fut.shape}")
-    
-    # 3. The Schaake Shuffle
+    # 2. The Schaake Shuffle
     print("Applying Shuffle...")
-    
-    # Step A: Sort Future (Ascending along space)
-    # We want to re-arrange the VALUES of X_fut spatially to match the RANK PATTERN of X_obs.
-    # Note: Schaake Shuffle typically sorts *independent samples*, usually temporal.
-    # BUT here use it for SPATIAL coherence.
-    # Wait, the Schaake Shuffle creates dependence between variables (locations).
-    # Correct Logic:
-    # 1. Identify the dependence structure (rank) of the Reference (X_obs) across locations? 
-    #    No, standard Schaake Shuffle: reconstructs vector dependence.
-    #    For a given timestep t:
-    #    Vector Y_fut(t) = [y1, y2, ... yN]. 
-    #    Vector Y_obs(t) = [x1, x2, ... xN].
-    #    We want Y_new(t) to have distribution of Y_fut but correlation of Y_obs.
-    #    Implementation:
-    #      Y_new(t) = Sort(Y_fut(t)) [ Rank(Y_obs(t)) ]
-    #    Wait, Sort(Y_fut) gives the ordered magnitudes.
-    #    Rank(Y_obs) gives the indices of where the smallest, 2nd smallest, etc. are located on the map.
-    #    So if Obs has the cold spot at loc 5, Future should put its coldest value at loc 5.
-    
-    # Vectorized implementation Loop over Time (or can we broadcast?)
-    # Sorting per row (time step)
-    
-    # Sort Future along Spatial Axis (axis=1)
-    X_fut_sorted = np.sort(X_fut, axis=1)
-    
-    # Get Rank/Indices of Historical along Spatial Axis
-    # argsort gives limits that would sort the array.
-    # We want the 'rank structure'.
-    # If X_obs = [20, 30, 10], argsort -> [2, 0, 1] (indices of min, mid, max).
-    # X_fut_sorted = [15, 25, 35] (values min, mid, max).
-    # We want X_new to be [25, 35, 15] (matching the pattern: medium, high, low).
-    
-    # BUT argsort gives indices FROM sorted TO original.
-    # We want to place X_fut_sorted[0] at index 2, X_fut_sorted[1] at index 0, etc.
-    # This is effectively "unsorting".
-    
-    # Let idx = argsort(X_obs). 
-    # X_obs[idx] is sorted.
-    # We want Y such that Y[idx] = X_fut_sorted.
-    # So Y = X_fut_sorted[inverse_permutation] ?
-    
-    # Actually simpler:
-    # argsort(X_obs) tells us which element is 1st, 2nd, 3rd.
-    #   idx = [2, 0, 1] means:
-    #   Element at 2 is smallest (Rank 0)
-    #   Element at 0 is middle (Rank 1)
-    #   Element at 1 is largest (Rank 2)
-    
-    # However we want to construct the array.
-    # Let's use `argsort(argsort(X_obs))` which gives the Rank (0..N-1) of each element.
-    #   X_obs = [20, 30, 10]
-    #   argsort -> [2, 0, 1]
-    #   argsort(argsort) -> [1, 2, 0]
-    #   This means: Index 0 has rank 1. Index 1 has rank 2. Index 2 has rank 0.
-    
-    # Now take X_fut_sorted = [15, 25, 35].
-    # We want result[i] = X_fut_sorted[ rank[i] ].
-    #   i=0: rank=1 -> 25
-    #   i=1: rank=2 -> 35
-    #   i=2: rank=0 -> 15
-    #   Result: [25, 35, 15].
-    # Pattern matches Obs ([20, 30, 10] -> Mid, High, Low). Values match Fut. 
-    # Correct!
-    
-    ranks = np.argsort(np.argsort(X_obs, axis=1), axis=1)
-    
-    # Apply ranks to grab from sorted future
-    # We need advanced indexing.
-    # X_new[t, s] = X_fut_sorted[t, ranks[t, s]]
-    
-    # Create grid of time indices
-    rows = np.arange(X_obs.shape[0])[:, np.newaxis]
-    X_coherent = X_fut_sorted[rows, ranks] # Broadcasting magic
-    
-    # 4. Reconstruct & Save
-    print("Reconstructing Dimensions...")
-    
-    # Put back into DataArray
-    da_coherent = xr.DataArray(
-        X_coherent,
-        coords=da_fut_flat.coords,
-        dims=da_fut_flat.dims,
-        name='temp_coherent'
+    # Spatial dims are the core dims (flattened inside the kernel); time is the
+    # loop dim, so dask maps the kernel block by block.
+    spatial_dims = ['latitude', 'longitude']
+    obs = ds_obs[var_obs].transpose('valid_time', *spatial_dims)
+    fut = ds_fut[var_fut].transpose('valid_time', *spatial_dims)
+    if fut.chunks is not None or obs.chunks is not None:
+        # Core dims must be one dask chunk each (Zarr artifacts are tiled 32x32 on disk)
+        obs = obs.chunk({d: -1 for d in spatial_dims})
+        fut = fut.chunk({d: -1 for d in spatial_dims})
+    da_coherent = xr.apply_ufunc(
+        shuffle_block,
+        obs,
+        fut,
+        input_core_dims=[spatial_dims, spatial_dims],
+        output_core_dims=[spatial_dims],
+        dask='parallelized',
+        output_dtypes=[ds_fut[var_fut].dtype],
     )
     
-    # Unstack
-    da_coherent_unstacked = da_coherent.unstack('space')
-    
     ds_out = xr.Dataset()
-    ds_out['temp_coherent'] = da_coherent_unstacked
+    ds_out['temp_coherent'] = da_coherent
     
     # Copy attributes
-    ds_out.attrs = ds_fut.attrs
+    ds_out.attrs = dict(ds_fut.attrs)
     ds_out.attrs['description'] = 'Spatially Coherent MQDM (Schaake Shuffle Applied)'
-    
-    print("Saving era5_spatially_coherent.nc...")
-    encoding = {'temp_coherent': {'zlib': True, 'complevel': 5}}
-    ds_out.to_netcdf('era5_spatially_coherent.nc', encoding=encoding)
+    return ds_out
+
+def save_coherent(ds_out, path=None):
+    # With dask-backed (streaming) data each block is written as soon as it is computed
+    path = path or storage.artifact_path('era5_spatially_coherent')
+    print(f"Saving {path}...")
+    storage.write_dataset(ds_out, path)
     print("Done!")
-    
-    # 5. Verify Correlation Improvement
+
+def verify_coherence(path=None):
+    # 4. Verify Correlation Improvement
     print("\n--- Verification: Spatial Correlation ---")
+    ds_out = storage.open_dataset(path or storage.artifact_path('era5_spatially_coherent'))
+    ds_obs = storage.open_dataset(storage.artifact_path('era5_clean'))
     
-    # Select Loc A (0,0) and Loc B (0,1)
-    # Check if we have enough points
-    if ds_out.sizes['longitude'] < 2:
+    # All cell pairs: S x S correlation matrices of the output and of ERA5
+    if ds_out.sizes['latitude'] * ds_out.sizes['longitude'] < 2:
         print("Not enough points to verify.")
         return
 
-    ts_A = ds_out['temp_coherent'].isel(latitude=0, longitude=0).values.flatten()
-    ts_B = ds_out['temp_coherent'].isel(latitude=0, longitude=1).values.flatten()
+    corr_coherent = correlation_matrix(ds_out['temp_coherent'])
+    corr_obs = correlation_matrix(ds_obs['temp_hourly'])
+    error = coherence_error(corr_obs, corr_coherent)
+    upper = np.triu_indices_from(corr_obs, k=1)
+    print(f"Coherent mean correlation (all pairs): {np.nanmean(corr_coherent[upper]):.4f}")
+    print(f"Historical mean correlation (all pairs): {np.nanmean(corr_obs[upper]):.4f}")
+    print(f"Correlation RMSE vs historical: {error['rmse']:.4f}")
+    return error
+
+def schaake_shuffle(block_size=None):
+    print("Starting Schaake Shuffle (Spatially Coherent Extension)...")
+    
+    # 1. Load Data
+    print("Loading datasets...")
+    # With a block size the inputs are opened lazily in time blocks (dask), so only
+    # `block_size` time steps per worker are ever held in memory at once.
+    chunks = {'valid_time': block_size, 'latitude': -1, 'longitude': -1} if block_size else None
+    ds_obs = storage.open_dataset(storage.artifact_path('era5_clean'), chunks=chunks) # Template source
+    ds_fut = storage.open_dataset(storage.artifact_path('era5_future_hourly'), chunks=chunks) # Target to reorder
     
-    valid = (~np.isnan(ts_A)) & (~np.isnan(ts_B))
-    ts_A = ts_A[valid]
-    ts_B = ts_B[valid]
+    ds_out = compute_coherent(ds_obs, ds_fut, block_size)
     
-    r_coherent, _ = stats.pearsonr(ts_A, ts_B)
-    print(f"Coherent Correlation (Loc A vs B): {r_coherent:.4f}")
-    print("(Compare this to ~0.9926 from broken phase, and ~0.9958 from historical)")
+    # 3. Save
+    save_coherent(ds_out)
+    verify_coherence()
+
+def schaake_shuffle_append():
+    # Incremental update: the shuffle is per time step, so only steps whose future
+    # values changed (months that received new ERA5 steps) are reordered; existing
+    # steps are rewritten in place and new steps appended.
+    coherent_path = storage.artifact_path('era5_spatially_coherent')
+    ds_obs = storage.open_dataset(storage.artifact_path('era5_clean'))
+    ds_fut = storage.open_dataset(storage.artifact_path('era5_future_hourly'))
+
+    last_step = last_time(coherent_path, 'valid_time')
+    if last_step is None:
+        print(f"{coherent_path} does not exist yet. Running a full shuffle.")
+        return schaake_shuffle()
+
+    mask = dirty_mask(ds_fut['valid_time'].values, last_step)
+    if not mask.any():
+        print(f"No new steps after {last_step}. {coherent_path} is up to date.")
+        return
+
+    runs = contiguous_runs(mask)
+    print(f"Shuffling {len(runs)} month blocks affected by new steps after {last_step}...")
+    for run in runs:
+        ds_fut_block = ds_fut.isel(valid_time=run)
+        ds_obs_block = ds_obs.sel(valid_time=ds_fut_block['valid_time'])
+        ds_block = compute_coherent(ds_obs_block, ds_fut_block)
+        storage.update_dataset(ds_block, coherent_path, 'valid_time')
+    print("Done!")
 
 if __name__ == '__main__':
-    schaake_shuffle()
+    parser = argparse.ArgumentParser(description='Spatially coherent reordering (Schaake Shuffle).')
+    parser.add_argument('--block-size', type=int, default=None,
+                        help='Process and write this many time steps at a time (bounded memory). '
+                             'Default: load the full record.')
+    parser.add_argument('--append', action='store_true',
+                        help='Only update the steps affected by new ERA5 data.')
+    parser.add_argument('--backend', choices=accel.BACKENDS, default=None,
+                        help='Reorder kernel: numpy (default), numba (parallel, optional dependency) or auto.')
+    args = parser.parse_args()
+    accel.configure(args.backend)
+    if args.append:
+        schaake_shuffle_append()
+    else:
+        schaake_shuffle(block_size=args.block_size)
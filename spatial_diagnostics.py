@@ -0,0 +1,198 @@
+import os
+import json
+import argparse
+import numpy as np
+
+import storage
+
+# Spatial-coherence diagnostics over the whole grid instead of one cell pair.
+#
+# The S x S Pearson correlation matrix of a (time, lat, lon) field is accumulated from
+# one standardized matrix product per time block (X^T X of the block's (T_block, S)
+# matrix), so the full (T, S) matrix never has to be in memory. Values are shifted by a
+# per-cell reference (first block mean) before accumulating, for numerical stability.
+# Cells with missing steps are handled pairwise (extra masked products, only allocated
+# once a NaN is seen).
+#
+# From the matrices we derive correlation-vs-distance curves and a summary error score:
+# the RMSE of the off-diagonal correlations against the historical (ERA5) matrix.
+
+BLOCK_SIZE = 744           # ~one month of hourly steps per product
+DISTANCE_BINS = 20
+DIAGNOSTICS_JSON = 'spatial_diagnostics.json'
+DIAGNOSTICS_PLOT = 'spatial_coherence_diagnostics.png'
+EARTH_RADIUS_KM = 6371.0
+
+
+class CorrelationAccumulator:
+    # Streaming S x S correlation: add() (T_block, S) blocks, then corr()
+    def __init__(self, n_cells):
+        self.S = n_cells
+        self.offset = None
+        self.n = 0
+        self.sum = np.zeros(n_cells)
+        self.xtx = np.zeros((n_cells, n_cells))
+        self.pairwise = None       # (n_ij, sum_i over pairs, sum of squares_i over pairs)
+
+    def add(self, block):
+        block = np.asarray(block, dtype='float64').reshape(-1, self.S)
+        if self.offset is None:
+            self.offset = np.nan_to_num(np.nanmean(block, axis=0))
+        x = block - self.offset
+        valid = ~np.isnan(x)
+        if self.pairwise is None and not valid.all():
+            # First gap: switch to pairwise-complete accumulation
+            self.pairwise = (np.full((self.S, self.S), float(self.n)),
+                             np.repeat(self.sum[:, np.newaxis], self.S, axis=1),
+                             np.repeat(np.diag(self.xtx)[:, np.newaxis], self.S, axis=1))
+        x = np.where(valid, x, 0.0)
+        self.xtx += x.T @ x
+        if self.pairwise is None:
+            self.n += x.shape[0]
+            self.sum += x.sum(axis=0)
+        else:
+            v = valid.astype('float64')
+            n_ij, s_ij, ss_ij = self.pairwise
+            n_ij += v.T @ v
+            s_ij += x.T @ v
+            ss_ij += (x * x).T @ v
+
+    def corr(self):
+        if self.pairwise is None:
+            n = self.n
+            s_i = self.sum[:, np.newaxis]
+            s_j = self.sum[np.newaxis, :]
+            ss_i = np.diag(self.xtx)[:, np.newaxis]
+            ss_j = np.diag(self.xtx)[np.newaxis, :]
+        else:
+            n, s_i, ss_i = self.pairwise
+            s_j, ss_j = s_i.T, ss_i.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = n * self.xtx - s_i * s_j
+            var = (n * ss_i - s_i ** 2) * (n * ss_j - s_j ** 2)
+            r = cov / np.sqrt(var)
+        return np.clip(r, -1, 1)
+
+
+def correlation_matrix(da, block_size=BLOCK_SIZE, time_name='valid_time'):
+    # S x S correlation of a (time, lat, lon) DataArray, streamed in time blocks
+    da = da.transpose(time_name, ...)
+    n_cells = int(np.prod(da.shape[1:]))
+    acc = CorrelationAccumulator(n_cells)
+    for start in range(0, da.sizes[time_name], block_size):
+        acc.add(da.isel({time_name: slice(start, start + block_size)}).values)
+    return acc.corr()
+
+
+def distance_matrix(lat, lon):
+    # Great-circle distance (km) between all cells of a rectilinear grid
+    lat2d, lon2d = np.meshgrid(np.deg2rad(lat), np.deg2rad(lon), indexing='ij')
+    lat_f, lon_f = lat2d.ravel(), lon2d.ravel()
+    dlat = lat_f[:, np.newaxis] - lat_f[np.newaxis, :]
+    dlon = lon_f[:, np.newaxis] - lon_f[np.newaxis, :]
+    a = (np.sin(dlat / 2) ** 2
+         + np.cos(lat_f)[:, np.newaxis] * np.cos(lat_f)[np.newaxis, :] * np.sin(dlon / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def correlation_vs_distance(corr, distances, bins=DISTANCE_BINS):
+    # Mean correlation of all cell pairs in each distance bin -> (bin centres, means)
+    upper = np.triu_indices_from(corr, k=1)
+    d = distances[upper]
+    r = corr[upper]
+    edges = np.linspace(0, d.max() if d.size else 1.0, bins + 1)
+    which = np.clip(np.digitize(d, edges) - 1, 0, bins - 1)
+    valid = ~np.isnan(r)
+    counts = np.bincount(which[valid], minlength=bins)
+    sums = np.bincount(which[valid], weights=r[valid], minlength=bins)
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+    return (edges[:-1] + edges[1:]) / 2, means
+
+
+def coherence_error(corr_ref, corr_test):
+    # RMSE / mean abs error of the off-diagonal correlations against the reference
+    upper = np.triu_indices_from(corr_ref, k=1)
+    diff = corr_test[upper] - corr_ref[upper]
+    diff = diff[~np.isnan(diff)]
+    if diff.size == 0:
+        return {'rmse': float('nan'), 'mae': float('nan'), 'max_abs': float('nan')}
+    return {'rmse': float(np.sqrt(np.mean(diff ** 2))), 'mae': float(np.mean(np.abs(diff))),
+            'max_abs': float(np.max(np.abs(diff)))}
+
+
+def spatial_diagnostics(fields, reference='historical', block_size=BLOCK_SIZE,
+                        output_json=DIAGNOSTICS_JSON, output_plot=DIAGNOSTICS_PLOT):
+    # fields: {label: (time, lat, lon) DataArray}. Returns the summary dict.
+    template = fields[reference]
+    lat = template['latitude'].values
+    lon = template['longitude'].values
+    distances = distance_matrix(lat, lon)
+
+    matrices = {}
+    for label, da in fields.items():
+        print(f"Correlation matrix ({label}, {lat.size * lon.size} cells)...")
+        matrices[label] = correlation_matrix(da, block_size)
+
+    summary = {'n_cells': int(lat.size * lon.size), 'reference': reference, 'fields': {}}
+    curves = {}
+    for label, corr in matrices.items():
+        centres, means = correlation_vs_distance(corr, distances)
+        curves[label] = means
+        entry = {'mean_offdiag_corr': float(np.nanmean(corr[np.triu_indices_from(corr, k=1)]))
+                 if corr.shape[0] > 1 else float('nan'),
+                 'corr_vs_distance': [None if np.isnan(m) else float(m) for m in means]}
+        if label != reference:
+            entry['error'] = coherence_error(matrices[reference], corr)
+        summary['fields'][label] = entry
+    summary['distance_km'] = [float(c) for c in centres]
+
+    print("\n--- Spatial Coherence (all cell pairs) ---")
+    for label, entry in summary['fields'].items():
+        line = f"{label:<12} mean r = {entry['mean_offdiag_corr']:.4f}"
+        if 'error' in entry:
+            line += f"   RMSE vs {reference} = {entry['error']['rmse']:.4f}"
+        print(line)
+
+    if output_json:
+        with open(output_json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved {output_json}")
+    if output_plot:
+        plot_correlation_vs_distance(centres, curves, output_plot)
+    return summary
+
+
+def plot_correlation_vs_distance(centres, curves, path, title=None):
+    import matplotlib.pyplot as plt
+    colors = {'historical': 'blue', 'broken': 'red', 'coherent': 'green'}
+    plt.figure(figsize=(9, 6))
+    for label, means in curves.items():
+        plt.plot(centres, means, 'o-', color=colors.get(label), label=label.capitalize())
+    plt.title(title or "Spatial Correlation vs Distance (all cell pairs)")
+    plt.xlabel("Distance (km)")
+    plt.ylabel("Mean Pearson correlation")
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    plt.savefig(path)
+    print(f"Saved {path}")
+    plt.close()
+
+
+def run_diagnostics(block_size=BLOCK_SIZE):
+    fields = {
+        'historical': storage.open_dataset(storage.artifact_path('era5_clean'))['temp_hourly'],
+        'broken': storage.open_dataset(storage.artifact_path('era5_future_hourly'))['temp_future'],
+    }
+    coherent_path = storage.artifact_path('era5_spatially_coherent')
+    if os.path.exists(coherent_path):
+        fields['coherent'] = storage.open_dataset(coherent_path)['temp_coherent']
+    return spatial_diagnostics(fields, block_size=block_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Full-grid spatial coherence diagnostics.')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                        help=f'Time steps per matrix product (default: {BLOCK_SIZE}).')
+    args = parser.parse_args()
+    run_diagnostics(block_size=args.block_size)
@@ -0,0 +1,239 @@
+import os
+import numpy as np
+import xarray as xr
+
+# Dataset access shared by the pipeline stages.
+#
+# 1. Format / layout: every pipeline artifact (era5_clean, era5_future_daily, ...) is
+#    read and written through this module, so the on-disk format is chosen in one place.
+#    NetCDF4 is the default; a Zarr directory store is available for faster partial reads.
+#    Data variables are written with explicit chunks that suit both time-slab access
+#    (one month of hours per chunk) and point-series access (small spatial tiles).
+#    Select with the MQDM_STORE_FORMAT (netcdf|zarr) and MQDM_COMPRESSOR (zlib|lz4|none)
+#    environment variables, or configure() (pipeline.py --format/--compressor).
+#
+# 2. Sharing: when several stages run in one process (pipeline.py), files are opened once
+#    and derived arrays (e.g. daily extremes of era5_clean) are computed once. Entries are
+#    keyed by the file's size/mtime, so a rewritten file is never served stale.
+
+STORE_FORMAT = os.environ.get('MQDM_STORE_FORMAT', 'netcdf')
+COMPRESSOR = os.environ.get('MQDM_COMPRESSOR', 'zlib')
+
+EXTENSIONS = {'netcdf': '.nc', 'zarr': '.zarr'}
+COMPRESSION_LEVEL = 5
+
+# Chunk layout: ~one month of hourly steps (or one year of daily steps) x 32x32 tiles
+TIME_CHUNK = {'hourly': 744, 'daily': 366}
+SPACE_CHUNK = 32
+TIME_DIMS = ['valid_time', 'time']
+
+_datasets = {}
+_derived = {}
+
+
+def configure(store_format=None, compressor=None):
+    global STORE_FORMAT, COMPRESSOR
+    if store_format is not None:
+        if store_format not in EXTENSIONS:
+            raise ValueError(f"Unknown store format: {store_format}")
+        STORE_FORMAT = store_format
+    if compressor is not None:
+        if compressor not in ('zlib', 'lz4', 'none'):
+            raise ValueError(f"Unknown compressor: {compressor}")
+        COMPRESSOR = compressor
+
+
+def artifact_path(name):
+    # 'era5_clean' -> 'era5_clean.nc' or 'era5_clean.zarr'
+    return name + EXTENSIONS[STORE_FORMAT]
+
+
+def is_zarr(path):
+    return path.endswith('.zarr') or os.path.isdir(path)
+
+
+def file_fingerprint(path):
+    if os.path.isdir(path):
+        # Zarr stores rewrite their consolidated metadata on every write
+        metadata = os.path.join(path, '.zmetadata')
+        path = metadata if os.path.exists(metadata) else path
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def open_dataset(path, **kwargs):
+    key = (os.path.abspath(path), file_fingerprint(path), repr(sorted(kwargs.items())))
+    if key not in _datasets:
+        if is_zarr(path):
+            # Zarr is always lazy; default to the on-disk chunks
+            kwargs.setdefault('chunks', {})
+            _datasets[key] = xr.open_zarr(path, **kwargs)
+        else:
+            kwargs.setdefault('engine', 'netcdf4')
+            _datasets[key] = xr.open_dataset(path, **kwargs)
+    return _datasets[key]
+
+
+def chunk_shape(da):
+    # Explicit chunk shape for a (time, lat, lon)-like variable
+    shape = []
+    for dim, size in zip(da.dims, da.shape):
+        if dim in TIME_DIMS:
+            kind = 'hourly' if _is_hourly(da[dim]) else 'daily'
+            shape.append(min(size, TIME_CHUNK[kind]))
+        else:
+            shape.append(min(size, SPACE_CHUNK))
+    return tuple(max(s, 1) for s in shape)
+
+
+def _is_hourly(time_coord):
+    times = np.asarray(time_coord.values, dtype='datetime64[ns]')
+    return times.size > 1 and (times[1] - times[0]) < np.timedelta64(1, 'D')
+
+
+def _netcdf_encoding(chunks):
+    if COMPRESSOR == 'zlib':
+        return {'zlib': True, 'complevel': COMPRESSION_LEVEL, 'chunksizes': chunks}
+    if COMPRESSOR == 'lz4':
+        # Requires netCDF4 built with the blosc filter plugins
+        return {'compression': 'blosc_lz4', 'blosc_shuffle': 1,
+                'complevel': COMPRESSION_LEVEL, 'chunksizes': chunks}
+    return {'chunksizes': chunks}
+
+
+def _zarr_encoding(chunks):
+    import numcodecs
+    if COMPRESSOR == 'zlib':
+        compressor = numcodecs.Zlib(level=COMPRESSION_LEVEL)
+    elif COMPRESSOR == 'lz4':
+        compressor = numcodecs.Blosc(cname='lz4', clevel=COMPRESSION_LEVEL,
+                                     shuffle=numcodecs.Blosc.SHUFFLE)
+    else:
+        compressor = None
+    return {'chunks': chunks, 'compressor': compressor}
+
+
+def write_dataset(ds, path, **kwargs):
+    # Write an artifact with the configured format, compressor and chunk layout.
+    # Extra kwargs are passed to to_netcdf / to_zarr.
+    invalidate(path)
+    ds = ds.copy()
+    encoding = {}
+    for var in ds.data_vars:
+        # Encodings inherited from the source file (zlib, chunksizes, ...) would
+        # override the layout chosen here
+        ds[var].encoding = {}
+        chunks = chunk_shape(ds[var])
+        if is_zarr(path):
+            encoding[var] = _zarr_encoding(chunks)
+            if ds[var].chunks is not None:
+                # Dask chunks must line up with the Zarr chunks
+                ds[var] = ds[var].chunk(dict(zip(ds[var].dims, chunks)))
+        else:
+            encoding[var] = _netcdf_encoding(chunks)
+
+    if is_zarr(path):
+        # Zarr arrays can always be extended; unlimited dims are a NetCDF concept
+        kwargs.pop('unlimited_dims', None)
+        kwargs.setdefault('mode', 'w')
+        return ds.to_zarr(path, encoding=encoding, consolidated=True, **kwargs)
+    # Keep the time axis extendable so new steps can be appended later
+    kwargs.setdefault('unlimited_dims', [d for d in TIME_DIMS if d in ds.dims])
+    return ds.to_netcdf(path, encoding=encoding, **kwargs)
+
+
+def append_dataset(ds, path, dim):
+    # Append new steps along `dim` to an existing artifact without rewriting it.
+    # The appended slab is small (e.g. one month), so it is loaded before writing.
+    invalidate(path)
+    ds = ds.load()
+    if is_zarr(path):
+        ds = ds.copy()
+        for var in ds.data_vars:
+            ds[var].encoding = {}
+        return ds.to_zarr(path, append_dim=dim, consolidated=True)
+
+    import netCDF4
+    with netCDF4.Dataset(path, 'a') as nc:
+        if not nc.dimensions[dim].isunlimited():
+            raise ValueError(f"{path}: '{dim}' is not an unlimited dimension; "
+                             f"rewrite the file before appending to it.")
+        start = len(nc.dimensions[dim])
+        stop = start + ds.sizes[dim]
+
+        time_var = nc.variables[dim]
+        dates = ds[dim].to_index().to_pydatetime()
+        time_var[start:stop] = netCDF4.date2num(dates, time_var.units,
+                                                calendar=getattr(time_var, 'calendar', 'standard'))
+
+        for var in ds.data_vars:
+            if dim not in ds[var].dims or var not in nc.variables:
+                continue
+            nc_var = nc.variables[var]
+            values = ds[var].transpose(*nc_var.dimensions).values
+            index = tuple(slice(start, stop) if d == dim else slice(None) for d in nc_var.dimensions)
+            nc_var[index] = values
+
+
+def update_dataset(ds, path, dim):
+    # Write `ds` into an existing artifact: steps already present along `dim` are
+    # overwritten in place (one write per contiguous run), later steps are appended.
+    ds_existing = open_dataset(path)
+    existing = ds_existing[dim].values
+    times = ds[dim].values
+
+    is_new = times > existing[-1]
+    old_idx = np.flatnonzero(~is_new)
+    if old_idx.size:
+        positions = np.searchsorted(existing, times[old_idx])
+        if np.any(existing[positions] != times[old_idx]):
+            raise ValueError(f"{path}: steps to update do not line up with the existing '{dim}' axis")
+        # Split into contiguous runs of target positions
+        breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+        for run_idx, run_pos in zip(np.split(old_idx, breaks), np.split(positions, breaks)):
+            write_region(ds.isel({dim: run_idx}), path, dim, int(run_pos[0]))
+
+    if is_new.any():
+        append_dataset(ds.isel({dim: np.flatnonzero(is_new)}), path, dim)
+    invalidate(path)
+
+
+def write_region(ds, path, dim, start):
+    # Overwrite steps start .. start + len(ds[dim]) of an existing artifact in place
+    invalidate(path)
+    ds = ds.load()
+    stop = start + ds.sizes[dim]
+    if is_zarr(path):
+        # Region writes may only contain variables along the region dim
+        ds = ds.drop_vars([v for v in ds.variables if dim not in ds[v].dims])
+        for var in ds.variables:
+            ds[var].encoding = {}
+        ds.to_zarr(path, region={dim: slice(start, stop)})
+        return
+
+    import netCDF4
+    with netCDF4.Dataset(path, 'a') as nc:
+        for var in ds.data_vars:
+            if dim not in ds[var].dims or var not in nc.variables:
+                continue
+            nc_var = nc.variables[var]
+            values = ds[var].transpose(*nc_var.dimensions).values
+            index = tuple(slice(start, stop) if d == dim else slice(None) for d in nc_var.dimensions)
+            nc_var[index] = values
+
+
+def cached(name, path, compute):
+    # Memoize compute() for the current version of `path`
+    key = (name, os.path.abspath(path), file_fingerprint(path))
+    if key not in _derived:
+        _derived[key] = compute()
+    return _derived[key]
+
+
+def invalidate(path):
+    # Close and forget everything derived from `path` (call before rewriting it)
+    path = os.path.abspath(path)
+    for key in [k for k in _datasets if k[0] == path]:
+        _datasets.pop(key).close()
+    for key in [k for k in _derived if k[1] == path]:
+        del _derived[key]
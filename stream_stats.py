@@ -0,0 +1,293 @@
+import os
+import argparse
+import numpy as np
+
+import storage
+from quantile_sketch import QuantileSketch, DEFAULT_K
+
+# One-pass streaming statistics for multi-decade hourly outputs.
+# A dataset is read once, in blocks of time steps, and every block updates all
+# statistics at the same time:
+#   - per-cell count / mean / M2 (Welford, merged per block with Chan's formula)
+#   - a fixed-bin histogram (plus under/overflow counts)
+#   - hour-of-day sums and counts (mean diurnal cycle)
+#   - a mergeable KLL quantile sketch of all values (quantile_sketch.py)
+#   - per-cell co-moments with a reference field (temporal correlation with ERA5)
+# All accumulators are mergeable (add blocks in any order, or merge() partial results
+# from workers). The small summary is saved next to the dataset as <name>_stats.npz and
+# the validation / paper plots render from it instead of re-reading the hourly cube.
+
+BLOCK_SIZE = 744                         # ~one month of hourly steps per read
+HIST_EDGES = np.arange(-100.0, 350.0 + 0.1, 0.1)  # 0.1 degree bins, covers Celsius and Kelvin
+SUMMARY_SUFFIX = '_stats.npz'
+SUMMARY_VERSION = 2
+
+
+def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    # Chan et al. parallel update of (count, mean, M2); works elementwise on arrays
+    n = n_a + n_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(n > 0, mean_a + delta * n_b / n, 0.0)
+        m2 = m2_a + m2_b + np.where(n > 0, delta ** 2 * n_a * n_b / n, 0.0)
+    return n, mean, m2
+
+
+class StatsAccumulator:
+    def __init__(self, cell_shape, edges=HIST_EDGES, sketch_k=DEFAULT_K, exact=False):
+        self.cell_shape = tuple(cell_shape)
+        self.edges = np.asarray(edges, dtype='float64')
+        self.n = np.zeros(self.cell_shape)
+        self.mean = np.zeros(self.cell_shape)
+        self.m2 = np.zeros(self.cell_shape)
+        self.hist = np.zeros(self.edges.size - 1, dtype='int64')
+        self.underflow = 0
+        self.overflow = 0
+        self.hour_sum = np.zeros(24)
+        self.hour_count = np.zeros(24, dtype='int64')
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.sketch = QuantileSketch(sketch_k, exact=exact)
+
+    def add(self, block, times):
+        # block: (time, ...) values, times: datetime64 of the block's steps
+        block = np.asarray(block, dtype='float64')
+        valid = ~np.isnan(block)
+        n_b = valid.sum(axis=0).astype('float64')
+        filled = np.where(valid, block, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_b = np.where(n_b > 0, filled.sum(axis=0) / n_b, 0.0)
+        m2_b = (np.where(valid, block - mean_b, 0.0) ** 2).sum(axis=0)
+        self.n, self.mean, self.m2 = _merge_moments(self.n, self.mean, self.m2, n_b, mean_b, m2_b)
+
+        values = block[valid]
+        if values.size:
+            self.vmin = min(self.vmin, float(values.min()))
+            self.vmax = max(self.vmax, float(values.max()))
+        self.hist += np.histogram(values, bins=self.edges)[0]
+        self.sketch.update(values)
+        self.underflow += int((values < self.edges[0]).sum())
+        self.overflow += int((values > self.edges[-1]).sum())
+
+        hours = np.asarray(times, dtype='datetime64[h]').astype('int64') % 24
+        step_sums = filled.reshape(block.shape[0], -1).sum(axis=1)
+        step_counts = valid.reshape(block.shape[0], -1).sum(axis=1)
+        self.hour_sum += np.bincount(hours, weights=step_sums, minlength=24)
+        self.hour_count += np.bincount(hours, weights=step_counts, minlength=24).astype('int64')
+
+    def merge(self, other):
+        self.n, self.mean, self.m2 = _merge_moments(self.n, self.mean, self.m2,
+                                                    other.n, other.mean, other.m2)
+        self.hist += other.hist
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.hour_sum += other.hour_sum
+        self.hour_count += other.hour_count
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def domain_moments(self):
+        # (count, mean, variance) over all cells and steps, from the per-cell moments
+        n = self.n.sum()
+        if n == 0:
+            return 0, np.nan, np.nan
+        mean = (self.n * self.mean).sum() / n
+        m2 = (self.m2 + self.n * (self.mean - mean) ** 2).sum()
+        return int(n), float(mean), float(m2 / n)
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2, 'edges': self.edges,
+                'hist': self.hist, 'underflow': self.underflow, 'overflow': self.overflow,
+                'hour_sum': self.hour_sum, 'hour_count': self.hour_count,
+                'vmin': self.vmin, 'vmax': self.vmax, **self.sketch.to_arrays()}
+
+
+class CoMomentAccumulator:
+    # Per-cell temporal correlation between a field and a reference (steps where both are valid)
+    def __init__(self, cell_shape):
+        self.n = np.zeros(cell_shape)
+        self.mx = np.zeros(cell_shape)
+        self.my = np.zeros(cell_shape)
+        self.m2x = np.zeros(cell_shape)
+        self.m2y = np.zeros(cell_shape)
+        self.cxy = np.zeros(cell_shape)
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype='float64')
+        y = np.asarray(y, dtype='float64')
+        valid = ~(np.isnan(x) | np.isnan(y))
+        n_b = valid.sum(axis=0).astype('float64')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mx_b = np.where(n_b > 0, np.where(valid, x, 0).sum(axis=0) / n_b, 0.0)
+            my_b = np.where(n_b > 0, np.where(valid, y, 0).sum(axis=0) / n_b, 0.0)
+        dx = np.where(valid, x - mx_b, 0.0)
+        dy = np.where(valid, y - my_b, 0.0)
+        self._merge(n_b, mx_b, my_b, (dx * dx).sum(axis=0), (dy * dy).sum(axis=0), (dx * dy).sum(axis=0))
+
+    def _merge(self, n_b, mx_b, my_b, m2x_b, m2y_b, cxy_b):
+        n_a = self.n
+        n = n_a + n_b
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(n > 0, n_a * n_b / n, 0.0)
+        dx = mx_b - self.mx
+        dy = my_b - self.my
+        self.cxy = self.cxy + cxy_b + dx * dy * w
+        _, self.mx, self.m2x = _merge_moments(n_a, self.mx, self.m2x, n_b, mx_b, m2x_b)
+        _, self.my, self.m2y = _merge_moments(n_a, self.my, self.m2y, n_b, my_b, m2y_b)
+        self.n = n
+
+    def merge(self, other):
+        self._merge(other.n, other.mx, other.my, other.m2x, other.m2y, other.cxy)
+        return self
+
+    def corr(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.cxy / np.sqrt(self.m2x * self.m2y)
+
+
+def summarize(fields, reference=None, block_size=BLOCK_SIZE, time_name='valid_time', exact=False,
+              extra=None):
+    # One pass over aligned (time, lat, lon) DataArrays {label: da}.
+    # Returns {label: StatsAccumulator} and {label: CoMomentAccumulator vs reference}.
+    # extra: optional {label: accumulator with add(block)} fed from the same blocks,
+    # e.g. spatial_diagnostics.CorrelationAccumulator, so no second read is needed.
+    extra = extra or {}
+    labels = list(fields)
+    n_steps = min(fields[label].sizes[time_name] for label in labels)
+    cell_shape = fields[labels[0]].transpose(time_name, ...).shape[1:]
+    stats = {label: StatsAccumulator(cell_shape, exact=exact) for label in labels}
+    comoments = {label: CoMomentAccumulator(cell_shape) for label in labels
+                 if reference is not None and label != reference}
+
+    for start in range(0, n_steps, block_size):
+        stop = min(start + block_size, n_steps)
+        blocks = {}
+        for label in labels:
+            block = fields[label].transpose(time_name, ...).isel({time_name: slice(start, stop)})
+            blocks[label] = block.values
+            stats[label].add(blocks[label], block[time_name].values)
+            if label in extra:
+                extra[label].add(blocks[label])
+        for label, acc in comoments.items():
+            acc.add(blocks[label], blocks[reference])
+    return stats, comoments
+
+
+def summary_path(dataset_path):
+    return os.path.splitext(dataset_path.rstrip('/'))[0] + SUMMARY_SUFFIX
+
+
+def save_summary(path, stats, comoment=None, source=None):
+    arrays = stats.to_dict()
+    arrays['version'] = SUMMARY_VERSION
+    if comoment is not None:
+        arrays['corr_with_reference'] = comoment.corr()
+    if source is not None:
+        arrays['source_fingerprint'] = np.array(storage.file_fingerprint(source))
+    np.savez_compressed(path, **arrays)
+    print(f"Saved {path}")
+
+
+def load_summary(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def summary_is_current(dataset_path):
+    path = summary_path(dataset_path)
+    if not os.path.exists(path):
+        return False
+    with np.load(path) as data:
+        if 'source_fingerprint' not in data.files or 'version' not in data.files:
+            return False
+        if int(data['version']) != SUMMARY_VERSION:
+            return False
+        return list(data['source_fingerprint']) == list(storage.file_fingerprint(dataset_path))
+
+
+def load_or_build(dataset_path, var_name, block_size=BLOCK_SIZE, exact=False):
+    # Summary of one dataset variable; streamed and saved only if missing or stale.
+    # exact=True streams again with an exact quantile store and does not save it.
+    path = summary_path(dataset_path)
+    if exact:
+        print(f"Streaming exact statistics for {dataset_path}...")
+        da = storage.open_dataset(dataset_path)[var_name]
+        stats, _ = summarize({var_name: da}, block_size=block_size, exact=True)
+        return stats[var_name].to_dict()
+    if not summary_is_current(dataset_path):
+        print(f"Streaming statistics for {dataset_path}...")
+        da = storage.open_dataset(dataset_path)[var_name]
+        stats, _ = summarize({var_name: da}, block_size=block_size)
+        save_summary(path, stats[var_name], source=dataset_path)
+    return load_summary(path)
+
+
+# --- Derived quantities from a loaded summary ---
+
+def hour_of_day_mean(summary):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return summary['hour_sum'] / summary['hour_count']
+
+
+def histogram_density(summary):
+    widths = np.diff(summary['edges'])
+    total = summary['hist'].sum()
+    return summary['edges'], summary['hist'] / (total * widths) if total else summary['hist'] * 0.0
+
+
+def histogram_quantiles(summary, quantiles):
+    # Quantiles from the fixed-bin CDF (linear within bins; accurate to the bin width)
+    counts = summary['hist'].astype('float64')
+    edges = summary['edges']
+    cdf = np.concatenate([[0.0], np.cumsum(counts)]) / max(counts.sum(), 1)
+    return np.interp(quantiles, cdf, edges)
+
+
+def sketch_quantiles(summary, quantiles):
+    # Quantiles from the persisted KLL sketch (exact if the summary was built with exact=True)
+    return QuantileSketch.from_arrays(summary).quantile(quantiles)
+
+
+def domain_mean(summary):
+    n = summary['n'].sum()
+    return float((summary['n'] * summary['mean']).sum() / n) if n else float('nan')
+
+
+DATASETS = {
+    'historical': ('era5_clean', 'temp_hourly'),
+    'future': ('era5_future_hourly', 'temp_future'),
+    'coherent': ('era5_spatially_coherent', 'temp_coherent'),
+}
+
+
+def build_summaries(block_size=BLOCK_SIZE, force=False):
+    # One joint pass over all available pipeline outputs; co-moments against ERA5
+    fields, paths = {}, {}
+    for label, (name, var) in DATASETS.items():
+        path = storage.artifact_path(name)
+        if os.path.exists(path):
+            fields[label] = storage.open_dataset(path)[var]
+            paths[label] = path
+    if not force and all(summary_is_current(p) for p in paths.values()):
+        print("Summaries are up to date.")
+        return {label: summary_path(p) for label, p in paths.items()}
+
+    print(f"Streaming statistics over {', '.join(fields)} ({block_size} steps per block)...")
+    reference = 'historical' if 'historical' in fields else None
+    stats, comoments = summarize(fields, reference, block_size)
+    out = {}
+    for label, path in paths.items():
+        out[label] = summary_path(path)
+        save_summary(out[label], stats[label], comoments.get(label), source=path)
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='One-pass streaming statistics of the pipeline outputs.')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                        help=f'Time steps per read (default: {BLOCK_SIZE}).')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the summaries are current.')
+    args = parser.parse_args()
+    build_summaries(block_size=args.block_size, force=args.force)
@@ -0,0 +1,111 @@
+import argparse
+import numpy as np
+import xarray as xr
+
+import storage
+
+# Time-resolved Taylor statistics: the spatial-pattern standard deviation, centered RMS
+# difference and correlation of each field against the reference, at every time step.
+#
+# Each block of time steps is a (T_block, S) matrix. All three statistics come from
+# row-wise sums over the cells, so one block needs a few array passes and no Python
+# loop over time. A cell counts in a row only where every field is valid (the same
+# joint mask as the single-snapshot diagram).
+#
+# Pooled values for a single Taylor diagram average the per-step variances and
+# covariances, so crmsd^2 = s_ref^2 + s^2 - 2 s_ref s R still holds for the pooled point.
+
+BLOCK_SIZE = 744           # ~one month of hourly steps per read
+SEASONS = ('DJF', 'MAM', 'JJA', 'SON')
+
+
+def pattern_stats(ref, fields):
+    # ref: (T, S); fields: {label: (T, S)}. Per-row population std, centered RMSD, corr.
+    valid = ~np.isnan(ref)
+    for values in fields.values():
+        valid &= ~np.isnan(values)
+    n = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        def anomalies(values):
+            filled = np.where(valid, values, 0.0)
+            return np.where(valid, filled - (filled.sum(axis=1) / n)[:, np.newaxis], 0.0)
+
+        ref_anom = anomalies(ref)
+        var_ref = (ref_anom ** 2).sum(axis=1) / n
+        out = {'sdev_ref': np.sqrt(var_ref), 'n_cells': n}
+        for label, values in fields.items():
+            anom = anomalies(values)
+            var = (anom ** 2).sum(axis=1) / n
+            cov = (anom * ref_anom).sum(axis=1) / n
+            out[f'sdev_{label}'] = np.sqrt(var)
+            out[f'crmsd_{label}'] = np.sqrt(np.maximum(var_ref + var - 2 * cov, 0))
+            out[f'corr_{label}'] = cov / np.sqrt(var_ref * var)
+    return out
+
+
+def taylor_time_series(ref_da, fields, block_size=BLOCK_SIZE, time_name='valid_time'):
+    # Per-time-step statistics of {label: DataArray} against ref_da, streamed in blocks.
+    # Returns a Dataset of 1D variables along time_name.
+    ref_da = ref_da.transpose(time_name, ...)
+    fields = {label: da.transpose(time_name, ...) for label, da in fields.items()}
+    n_steps = min([ref_da.sizes[time_name]] + [da.sizes[time_name] for da in fields.values()])
+
+    blocks = []
+    for start in range(0, n_steps, block_size):
+        window = {time_name: slice(start, min(start + block_size, n_steps))}
+        ref = ref_da.isel(window).values
+        rows = ref.shape[0]
+        blocks.append(pattern_stats(ref.reshape(rows, -1).astype('float64'),
+                                    {label: da.isel(window).values.reshape(rows, -1).astype('float64')
+                                     for label, da in fields.items()}))
+
+    data = {key: (time_name, np.concatenate([b[key] for b in blocks])) for key in blocks[0]}
+    return xr.Dataset(data, coords={time_name: ref_da[time_name].values[:n_steps]})
+
+
+def pooled(ds_stats, labels):
+    # One Taylor point per field: mean variances / covariances over all time steps
+    var_ref = float(np.nanmean(ds_stats['sdev_ref'].values ** 2))
+    out = {'sdev_ref': np.sqrt(var_ref)}
+    for label in labels:
+        var_t = ds_stats[f'sdev_{label}'].values ** 2
+        # Covariance back from the law of cosines (defined even where corr is not)
+        cov_t = (ds_stats['sdev_ref'].values ** 2 + var_t - ds_stats[f'crmsd_{label}'].values ** 2) / 2
+        var = float(np.nanmean(var_t))
+        cov = float(np.nanmean(cov_t))
+        out[f'sdev_{label}'] = np.sqrt(var)
+        out[f'corr_{label}'] = cov / np.sqrt(var_ref * var)
+        out[f'crmsd_{label}'] = np.sqrt(max(var_ref + var - 2 * cov, 0.0))
+    return out
+
+
+def seasonal_hourly(ds_stats, time_name='valid_time'):
+    # Means of every statistic by (season, hour of day); the series are 1D, so this is cheap
+    season = ds_stats[f'{time_name}.season']
+    hour = ds_stats[f'{time_name}.hour']
+    key = xr.DataArray([SEASONS.index(s) * 24 + h for s, h in zip(season.values, hour.values)],
+                       dims=time_name, name='season_hour')
+    means = ds_stats.groupby(key).mean()
+    means = means.reindex(season_hour=np.arange(len(SEASONS) * 24))
+    index = np.arange(len(SEASONS) * 24)
+    return means.assign_coords(season=('season_hour', [SEASONS[i // 24] for i in index]),
+                               hour=('season_hour', index % 24))
+
+
+def run_taylor_stats(block_size=BLOCK_SIZE, output='taylor_stats.nc'):
+    ref = storage.open_dataset(storage.artifact_path('era5_clean'))['temp_hourly']
+    fields = {'before': storage.open_dataset(storage.artifact_path('era5_future_hourly'))['temp_future'],
+              'after': storage.open_dataset(storage.artifact_path('era5_spatially_coherent'))['temp_coherent']}
+    ds_stats = taylor_time_series(ref, fields, block_size)
+    ds_stats.to_netcdf(output)
+    print(f"Saved {output} ({ds_stats.sizes['valid_time']} time steps)")
+    return ds_stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-time-step Taylor statistics of the pipeline outputs.')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                        help=f'Time steps per read (default: {BLOCK_SIZE}).')
+    parser.add_argument('--output', default='taylor_stats.nc', help='Output NetCDF file.')
+    args = parser.parse_args()
+    run_taylor_stats(args.block_size, args.output)
@@ -1,15 +1,20 @@
 import xarray as xr
 import matplotlib.pyplot as plt
-import scipy.stats as stats
 import numpy as np
 
-def validate_and_break():
+import storage
+from spatial_diagnostics import (CorrelationAccumulator, distance_matrix, correlation_vs_distance,
+                                 coherence_error, plot_correlation_vs_distance)
+from stream_stats import summarize, histogram_density, domain_mean
+
+def validate_and_break(ds_hist=None, ds_fut=None):
     print("Starting Validation & Break Analysis...")
 
-    # Load Data
-    print("Loading datasets...")
-    ds_hist = xr.open_dataset('era5_clean.nc', engine='netcdf4')
-    ds_fut = xr.open_dataset('era5_future_hourly.nc', engine='netcdf4')
+    # Load Data (unless the datasets are handed over in memory)
+    if ds_hist is None or ds_fut is None:
+        print("Loading datasets...")
+        ds_hist = storage.open_dataset(storage.artifact_path('era5_clean'))
+        ds_fut = storage.open_dataset(storage.artifact_path('era5_future_hourly'))
 
     # Ensure consistent variable names/access
     var_hist = 'temp_hourly'
@@ -18,23 +23,32 @@ def validate_and_break():
     # --- PART 1: The Sanity Check (Did it warm?) ---
     print("\n--- Part 1: Warming Check ---")
     
-    # Select first location (lat=0, lon=0 in the array)
-    # We assume dims are (time, lat, lon) or similar
-    t_hist_loc0 = ds_hist[var_hist].isel(latitude=0, longitude=0).values.flatten()
-    t_fut_loc0 = ds_fut[var_fut].isel(latitude=0, longitude=0).values.flatten()
-    
-    # Remove NaNs if any
-    t_hist_loc0 = t_hist_loc0[~np.isnan(t_hist_loc0)]
-    t_fut_loc0 = t_fut_loc0[~np.isnan(t_fut_loc0)]
-    
+    # Whole domain in one streamed pass (see stream_stats.py) instead of one cell.
+    # The same blocks also feed the S x S correlation matrices used in Part 2.
+    n_cells = ds_hist.sizes['latitude'] * ds_hist.sizes['longitude']
+    correlations = {'historical': CorrelationAccumulator(n_cells), 'future': CorrelationAccumulator(n_cells)}
+    stats, comoments = summarize({'historical': ds_hist[var_hist], 'future': ds_fut[var_fut]},
+                                 reference='historical', extra=correlations)
+    summary_hist = stats['historical'].to_dict()
+    summary_fut = stats['future'].to_dict()
+
+    edges, density_hist = histogram_density(summary_hist)
+    _, density_fut = histogram_density(summary_fut)
+    lo, hi = (min(summary_hist['vmin'], summary_fut['vmin']), max(summary_hist['vmax'], summary_fut['vmax']))
+    centres = (edges[:-1] + edges[1:]) / 2
+    shown = (centres >= lo) & (centres <= hi)
+
     plt.figure(figsize=(10, 6))
-    plt.hist(t_hist_loc0, bins=50, alpha=0.5, label='Historical (ERA5)', color='blue', density=True)
-    plt.hist(t_fut_loc0, bins=50, alpha=0.5, label='Future (MQDM)', color='red', density=True)
-    
-    mean_hist = np.mean(t_hist_loc0)
-    mean_fut = np.mean(t_fut_loc0)
-    
-    plt.title(f"Temperature Distribution Shift (Loc 0,0)\nMean Hist: {mean_hist:.2f}C, Mean Fut: {mean_fut:.2f}C")
+    plt.fill_between(centres[shown], density_hist[shown], step='mid', alpha=0.5, label='Historical (ERA5)', color='blue')
+    plt.fill_between(centres[shown], density_fut[shown], step='mid', alpha=0.5, label='Future (MQDM)', color='red')
+
+    mean_hist = domain_mean(summary_hist)
+    mean_fut = domain_mean(summary_fut)
+    corr = comoments['future'].corr()
+    print(f"Mean Hist: {mean_hist:.2f}C, Mean Fut: {mean_fut:.2f}C, "
+          f"median per-cell correlation with ERA5: {np.nanmedian(corr):.4f}")
+
+    plt.title(f"Temperature Distribution Shift (all cells)\nMean Hist: {mean_hist:.2f}C, Mean Fut: {mean_fut:.2f}C")
     plt.xlabel("Temperature (Celsius)")
     plt.ylabel("Density")
     plt.legend()
@@ -47,65 +61,30 @@ def validate_and_break():
     # --- PART 2: The "Break" Analysis (Spatial Coherence) ---
     print("\n--- Part 2: Spatial Coherence Analysis ---")
     
-    # Select Loc A and Loc B (Neighbors)
-    # Using isel for indices 0 and 1
-    # Check if we have enough neighbors
-    if ds_hist.dims['longitude'] < 2:
-        print("Error: Not enough longitude points for spatial analysis.")
+    # All cell pairs instead of one neighbour pair: full S x S correlation matrices,
+    # accumulated during the Part 1 pass (see spatial_diagnostics.py)
+    if n_cells < 2:
+        print("Error: Not enough grid points for spatial analysis.")
         return
 
-    # Extract time series
-    # Historical
-    ts_hist_A = ds_hist[var_hist].isel(latitude=0, longitude=0).values.flatten()
-    ts_hist_B = ds_hist[var_hist].isel(latitude=0, longitude=1).values.flatten()
-    
-    # Future
-    ts_fut_A = ds_fut[var_fut].isel(latitude=0, longitude=0).values.flatten()
-    ts_fut_B = ds_fut[var_fut].isel(latitude=0, longitude=1).values.flatten()
-    
-    # Filter common NaNs
-    valid_hist = (~np.isnan(ts_hist_A)) & (~np.isnan(ts_hist_B))
-    ts_hist_A = ts_hist_A[valid_hist]
-    ts_hist_B = ts_hist_B[valid_hist]
-    
-    valid_fut = (~np.isnan(ts_fut_A)) & (~np.isnan(ts_fut_B))
-    ts_fut_A = ts_fut_A[valid_fut]
-    ts_fut_B = ts_fut_B[valid_fut]
+    corr_hist = correlations['historical'].corr()
+    corr_fut = correlations['future'].corr()
+    distances = distance_matrix(ds_hist['latitude'].values, ds_hist['longitude'].values)
 
-    # Calculate Correlations
-    r_hist, _ = stats.pearsonr(ts_hist_A, ts_hist_B)
-    r_fut, _ = stats.pearsonr(ts_fut_A, ts_fut_B)
-    
-    print(f"Historical Correlation (Loc A vs B): {r_hist:.4f}")
-    print(f"Future Correlation     (Loc A vs B): {r_fut:.4f}")
-    
-    # Scatter Plot
-    plt.figure(figsize=(8, 8))
-    
-    # Plot Hist
-    plt.scatter(ts_hist_A, ts_hist_B, 
-                color='blue', alpha=0.3, s=10, 
-                label=f'Historical (R={r_hist:.3f})')
-                
-    # Plot Future
-    plt.scatter(ts_fut_A, ts_fut_B, 
-                color='red', alpha=0.3, s=10, 
-                label=f'Future (R={r_fut:.3f})')
-    
-    # 1:1 Line for reference
-    min_val = min(np.min(ts_hist_A), np.min(ts_fut_A))
-    max_val = max(np.max(ts_hist_A), np.max(ts_fut_A))
-    plt.plot([min_val, max_val], [min_val, max_val], 'k--', alpha=0.5, label='1:1 Line')
-    
-    plt.title("Spatial Coherence: Loc A vs Loc B\n(Loss of correlation indicates broken structure)")
-    plt.xlabel("Temperature at Loc A (C)")
-    plt.ylabel("Temperature at Loc B (C)")
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    
-    plt.savefig('spatial_break_analysis.png')
-    print("Saved spatial_break_analysis.png")
-    plt.close()
+    centres, curve_hist = correlation_vs_distance(corr_hist, distances)
+    _, curve_fut = correlation_vs_distance(corr_fut, distances)
+    error = coherence_error(corr_hist, corr_fut)
+
+    upper = np.triu_indices(n_cells, k=1)
+    print(f"Historical mean correlation (all {upper[0].size} pairs): {np.nanmean(corr_hist[upper]):.4f}")
+    print(f"Future mean correlation     (all {upper[0].size} pairs): {np.nanmean(corr_fut[upper]):.4f}")
+    print(f"Correlation RMSE vs historical: {error['rmse']:.4f} (max abs {error['max_abs']:.4f})")
+    
+    plot_correlation_vs_distance(
+        centres, {'historical': curve_hist, 'broken': curve_fut}, 'spatial_break_analysis.png',
+        title=f"Spatial Coherence: all cell pairs\n(Loss of correlation indicates broken structure, "
+              f"RMSE = {error['rmse']:.4f})")
+    return error
 
 if __name__ == "__main__":
     validate_and_break()
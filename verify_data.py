@@ -1,35 +1,171 @@
 import os
+import re
 import glob
-import xarray as xr
+import json
+import calendar
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import netCDF4
 
 # Define path to data
 DATA_DIR = "data/raw"
+FILE_PATTERN = "era5_2m_temperature_*.nc"
+REPORT_FILE = "verify_report.json"
+CACHE_FILE = ".verify_cache.json"
+
+VARIABLE = 't2m'
+TIME_NAMES = ['valid_time', 'time']
+LAT_NAMES = ['latitude', 'lat']
+LON_NAMES = ['longitude', 'lon']
+
+def _first_present(variables, names):
+    for name in names:
+        if name in variables:
+            return name
+    return None
+
+def expected_hours(filename):
+    # era5_2m_temperature_YYYY_MM.nc -> (first hour, number of hours in that month)
+    match = re.search(r'_(\d{4})_(\d{2})\.nc$', filename)
+    if not match:
+        return None, None
+    year, month = int(match.group(1)), int(match.group(2))
+    n_days = calendar.monthrange(year, month)[1]
+    return np.datetime64(f"{year:04d}-{month:02d}-01T00:00", 'h'), n_days * 24
+
+def scan_file(path):
+    # Header + coordinate checks only; the data variable itself is never read.
+    result = {'file': os.path.basename(path), 'errors': []}
+    try:
+        with netCDF4.Dataset(path) as nc:
+            variables = nc.variables
+
+            if VARIABLE not in variables:
+                result['errors'].append(f"variable '{VARIABLE}' missing")
+
+            # Grid: keep a fingerprint so consistency can be checked (and cached) per file
+            lat_name = _first_present(variables, LAT_NAMES)
+            lon_name = _first_present(variables, LON_NAMES)
+            if lat_name is None or lon_name is None:
+                result['errors'].append("latitude/longitude coordinates missing")
+            else:
+                lat = np.asarray(variables[lat_name][:], dtype='float64')
+                lon = np.asarray(variables[lon_name][:], dtype='float64')
+                result['grid_shape'] = [int(lat.size), int(lon.size)]
+                result['grid_hash'] = hashlib.sha1(lat.tobytes() + lon.tobytes()).hexdigest()
+
+            # Time axis: hour count, start, and missing hours
+            time_name = _first_present(variables, TIME_NAMES)
+            if time_name is None:
+                result['errors'].append("time coordinate missing")
+            else:
+                time_var = variables[time_name]
+                dates = netCDF4.num2date(time_var[:], time_var.units,
+                                         calendar=getattr(time_var, 'calendar', 'standard'),
+                                         only_use_cftime_datetimes=False,
+                                         only_use_python_datetimes=True)
+                times = np.array(dates, dtype='datetime64[h]')
+                result['n_times'] = int(times.size)
 
-def verify_data():
+                start, n_expected = expected_hours(result['file'])
+                if n_expected is not None:
+                    result['expected_times'] = n_expected
+                    expected = start + np.arange(n_expected).astype('timedelta64[h]')
+                    missing = np.setdiff1d(expected, times)
+                    result['missing_hours'] = int(missing.size)
+                    if times.size != n_expected:
+                        result['errors'].append(f"expected {n_expected} hours, found {times.size}")
+                    if missing.size:
+                        result['errors'].append(f"{missing.size} missing hours (first: {missing[0]})")
+                if times.size > 1 and np.any(np.diff(times) <= np.timedelta64(0, 'h')):
+                    result['errors'].append("time axis not strictly increasing")
+    except Exception as e:
+        result['errors'].append(f"unreadable: {e}")
+    return result
+
+def _load_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(cache_path, cache):
+    tmp_path = cache_path + '.part'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+def verify_data(workers=None, use_cache=True):
     if not os.path.exists(DATA_DIR):
         print(f"Error: Directory {DATA_DIR} does not exist.")
         return
 
-    files = sorted(glob.glob(os.path.join(DATA_DIR, "*.nc")))
+    files = sorted(glob.glob(os.path.join(DATA_DIR, FILE_PATTERN)))
     print(f"Found {len(files)} files in {DATA_DIR}")
 
     if len(files) == 0:
         print("No .nc files found!")
         return
 
-    valid_count = 0
+    # Results are cached by file mtime/size, so unchanged files are not reopened
+    cache_path = os.path.join(DATA_DIR, CACHE_FILE)
+    cache = _load_cache(cache_path) if use_cache else {}
+
+    results = {}
+    to_scan = []
     for f in files:
-        try:
-            ds = xr.open_dataset(f)
-            # Basic check: Access "2m_temperature"
-            _ = ds['t2m']
-            ds.close()
-            valid_count += 1
-            # print(f"Valid: {os.path.basename(f)}")
-        except Exception as e:
-            print(f"INVALID: {os.path.basename(f)} - {e}")
+        stat = os.stat(f)
+        key = os.path.basename(f)
+        entry = cache.get(key)
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            results[key] = entry['result']
+        else:
+            to_scan.append(f)
+
+    print(f"{len(results)} cached, scanning {len(to_scan)} files...")
+    if to_scan:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for f, result in zip(to_scan, pool.map(scan_file, to_scan, chunksize=8)):
+                stat = os.stat(f)
+                results[result['file']] = result
+                cache[result['file']] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'result': result}
+        _save_cache(cache_path, cache)
+
+    # Grid consistency with the first readable file (not cached: depends on the file set)
+    ordered = [results[os.path.basename(f)] for f in files]
+    reference = next((r for r in ordered if 'grid_hash' in r), None)
+    report = []
+    for r in ordered:
+        r = dict(r, errors=list(r['errors']))
+        if reference is not None and 'grid_hash' in r and r['grid_hash'] != reference['grid_hash']:
+            r['errors'].append(f"grid differs from {reference['file']} "
+                               f"({r['grid_shape']} vs {reference['grid_shape']})")
+        r['valid'] = not r['errors']
+        report.append(r)
+
+    for r in report:
+        if not r['valid']:
+            print(f"INVALID: {r['file']} - {'; '.join(r['errors'])}")
+
+    valid_count = sum(r['valid'] for r in report)
+    report_path = os.path.join(DATA_DIR, REPORT_FILE)
+    with open(report_path, 'w') as f:
+        json.dump({'valid': valid_count, 'total': len(report), 'files': report}, f, indent=2)
 
     print(f"\nVerification Complete: {valid_count}/{len(files)} files are valid.")
+    print(f"Report written to {report_path}")
 
 if __name__ == "__main__":
-    verify_data()
+    parser = argparse.ArgumentParser(description='Parallel header-only integrity check of the ERA5 monthly files.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of scanner processes (default: number of CPUs).')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore cached results and rescan every file.')
+    args = parser.parse_args()
+    verify_data(workers=args.workers, use_cache=not args.no_cache)